@@ -1,7 +1,8 @@
 """Custom actions"""
 from typing import Dict, Text, Any, List
+from datetime import datetime
+import itertools
 import logging
-from dateutil import parser
 from rasa_sdk.interfaces import Action
 from rasa_sdk.events import (
     SlotSet,
@@ -20,11 +21,15 @@ from actions.parsing import (
     parse_duckling_time,
     get_entity_details,
     parse_duckling_currency,
+    parse_time,
+    GRAIN_FORMATS,
 )
-from actions.profile import create_mock_profile
-from actions.api.store import Store
+from actions.ledger import ledger, get_account, requires_account, LEDGER_SLOT
+from actions.transactions import format_cents, to_cents
+from actions.recipients import PARTIAL
 
 from actions.custom_forms import CustomFormValidationAction
+from actions.instrumentation import instrumented
 
 logger = logging.getLogger(__name__)
 
@@ -35,6 +40,10 @@ NEXT_FORM_NAME = {
     "check_earnings": "transaction_search_form",
 }
 
+# the transaction search that action_show_transactions lists, and its position
+TRANSACTION_CURSOR_SLOT = "transaction_cursor"
+TRANSACTIONS_PAGE_SIZE = 5
+
 FORM_DESCRIPTION = {
     "cc_payment_form": "credit card payment",
     "transfer_money_form": "money transfer",
@@ -46,6 +55,52 @@ anonymous_profile = {
     "name": "anonymous"
 }
 
+# Slots of the user's profile, these are always carried over to a new session
+PROFILE_SLOTS = [
+    "user_profile",
+    "user_name",
+    LEDGER_SLOT,
+    "currency",
+    "known_recipients",
+    "vendor_list",
+]
+
+
+def reset_slots(tracker: Tracker, slots: Dict[Text, Any]) -> List[EventType]:
+    """Returns `SlotSet` events for the slots that do not have their value yet.
+
+    Slots that are already set to the value are left out, so that the events
+    only carry what changed.
+    """
+    return [
+        SlotSet(slot, value)
+        for slot, value in slots.items()
+        if tracker.get_slot(slot) != value
+    ]
+
+
+def carry_over_slots(tracker: Tracker, domain: Dict[Text, Any]) -> List[EventType]:
+    """Returns `SlotSet` events for the slots to carry over to a new session.
+
+    The profile slots are always carried over, the other slots only if
+    `carry_over_slots_to_new_session` is enabled in the domain. A new session
+    resets every slot to its initial value, so slots that still have their
+    initial value are skipped.
+    """
+    session_config = domain.get("session_config", {})
+    carry_over_all = session_config.get("carry_over_slots_to_new_session", True)
+    domain_slots = domain.get("slots", {})
+
+    slots = []
+    for key, value in tracker.current_slot_values().items():
+        if not carry_over_all and key not in PROFILE_SLOTS:
+            continue
+        if value == domain_slots.get(key, {}).get("initial_value"):
+            continue
+        slots.append(SlotSet(key=key, value=value))
+    return slots
+
+
 def get_user_id_from_event(tracker: Tracker) -> Text:
     """Pulls "session_started" event, if available, and 
        returns the userId from the channel's metadata.
@@ -61,27 +116,23 @@ def get_user_id_from_event(tracker: Tracker) -> Text:
 
     return anonymous_profile.get("id")
 
+@instrumented
 class ActionSessionStart(Action):
     def name(self) -> Text:
         return "action_session_start"
 
     @staticmethod
-    async def fetch_slots(tracker: Tracker) -> List[EventType]:
+    async def fetch_slots(tracker: Tracker, domain: Dict[Text, Any]) -> List[EventType]:
         """Add user profile to the slots if it is not set."""
 
-        slots = []
-
-        # Start by copying all the existing slots
-        for key in tracker.current_slot_values().keys():
-            slots.append(SlotSet(key=key, value=tracker.get_slot(key)))
+        # Start by carrying over the slots that are set
+        slots = carry_over_slots(tracker, domain)
 
         user_channel = tracker.get_latest_input_channel()
         sender_id = tracker.sender_id
         user_profile = tracker.get_slot("user_profile")
         user_name = tracker.get_slot("user_name")
 
-        db = Store()
-
         if user_profile is None:
             id = get_user_id_from_event(tracker)
             if id == anonymous_profile.get("id"):
@@ -92,6 +143,28 @@ class ActionSessionStart(Action):
         if user_name is None:
             slots.append(SlotSet(key="user_name", value=user_profile.get("name")))
 
+        # The account itself is kept by the ledger, only its id goes in a slot
+        ledger_id = tracker.get_slot(LEDGER_SLOT)
+        if ledger_id is None:
+            user_id = get_user_id_from_event(tracker)
+            if user_id == anonymous_profile.get("id"):
+                user_id = sender_id
+            ledger_id = user_id
+            slots.append(SlotSet(key=LEDGER_SLOT, value=ledger_id))
+
+        if ledger_id in ledger:
+            account = ledger.account(ledger_id)
+        else:
+            # a new user, or the account was closed since the last session
+            account = ledger.open_account(ledger_id)
+        for key, value in [
+            ("currency", account.currency),
+            ("known_recipients", account.known_recipients),
+            ("vendor_list", account.vendor_list),
+        ]:
+            if tracker.get_slot(key) is None:
+                slots.append(SlotSet(key=key, value=value))
+
         return slots
 
          
@@ -107,7 +180,7 @@ class ActionSessionStart(Action):
 
         # any slots that should be carried over should come after the
         # `session_started` event
-        newEvents = await self.fetch_slots(tracker)
+        newEvents = await self.fetch_slots(tracker, domain)
         events.extend(newEvents)
 
         # an `action_listen` should be added at the end as a user message follows
@@ -115,6 +188,8 @@ class ActionSessionStart(Action):
 
         return events
 
+@instrumented
+@requires_account
 class ActionPayCC(Action):
     """Pay credit card."""
 
@@ -147,25 +222,19 @@ class ActionPayCC(Action):
         }
 
         if tracker.get_slot("confirm") == "yes":
-            account_balance = float(tracker.get_slot("account_balance"))
-            credit_card = tracker.get_slot("credit_card")
-            cc_balance = tracker.get_slot("credit_card_balance")
-            amount_of_money = float(tracker.get_slot("amount-of-money"))
-            amount_transferred = float(tracker.get_slot("amount_transferred"))
-
-            cc_balance[credit_card.lower()]["current balance"] -= amount_of_money
-            account_balance = account_balance - amount_of_money
+            get_account(tracker).pay_credit_card(
+                tracker.get_slot("credit_card"),
+                to_cents(tracker.get_slot("amount-of-money")),
+            )
             dispatcher.utter_message(template="utter_cc_pay_scheduled")
-
-            slots["amount_transferred"] = amount_transferred + amount_of_money
-            slots["account_balance"] = f"{account_balance:.2f}"
-            slots["credit_card_balance"] = cc_balance
         else:
             dispatcher.utter_message(template="utter_cc_pay_cancelled")
 
-        return [SlotSet(slot, value) for slot, value in slots.items()]
+        return reset_slots(tracker, slots)
 
 
+@instrumented
+@requires_account
 class ValidatePayCCForm(CustomFormValidationAction):
     """Validates Slots of the cc_payment_form"""
 
@@ -181,9 +250,7 @@ class ValidatePayCCForm(CustomFormValidationAction):
         domain: Dict[Text, Any],
     ) -> Dict[Text, Any]:
         """Validates value of 'amount-of-money' slot"""
-        credit_card = tracker.get_slot("credit_card")
-        cc_balance = tracker.get_slot("credit_card_balance")
-        account_balance = float(tracker.get_slot("account_balance"))
+        account = get_account(tracker)
         try:
             entity = get_entity_details(
                 tracker, "amount-of-money"
@@ -191,23 +258,23 @@ class ValidatePayCCForm(CustomFormValidationAction):
             amount_currency = parse_duckling_currency(entity)
             if not amount_currency:
                 raise TypeError
-            if account_balance < float(amount_currency.get("amount-of-money")):
+            if not account.can_pay(to_cents(amount_currency.get("amount-of-money"))):
                 dispatcher.utter_message(template="utter_insufficient_funds")
                 return {"amount-of-money": None}
             return amount_currency
         except (TypeError, AttributeError):
             pass
         # check if user asked to pay the full or the minimum balance
-        if value and value.lower() in cc_balance.get(credit_card.lower()):
-            key = value.lower()
-            amount = cc_balance.get(credit_card.lower()).get(key)
-            amount_type = f" (your {key})"
+        credit_card = account.credit_card(tracker.get_slot("credit_card"))
+        amount = credit_card.payment_amount(value) if credit_card and value else None
+        if amount is not None:
+            amount_type = f" (your {value.lower()})"
 
-            if account_balance < float(amount):
+            if not account.can_pay(amount):
                 dispatcher.utter_message(template="utter_insufficient_funds")
                 return {"amount-of-money": None}
             return {
-                "amount-of-money": f"{amount:.2f}",
+                "amount-of-money": format_cents(amount),
                 "payment_amount_type": amount_type,
                 "currency": "$",
             }
@@ -223,8 +290,7 @@ class ValidatePayCCForm(CustomFormValidationAction):
         domain: Dict[Text, Any],
     ) -> Dict[Text, Any]:
         """Validates value of 'credit_card' slot"""
-        cc_balance = tracker.get_slot("credit_card_balance")
-        if value and value.lower() in list(cc_balance.keys()):
+        if get_account(tracker).credit_card(value):
             return {"credit_card": value.title()}
 
         dispatcher.utter_message(template="utter_no_creditcard")
@@ -239,14 +305,12 @@ class ValidatePayCCForm(CustomFormValidationAction):
     ) -> Dict[Text, Any]:
         """Explains 'credit_card' slot"""
         dispatcher.utter_message("You have the following credits cards:")
-        credit_card_balance = tracker.get_slot("credit_card_balance")
-        for credit_card in credit_card_balance.keys():
-            current_balance = credit_card_balance[credit_card]["current balance"]
+        for credit_card in get_account(tracker).credit_cards.values():
             dispatcher.utter_message(
                 template="utter_credit_card_balance",
                 **{
-                    "credit_card": credit_card.title(),
-                    "amount-of-money": f"{current_balance:.2f}",
+                    "credit_card": credit_card.name.title(),
+                    "amount-of-money": format_cents(credit_card.current_balance),
                 },
             )
         return {}
@@ -280,6 +344,8 @@ class ValidatePayCCForm(CustomFormValidationAction):
         return {"confirm": None}
 
 
+@instrumented
+@requires_account
 class ActionTransactionSearch(Action):
     """Searches for a transaction"""
 
@@ -306,37 +372,40 @@ class ActionTransactionSearch(Action):
             "grain": None,
             "search_type": None,
             "vendor_name": None,
+            # a cancelled search must not leave the previous one to be shown
+            TRANSACTION_CURSOR_SLOT: None,
         }
 
         if tracker.get_slot("confirm") == "yes":
             search_type = tracker.get_slot("search_type")
-            transaction_history = tracker.get_slot("transaction_history")
-            transactions_subset = transaction_history.get(search_type, {})
             vendor_name = tracker.get_slot("vendor_name")
+            account = get_account(tracker)
+            vendor = vendor_name and (
+                account.vendors.resolve(vendor_name) or vendor_name
+            )
 
-            if vendor_name:
-                transactions = transactions_subset.get(vendor_name.lower())
-                vendor_name = f" with {vendor_name}"
-            else:
-                transactions = [
-                    v for k in list(transactions_subset.values()) for v in k
-                ]
-                vendor_name = ""
-
-            start_time = parser.isoparse(tracker.get_slot("start_time"))
-            end_time = parser.isoparse(tracker.get_slot("end_time"))
-
-            for i in range(len(transactions) - 1, -1, -1):
-                transaction = transactions[i]
-                transaction_date = parser.isoparse(transaction.get("date"))
+            numtransacts, total = account.transactions.search(
+                search_type,
+                tracker.get_slot("start_time"),
+                tracker.get_slot("end_time"),
+                vendor=vendor,
+            )
+            # action_show_transactions lists the transactions of this search
+            slots[TRANSACTION_CURSOR_SLOT] = {
+                "search_type": search_type,
+                "vendor": vendor,
+                "start_time": tracker.get_slot("start_time"),
+                "end_time": tracker.get_slot("end_time"),
+                "after": None,
+            }
+            buttons = []
+            if numtransacts:
+                buttons = [{"title": "Show them", "payload": "/show_transactions"}]
 
-                if transaction_date < start_time or transaction_date > end_time:
-                    transactions.pop(i)
+            vendor_name = f" with {vendor_name}" if vendor_name else ""
 
-            numtransacts = len(transactions)
-            total = sum([t.get("amount") for t in transactions])
             slotvars = {
-                "total": f"{total:.2f}",
+                "total": format_cents(total),
                 "numtransacts": numtransacts,
                 "start_time_formatted": tracker.get_slot("start_time_formatted"),
                 "end_time_formatted": tracker.get_slot("end_time_formatted"),
@@ -348,7 +417,9 @@ class ActionTransactionSearch(Action):
                 **slotvars,
             )
             dispatcher.utter_message(
-                template=f"utter_found_{search_type}_transactions", **slotvars
+                template=f"utter_found_{search_type}_transactions",
+                buttons=buttons,
+                **slotvars,
             )
         else:
             dispatcher.utter_message(template="utter_transaction_search_cancelled")
@@ -356,6 +427,70 @@ class ActionTransactionSearch(Action):
         return [SlotSet(slot, value) for slot, value in slots.items()]
 
 
+@instrumented
+@requires_account
+class ActionShowTransactions(Action):
+    """Lists the transactions of the last transaction search, a page at a time"""
+
+    def name(self) -> Text:
+        """Unique identifier of the action"""
+        return "action_show_transactions"
+
+    async def run(
+        self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any],
+    ) -> List[EventType]:
+        """Executes the action"""
+        cursor = tracker.get_slot(TRANSACTION_CURSOR_SLOT)
+        if not cursor:
+            dispatcher.utter_message(template="utter_no_transactions_to_show")
+            return []
+
+        # transactions are read lazily, only one more than a page is taken
+        transactions = get_account(tracker).transactions.iter_transactions(
+            cursor["search_type"],
+            cursor["start_time"],
+            cursor["end_time"],
+            vendor=cursor.get("vendor"),
+            after=cursor.get("after"),
+        )
+        page = list(itertools.islice(transactions, TRANSACTIONS_PAGE_SIZE + 1))
+        if not page:
+            dispatcher.utter_message(template="utter_no_transactions_to_show")
+            return [SlotSet(TRANSACTION_CURSOR_SLOT, None)]
+
+        has_more = len(page) > TRANSACTIONS_PAGE_SIZE
+        page = page[:TRANSACTIONS_PAGE_SIZE]
+        timezone = parse_time(cursor["start_time"], None).value.tzinfo
+        preposition = "at" if cursor["search_type"] == "spend" else "from"
+        currency = tracker.get_slot("currency") or "$"
+        lines = []
+        for transaction in page:
+            date = datetime.fromtimestamp(transaction.epoch, timezone)
+            lines.append(
+                f"- {date.strftime(GRAIN_FORMATS['day'])}: {currency}"
+                f"{format_cents(transaction.cents)} {preposition} "
+                f"{transaction.vendor.title()}"
+            )
+        formatted_transactions = "\n" + "\n".join(lines)
+
+        buttons = []
+        next_cursor = None
+        if has_more:
+            buttons = [{"title": "Show more", "payload": "/show_transactions"}]
+            next_cursor = {**cursor, "after": page[-1].cursor}
+        dispatcher.utter_message(
+            template="utter_transactions",
+            buttons=buttons,
+            formatted_transactions=formatted_transactions,
+        )
+        return [SlotSet(TRANSACTION_CURSOR_SLOT, next_cursor)]
+
+
+@instrumented
+@requires_account
 class ValidateTransactionSearchForm(CustomFormValidationAction):
     """Validates Slots of the transaction_search_form"""
 
@@ -399,8 +534,11 @@ class ValidateTransactionSearchForm(CustomFormValidationAction):
         domain: Dict[Text, Any],
     ) -> Dict[Text, Any]:
         """Validates value of 'vendor_name' slot"""
-        if value and value.lower() in tracker.get_slot("vendor_list"):
-            return {"vendor_name": value}
+        # Resolves aliases & misspellings to the vendor of the transactions
+        account = get_account(tracker)
+        vendor = account.vendors.resolve(value) if value else None
+        if vendor and account.transactions.has_vendor("spend", vendor):
+            return {"vendor_name": vendor.title()}
 
         dispatcher.utter_message(template="utter_no_vendor_name")
         return {"vendor_name": None}
@@ -422,6 +560,8 @@ class ValidateTransactionSearchForm(CustomFormValidationAction):
         return parsedinterval
 
 
+@instrumented
+@requires_account
 class ActionTransferMoney(Action):
     """Transfers Money."""
 
@@ -442,22 +582,20 @@ class ActionTransferMoney(Action):
         }
 
         if tracker.get_slot("confirm") == "yes":
-            amount_of_money = float(tracker.get_slot("amount-of-money"))
-            account_balance = float(tracker.get_slot("account_balance"))
-
-            updated_account_balance = account_balance - amount_of_money
+            get_account(tracker).transfer(
+                to_cents(tracker.get_slot("amount-of-money")),
+                recipient=tracker.get_slot("PERSON"),
+            )
 
             dispatcher.utter_message(template="utter_transfer_complete")
-
-            amount_transferred = float(tracker.get_slot("amount_transferred"))
-            slots["amount_transferred"] = amount_transferred + amount_of_money
-            slots["account_balance"] = f"{updated_account_balance:.2f}"
         else:
             dispatcher.utter_message(template="utter_transfer_cancelled")
 
-        return [SlotSet(slot, value) for slot, value in slots.items()]
+        return reset_slots(tracker, slots)
 
 
+@instrumented
+@requires_account
 class ValidateTransferMoneyForm(CustomFormValidationAction):
     """Validates Slots of the transfer_money_form"""
 
@@ -478,16 +616,23 @@ class ValidateTransferMoneyForm(CustomFormValidationAction):
         if isinstance(value, list):
             value = value[0]
 
-        name = value.title() if value else None
-        known_recipients = tracker.get_slot("known_recipients")
-        first_names = [name.split()[0] for name in known_recipients]
-        if name in known_recipients:
-            return {"PERSON": name}
+        matches = get_account(tracker).recipients.lookup(value) if value else []
+        if len(matches) == 1 and matches[0].rank != PARTIAL:
+            return {"PERSON": matches[0].recipient}
 
-        if name in first_names:
-            index = first_names.index(name)
-            fullname = known_recipients[index]
-            return {"PERSON": fullname}
+        if matches:
+            # Let the user pick one of the recipients with a similar name
+            buttons = [
+                {
+                    "title": match.recipient,
+                    "payload": f'/inform{{"PERSON":"{match.recipient}"}}',
+                }
+                for match in matches
+            ]
+            dispatcher.utter_message(
+                template="utter_ambiguous_recipient", buttons=buttons, PERSON=value
+            )
+            return {"PERSON": None}
 
         dispatcher.utter_message(template="utter_unknown_recipient", PERSON=value)
         return {"PERSON": None}
@@ -518,7 +663,7 @@ class ValidateTransferMoneyForm(CustomFormValidationAction):
         domain: Dict[Text, Any],
     ) -> Dict[Text, Any]:
         """Validates value of 'amount-of-money' slot"""
-        account_balance = float(tracker.get_slot("account_balance"))
+        account = get_account(tracker)
         try:
             entity = get_entity_details(
                 tracker, "amount-of-money"
@@ -526,7 +671,7 @@ class ValidateTransferMoneyForm(CustomFormValidationAction):
             amount_currency = parse_duckling_currency(entity)
             if not amount_currency:
                 raise TypeError
-            if account_balance < float(amount_currency.get("amount-of-money")):
+            if not account.can_pay(to_cents(amount_currency.get("amount-of-money"))):
                 dispatcher.utter_message(template="utter_insufficient_funds")
                 return {"amount-of-money": None}
             return amount_currency
@@ -548,6 +693,8 @@ class ValidateTransferMoneyForm(CustomFormValidationAction):
         return {"confirm": None}
 
 
+@instrumented
+@requires_account
 class ActionShowBalance(Action):
     """Shows the balance of bank or credit card accounts"""
 
@@ -560,51 +707,37 @@ class ActionShowBalance(Action):
     ) -> List[EventType]:
         """Executes the custom action"""
         account_type = tracker.get_slot("account_type")
+        account = get_account(tracker)
 
         if account_type == "credit":
             # show credit card balance
-            credit_card_balance = tracker.get_slot("credit_card_balance")
-            credit_card = tracker.get_slot("credit_card")
-
-            if credit_card and credit_card.lower() in credit_card_balance:
-                current_balance = credit_card_balance[credit_card.lower()][
-                    "current balance"
-                ]
+            credit_card = account.credit_card(tracker.get_slot("credit_card"))
+            if credit_card:
+                credit_cards = [credit_card]
+            else:
+                credit_cards = account.credit_cards.values()
+            for credit_card in credit_cards:
                 dispatcher.utter_message(
                     template="utter_credit_card_balance",
                     **{
-                        "credit_card": credit_card.title(),
-                        "amount-of-money": f"{current_balance:.2f}",
+                        "credit_card": credit_card.name.title(),
+                        "amount-of-money": format_cents(credit_card.current_balance),
                     },
                 )
-            else:
-                for credit_card in credit_card_balance.keys():
-                    current_balance = credit_card_balance[credit_card][
-                        "current balance"
-                    ]
-                    dispatcher.utter_message(
-                        template="utter_credit_card_balance",
-                        **{
-                            "credit_card": credit_card.title(),
-                            "amount-of-money": f"{current_balance:.2f}",
-                        },
-                    )
         else:
             # show bank account balance
-            account_balance = float(tracker.get_slot("account_balance"))
-            amount = tracker.get_slot("amount_transferred")
-            if amount:
-                amount = float(tracker.get_slot("amount_transferred"))
-                init_account_balance = account_balance + amount
+            if account.transferred:
                 dispatcher.utter_message(
                     template="utter_changed_account_balance",
-                    init_account_balance=f"{init_account_balance:.2f}",
-                    account_balance=f"{account_balance:.2f}",
+                    init_account_balance=format_cents(
+                        account.balance + account.transferred
+                    ),
+                    account_balance=format_cents(account.balance),
                 )
             else:
                 dispatcher.utter_message(
                     template="utter_account_balance",
-                    init_account_balance=f"{account_balance:.2f}",
+                    init_account_balance=format_cents(account.balance),
                 )
 
         events = []
@@ -620,6 +753,7 @@ class ActionShowBalance(Action):
         return events
 
 
+@instrumented
 class ActionShowRecipients(Action):
     """Lists the contents of then known_recipients slot"""
 
@@ -653,6 +787,7 @@ class ActionShowRecipients(Action):
         return events
 
 
+@instrumented
 class ActionShowTransferCharge(Action):
     """Lists the transfer charges"""
 
@@ -679,6 +814,7 @@ class ActionShowTransferCharge(Action):
         return events
 
 
+@instrumented
 class ActionRestart(Action):
     """Executes after restart of a session"""
 
@@ -696,6 +832,7 @@ class ActionRestart(Action):
         return [Restarted(), FollowupAction("action_session_start")]
 
 
+@instrumented
 class ActionAskTransactionSearchFormConfirm(Action):
     """Asks for the 'confirm' slot of 'transaction_search_form'
 
@@ -741,6 +878,7 @@ class ActionAskTransactionSearchFormConfirm(Action):
         return []
 
 
+@instrumented
 class ActionSwitchFormsAsk(Action):
     """Asks to switch forms"""
 
@@ -778,6 +916,7 @@ class ActionSwitchFormsAsk(Action):
         return [SlotSet("next_form_name", next_form_name)]
 
 
+@instrumented
 class ActionSwitchFormsDeny(Action):
     """Does not switch forms"""
 
@@ -801,6 +940,7 @@ class ActionSwitchFormsDeny(Action):
         return [SlotSet("next_form_name", None)]
 
 
+@instrumented
 class ActionSwitchFormsAffirm(Action):
     """Switches forms"""
 
@@ -836,6 +976,7 @@ class ActionSwitchFormsAffirm(Action):
         ]
 
 
+@instrumented
 class ActionSwitchBackAsk(Action):
     """Asks to switch back to previous form"""
 
@@ -0,0 +1,253 @@
+"""Response cache shared by the clients of external APIs.
+
+A bounded LRU cache with a TTL per endpoint. Concurrent lookups of the same
+missing key are coalesced into a single upstream call, and hits, misses,
+coalesced calls and evictions are counted per endpoint. The cache can be
+persisted to disk, so it survives restarts of the action server.
+"""
+import asyncio
+import atexit
+import collections
+import logging
+import os
+import pickle
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+# seconds a response stays valid, per endpoint
+DEFAULT_TTLS = {
+    "discourse.query": 10 * 60,
+    "discourse.search": 10 * 60,
+    "goodreads.search_books": 24 * 60 * 60,
+    "goodreads.find_author": 24 * 60 * 60,
+    "goodreads.book": 24 * 60 * 60,
+    "goodreads.author": 24 * 60 * 60,
+    "goodreads.author_url": 24 * 60 * 60,
+    "goodreads.search": 24 * 60 * 60,
+    "goodreads.shelves": 5 * 60,
+    "goodreads.shelf": 5 * 60,
+    "goodreads.library": 5 * 60,
+}
+DEFAULT_TTL = 5 * 60
+
+METRICS = ("hits", "misses", "coalesced", "evictions", "expired")
+
+# result of a shared call whose caller was cancelled, the waiters call again
+_CANCELLED = object()
+
+
+class ResponseCache(object):
+    """Bounded LRU cache of API responses with per-endpoint TTLs."""
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttls: Optional[Dict[Text, float]] = None,
+        default_ttl: float = DEFAULT_TTL,
+        path: Optional[Text] = None,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.default_ttl = default_ttl
+        self.path = path
+        # (endpoint, key) -> (expiry time, value), least recently used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self._calls: Dict[Tuple[Text, Hashable], threading.Event] = {}
+        self._futures: Dict[Tuple[Text, Hashable], asyncio.Future] = {}
+        self.metrics: Dict[Text, Dict[Text, int]] = collections.defaultdict(
+            lambda: dict.fromkeys(METRICS, 0)
+        )
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _count(self, endpoint: Text, metric: Text) -> None:
+        self.metrics[endpoint][metric] += 1
+
+    def get(self, endpoint: Text, key: Hashable) -> Tuple[bool, Any]:
+        """Returns whether the key is cached and unexpired, and its value."""
+        with self._lock:
+            entry = self._entries.get((endpoint, key))
+            if entry is not None:
+                expiry, value = entry
+                if expiry > time.time():
+                    self._entries.move_to_end((endpoint, key))
+                    self._count(endpoint, "hits")
+                    return True, value
+                del self._entries[(endpoint, key)]
+                self._count(endpoint, "expired")
+            self._count(endpoint, "misses")
+            return False, None
+
+    def set(self, endpoint: Text, key: Hashable, value: Any) -> None:
+        ttl = self.ttls.get(endpoint, self.default_ttl)
+        with self._lock:
+            self._entries[(endpoint, key)] = (time.time() + ttl, value)
+            self._entries.move_to_end((endpoint, key))
+            while len(self._entries) > self.maxsize:
+                (evicted_endpoint, _), _ = self._entries.popitem(last=False)
+                self._count(evicted_endpoint, "evictions")
+
+    def get_or_call(
+        self,
+        endpoint: Text,
+        key: Hashable,
+        fetch: Callable[[], Any],
+        cache_if: Callable[[Any], bool] = lambda value: True,
+    ) -> Any:
+        """Returns the cached value, or calls `fetch` and caches its result.
+
+        Threads asking for the same missing key wait for the first one's call.
+        """
+        hit, value = self.get(endpoint, key)
+        if hit:
+            return value
+
+        with self._lock:
+            event = self._calls.get((endpoint, key))
+            leader = event is None
+            if leader:
+                event = self._calls[(endpoint, key)] = threading.Event()
+            else:
+                self._count(endpoint, "coalesced")
+
+        if not leader:
+            event.wait()
+            hit, value = self.get(endpoint, key)
+            # the first call failed or was not cacheable, try ourselves
+            return value if hit else fetch()
+
+        try:
+            value = fetch()
+            if cache_if(value):
+                self.set(endpoint, key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._calls[(endpoint, key)]
+            event.set()
+
+    async def get_or_fetch(
+        self,
+        endpoint: Text,
+        key: Hashable,
+        fetch: Callable[[], Awaitable[Any]],
+        cache_if: Callable[[Any], bool] = lambda value: True,
+    ) -> Any:
+        """Returns the cached value, or awaits `fetch` and caches its result.
+
+        Coroutines asking for the same missing key share the first one's call.
+        If the first one is cancelled, the others do not fail with it: one of
+        them calls `fetch` again.
+        """
+        hit, value = self.get(endpoint, key)
+        if hit:
+            return value
+
+        future = self._futures.get((endpoint, key))
+        if future is not None:
+            self._count(endpoint, "coalesced")
+            value = await asyncio.shield(future)
+            if value is _CANCELLED:
+                return await self.get_or_fetch(endpoint, key, fetch, cache_if)
+            return value
+
+        future = asyncio.get_event_loop().create_future()
+        self._futures[(endpoint, key)] = future
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.set_result(_CANCELLED)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark the exception as retrieved, the waiters (if any) get it too
+            future.exception()
+            raise
+        else:
+            if cache_if(value):
+                self.set(endpoint, key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._futures[(endpoint, key)]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[Text, Dict[Text, Any]]:
+        """Returns the metrics and hit rate per endpoint."""
+        stats = {}
+        with self._lock:
+            for endpoint, metrics in self.metrics.items():
+                lookups = metrics["hits"] + metrics["misses"]
+                stats[endpoint] = {
+                    **metrics,
+                    "hit_rate": metrics["hits"] / lookups if lookups else 0.0,
+                }
+        return stats
+
+    def save(self) -> None:
+        """Writes the unexpired entries to `path`, skipping unpicklable values."""
+        if not self.path:
+            return
+        now = time.time()
+        entries = []
+        with self._lock:
+            for key, (expiry, value) in self._entries.items():
+                if expiry <= now:
+                    continue
+                try:
+                    entries.append((key, expiry, pickle.dumps(value)))
+                except Exception as e:
+                    logger.debug(f"Not persisting cached {key[0]} response: {e!r}")
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> None:
+        """Reads the unexpired entries from `path`."""
+        try:
+            with open(self.path, "rb") as f:
+                entries = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read response cache {self.path}: {e!r}")
+            return
+        now = time.time()
+        with self._lock:
+            for key, expiry, value in entries:
+                if expiry > now:
+                    self._entries[key] = (expiry, pickle.loads(value))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Returns the response cache shared by all API clients.
+
+    Its size and file come from the `API_CACHE_SIZE` and `API_CACHE_PATH`
+    environment variables. Without a file the cache is not persisted.
+    """
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    maxsize=int(os.getenv("API_CACHE_SIZE", 1024)),
+                    path=os.getenv("API_CACHE_PATH"),
+                )
+                if _response_cache.path:
+                    atexit.register(_response_cache.save)
+    return _response_cache
@@ -0,0 +1,457 @@
+"""Local catalog of books, to search titles and authors without the Goodreads API.
+
+The catalog is an SQLite database of the books and authors seen in Goodreads
+responses or imported in bulk, with an inverted index from the words of the
+titles and author names to the books. Every word of a query has to match a
+word of the book: exactly, as a prefix (the last word, which may not be fully
+typed yet) or with typos, found with a `DeletionIndex` over the indexed words.
+Books are ranked by how well the words matched, then by number of ratings.
+
+    python -m actions.api.catalog import books.csv
+    python -m actions.api.catalog search "harry poter"
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Text, Tuple
+
+from actions.fuzzy import DeletionIndex, edit_distance, max_edits, normalize
+
+logger = logging.getLogger(__name__)
+
+here = pathlib.Path(__file__).parent.absolute()
+project = here.parent.parent
+CATALOG_FILE = os.getenv("BOOK_CATALOG", str(project / "books.db"))
+
+TITLE = "title"
+AUTHOR = "author"
+# indexed fields searched for each Goodreads `search[field]`
+SEARCH_FIELDS = {"all": (TITLE, AUTHOR), "title": (TITLE,), "author": (AUTHOR,)}
+
+# scores of the kinds of matches of a word, the higher the better
+EXACT = 3
+PREFIX = 2
+TYPO = 1
+
+# shortest prefix expanded to the words it starts
+MIN_PREFIX = 2
+# SQLite limits the number of parameters of a query
+CHUNK_SIZE = 500
+
+# columns of the CSV exports of Goodreads libraries and of goodbooks-10k
+CSV_COLUMNS = {
+    "id": ("Book Id", "goodreads_book_id", "best_book_id", "id"),
+    "title": ("Title", "title", "original_title"),
+    "authors": ("Author", "authors"),
+    "isbn": ("ISBN", "isbn"),
+    "average_rating": ("Average Rating", "average_rating"),
+    "ratings_count": ("ratings_count", "Ratings Count"),
+    "publication_year": (
+        "Original Publication Year",
+        "original_publication_year",
+        "Year Published",
+    ),
+    "image_url": ("image_url",),
+}
+
+
+def chunks(items: List[Any], size: int = CHUNK_SIZE) -> Iterator[List[Any]]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def merge(old: Optional[Dict[Text, Any]], new: Dict[Text, Any]) -> Dict[Text, Any]:
+    """Updates a record with the values a (possibly partial) response has."""
+    return {**(old or {}), **{k: v for k, v in new.items() if v not in (None, [])}}
+
+
+class BookCatalog(object):
+    """Books and authors in an SQLite database, with an inverted index.
+
+    `postings` maps each normalized word of a title or author name to the
+    books, `searches` remembers how many books Goodreads found for the
+    searches whose results were added, so `search_page` can tell whether the
+    catalog has all of them.
+    """
+
+    def __init__(self, path: Text = CATALOG_FILE) -> None:
+        self.path = path
+        self._lock = threading.RLock()
+        self._typos: Optional[DeletionIndex] = None
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS books ("
+                "id INTEGER PRIMARY KEY, ratings_count INTEGER, data TEXT NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS authors ("
+                "name TEXT PRIMARY KEY, data TEXT NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS postings ("
+                "term TEXT NOT NULL, field TEXT NOT NULL, book_id INTEGER NOT NULL, "
+                "PRIMARY KEY (term, field, book_id)) WITHOUT ROWID"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS searches ("
+                "query TEXT NOT NULL, field TEXT NOT NULL, total INTEGER NOT NULL, "
+                "PRIMARY KEY (query, field))"
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+
+    def _vocabulary(self) -> DeletionIndex:
+        """Returns the index of the words with typos, built on first use."""
+        if self._typos is None:
+            typos = DeletionIndex()
+            for (term,) in self.conn.execute("SELECT DISTINCT term FROM postings"):
+                typos.add(term, term)
+            self._typos = typos
+        return self._typos
+
+    # Updates
+    def add_books(self, books: Iterable[Dict[Text, Any]]) -> int:
+        """Adds or updates books, and their authors. Returns the number added."""
+        books = [book for book in books if book.get("id") and book.get("title")]
+        if not books:
+            return 0
+        with self._lock, self.conn:
+            ids = [book["id"] for book in books]
+            old = {}
+            for chunk in chunks(ids):
+                marks = ",".join("?" * len(chunk))
+                old.update(
+                    (book_id, json.loads(data))
+                    for book_id, data in self.conn.execute(
+                        f"SELECT id, data FROM books WHERE id IN ({marks})", chunk
+                    )
+                )
+            rows = []
+            postings = []
+            authors = []
+            for book in books:
+                book = merge(old.get(book["id"]), book)
+                rows.append((book["id"], book.get("ratings_count"), json.dumps(book)))
+                for term in set(normalize(book["title"]).split()):
+                    postings.append((term, TITLE, book["id"]))
+                for author in book.get("authors") or []:
+                    authors.append(author)
+                    for term in set(normalize(author.get("name")).split()):
+                        postings.append((term, AUTHOR, book["id"]))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO books (id, ratings_count, data) VALUES (?, ?, ?)",
+                rows,
+            )
+            for chunk in chunks(ids):
+                marks = ",".join("?" * len(chunk))
+                self.conn.execute(
+                    f"DELETE FROM postings WHERE book_id IN ({marks})", chunk
+                )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO postings (term, field, book_id) VALUES (?, ?, ?)",
+                postings,
+            )
+            self._add_authors(authors)
+            if self._typos is not None:
+                for term, _, _ in postings:
+                    self._typos.add(term, term)
+        return len(books)
+
+    def _add_authors(self, authors: List[Dict[Text, Any]]) -> None:
+        for author in authors:
+            name = normalize(author.get("name"))
+            if not name:
+                continue
+            row = self.conn.execute(
+                "SELECT data FROM authors WHERE name = ?", (name,)
+            ).fetchone()
+            author = merge(json.loads(row[0]) if row else None, author)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO authors (name, data) VALUES (?, ?)",
+                (name, json.dumps(author)),
+            )
+
+    def add_author(self, author: Dict[Text, Any]) -> None:
+        with self._lock, self.conn:
+            self._add_authors([author])
+
+    def add_search(
+        self, query: Text, search_field: Text, result: Dict[Text, Any]
+    ) -> None:
+        """Adds the books of a page of Goodreads search results."""
+        self.add_books(result["books"])
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO searches (query, field, total) VALUES (?, ?, ?)",
+                (normalize(query), search_field, result["total"]),
+            )
+
+    # Lookups
+    def book(self, book_id: int) -> Optional[Dict[Text, Any]]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT data FROM books WHERE id = ?", (book_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_author(self, name: Text) -> Optional[Dict[Text, Any]]:
+        """Returns the author with a name, or else the most popular author whose
+        name has all the words of the name, with typos.
+        """
+        query = normalize(name)
+        if not query:
+            return None
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT data FROM authors WHERE name = ?", (query,)
+            ).fetchone()
+            if row is None:
+                books, _ = self.search(query, AUTHOR, limit=5)
+                for author in (a for book in books for a in book.get("authors") or []):
+                    words = normalize(author.get("name")).split()
+                    if words and all(
+                        min(edit_distance(word, w, max_edits(word)) for w in words)
+                        <= max_edits(word)
+                        for word in query.split()
+                    ):
+                        row = self.conn.execute(
+                            "SELECT data FROM authors WHERE name = ?",
+                            (normalize(author["name"]),),
+                        ).fetchone()
+                        break
+        return json.loads(row[0]) if row else None
+
+    def _matches(
+        self, word: Text, fields: Tuple[Text, ...], prefix: bool
+    ) -> Dict[int, int]:
+        """Returns the score of the books matching a word of a query."""
+        terms = {word: EXACT}
+        for _, term, _ in self._vocabulary().search(word):
+            terms.setdefault(term, TYPO)
+
+        scores: Dict[int, int] = {}
+        field_marks = ",".join("?" * len(fields))
+        if prefix and len(word) >= MIN_PREFIX:
+            # the words starting with the prefix, in a single range scan
+            for term, book_id in self.conn.execute(
+                f"SELECT term, book_id FROM postings WHERE term >= ? AND term < ? "
+                f"AND field IN ({field_marks})",
+                [word, word + "\uffff", *fields],
+            ):
+                score = terms.get(term, PREFIX)
+                if score > scores.get(book_id, 0):
+                    scores[book_id] = score
+            terms = {
+                term: score
+                for term, score in terms.items()
+                if term[: len(word)] != word
+            }
+        for chunk in chunks(list(terms)):
+            marks = ",".join("?" * len(chunk))
+            for term, book_id in self.conn.execute(
+                f"SELECT term, book_id FROM postings "
+                f"WHERE term IN ({marks}) AND field IN ({field_marks})",
+                [*chunk, *fields],
+            ):
+                if terms[term] > scores.get(book_id, 0):
+                    scores[book_id] = terms[term]
+        return scores
+
+    def search(
+        self, query: Text, search_field: Text = "all", limit: int = 20, offset: int = 0
+    ) -> Tuple[List[Dict[Text, Any]], int]:
+        """Returns the books of a search, best matches first, and how many match."""
+        words = normalize(query).split()
+        fields = SEARCH_FIELDS.get(search_field)
+        if not words or not fields:
+            return [], 0
+        with self._lock:
+            scores: Optional[Dict[int, int]] = None
+            for i, word in enumerate(words):
+                matches = self._matches(word, fields, prefix=i == len(words) - 1)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {
+                        book_id: score + matches[book_id]
+                        for book_id, score in scores.items()
+                        if book_id in matches
+                    }
+                if not scores:
+                    return [], 0
+
+            ratings = {}
+            for chunk in chunks(list(scores)):
+                marks = ",".join("?" * len(chunk))
+                ratings.update(
+                    self.conn.execute(
+                        f"SELECT id, ratings_count FROM books WHERE id IN ({marks})",
+                        chunk,
+                    )
+                )
+            ranked = sorted(
+                scores, key=lambda book_id: (-scores[book_id], -(ratings[book_id] or 0))
+            )
+            page = ranked[offset : offset + limit]
+            marks = ",".join("?" * len(page))
+            books = {
+                book_id: json.loads(data)
+                for book_id, data in self.conn.execute(
+                    f"SELECT id, data FROM books WHERE id IN ({marks})", page
+                )
+            }
+        return [books[book_id] for book_id in page], len(ranked)
+
+    def search_page(
+        self,
+        query: Text,
+        search_field: Text = "all",
+        page: int = 1,
+        page_size: int = 20,
+    ) -> Optional[Dict[Text, Any]]:
+        """Returns a page of search results like Goodreads, if the catalog has it.
+
+        The catalog has every page of a search once it finds at least as many
+        books as Goodreads did, and every page of a search Goodreads was never
+        asked about once it finds enough books to fill a page. The answer does
+        not depend on the page, so a search is paged through either locally or
+        on Goodreads: the catalog ranks books in another order, so mixing its
+        pages with those of Goodreads would skip and repeat books.
+        """
+        if search_field not in SEARCH_FIELDS:
+            return None
+        offset = (page - 1) * page_size
+        books, total = self.search(query, search_field, page_size, offset)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT total FROM searches WHERE query = ? AND field = ?",
+                (normalize(query), search_field),
+            ).fetchone()
+        if total < (page_size if row is None else row[0]):
+            return None
+        return {
+            "books": books,
+            "start": offset + 1 if books else 0,
+            "end": offset + len(books),
+            "total": total,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+
+def _csv_value(row: Dict[Text, Text], field: Text) -> Optional[Text]:
+    for column in CSV_COLUMNS[field]:
+        value = (row.get(column) or "").strip()
+        # Goodreads exports ISBNs as ="0439554934"
+        value = value.lstrip("=").strip('"')
+        if value:
+            return value
+    return None
+
+
+def _number(value: Optional[Text], kind=int) -> Optional[Any]:
+    try:
+        return kind(float(value)) if value else None
+    except ValueError:
+        return None
+
+
+def read_books(path: Text) -> Iterator[Dict[Text, Any]]:
+    """Reads books from a CSV export, or a JSON lines file of book records."""
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        if not path.endswith(".csv"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        for row in csv.DictReader(f):
+            authors = _csv_value(row, "authors") or ""
+            yield {
+                "id": _number(_csv_value(row, "id")),
+                "title": _csv_value(row, "title"),
+                "isbn": _csv_value(row, "isbn"),
+                "image_url": _csv_value(row, "image_url"),
+                "average_rating": _number(_csv_value(row, "average_rating"), float),
+                "ratings_count": _number(_csv_value(row, "ratings_count")),
+                "publication_year": _number(_csv_value(row, "publication_year")),
+                "authors": [
+                    {"id": None, "name": name.strip()}
+                    for name in authors.split(",")
+                    if name.strip()
+                ],
+            }
+
+
+def import_books(catalog: BookCatalog, path: Text, batch_size: int = 1000) -> int:
+    """Adds the books of a file to the catalog, `batch_size` at a time."""
+    count = 0
+    batch = []
+    for book in read_books(path):
+        batch.append(book)
+        if len(batch) == batch_size:
+            count += catalog.add_books(batch)
+            batch = []
+    return count + catalog.add_books(batch)
+
+
+_catalog: Optional[BookCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> BookCatalog:
+    """Returns the book catalog shared by the action server, opening it if needed.
+
+    Its file comes from the `BOOK_CATALOG` environment variable.
+    """
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = BookCatalog()
+    return _catalog
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--path", default=CATALOG_FILE, help="catalog database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_command = commands.add_parser(
+        "import", help="import a CSV or JSON lines file"
+    )
+    import_command.add_argument("file")
+    search_command = commands.add_parser("search", help="search the catalog")
+    search_command.add_argument("query")
+    search_command.add_argument("--field", choices=list(SEARCH_FIELDS), default="all")
+    search_command.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    catalog = BookCatalog(args.path)
+    start = time.perf_counter()
+    if args.command == "import":
+        count = import_books(catalog, args.file)
+        print(f"Imported {count} books in {time.perf_counter() - start:.1f} s.")
+    else:
+        books, total = catalog.search(args.query, args.field, args.limit)
+        elapsed = (time.perf_counter() - start) * 1000
+        for book in books:
+            authors = ", ".join(author["name"] for author in book.get("authors") or [])
+            print(f"{book['id']:>10}  {book['title']} ({authors})")
+        print(f"{total} books found in {elapsed:.1f} ms.")
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
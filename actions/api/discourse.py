@@ -1,12 +1,55 @@
-import requests
+import asyncio
+import logging
 from typing import Any, Dict, List, Text, Optional
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from actions.api.cache import ResponseCache, get_response_cache
+
+logger = logging.getLogger(__name__)
+
+# responses that are worth another try
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
 
 class DiscourseAPI(object):
-    """Class to connect to the Algolia API"""
+    """Class to connect to the Discourse API
+
+    The sync methods (`query`, `search`) share a pooled `requests.Session`; the
+    async methods (`async_query`, `async_search`) share a pooled
+    `aiohttp.ClientSession`, so they don't block the action server's event loop.
+    Both return the decoded JSON response and raise on error statuses, time out
+    after `timeout` seconds and retry failed requests up to `retries` times
+    with exponential backoff. At most `max_concurrency` async requests are in
+    flight at the same time.
+
+    Successful responses are cached in the shared response cache, unless
+    another `cache` is given.
+    """
 
-    def __init__(self, url: Text):
+    def __init__(
+        self,
+        url: Text,
+        timeout: float = 5.0,
+        retries: int = 2,
+        backoff: float = 0.5,
+        max_connections: int = 10,
+        max_concurrency: int = 10,
+        cache: Optional[ResponseCache] = None,
+    ):
         self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.cache = cache if cache is not None else get_response_cache()
+        self._session: Optional[requests.Session] = None
+        # an aiohttp.ClientSession, created by the first async call
+        self._async_session: Optional[Any] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
 
     @staticmethod
     def get_discourse_links(topics: Optional[List[Dict[Text, Any]]], index: int):
@@ -16,13 +59,117 @@ class DiscourseAPI(object):
             forum = f"- [{topics[index].get('title')}]({doc_url})"
         return forum
 
-    def query(self, search_string: Text, include_blurbs=False):
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            retry = Retry(
+                total=self.retries,
+                backoff_factor=self.backoff,
+                status_forcelist=RETRY_STATUSES,
+                # return the last response, raised by `_get_json`, when retries run out
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.max_connections, max_retries=retry
+            )
+            self._session = requests.Session()
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+        return self._session
+
+    def _get_json(
+        self,
+        url: Text,
+        params: Dict[Text, Any],
+        headers: Optional[Dict[Text, Text]] = None,
+    ) -> Dict[Text, Any]:
+        res = self.session.get(
+            url=url, params=params, headers=headers, timeout=self.timeout
+        )
+        res.raise_for_status()
+        return res.json()
+
+    def query(self, search_string: Text, include_blurbs=False) -> Dict[Text, Any]:
         params = {"term": search_string, "include_blurbs": include_blurbs}
-        res = requests.get(url=f"{self.url}/query.json", params=params)
-        return res
+        return self.cache.get_or_call(
+            "discourse.query",
+            (self.url, search_string, include_blurbs),
+            lambda: self._get_json(f"{self.url}/query.json", params),
+        )
 
-    def search(self, search_string: Text, include_blurbs=False):
+    def search(self, search_string: Text, include_blurbs=False) -> Dict[Text, Any]:
         params = {"q": search_string}
         headers = {"Content-Type": "application/json; charset=utf-8"}
-        res = requests.get(url=self.url, params=params, headers=headers)
-        return res
+        return self.cache.get_or_call(
+            "discourse.search",
+            (self.url, search_string),
+            lambda: self._get_json(self.url, params, headers),
+        )
+
+    async def _async_get_json(
+        self,
+        url: Text,
+        params: Dict[Text, Any],
+        headers: Optional[Dict[Text, Text]] = None,
+    ) -> Dict[Text, Any]:
+        # aiohttp doubles the import time of the action server, so it is only
+        # imported once the async methods are called
+        import aiohttp
+
+        if self._async_session is None or self._async_session.closed:
+            self._async_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # aiohttp only accepts str, int & float query parameters
+        params = {
+            k: str(v).lower() if isinstance(v, bool) else v for k, v in params.items()
+        }
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    async with self._async_session.get(
+                        url, params=params, headers=headers
+                    ) as res:
+                        if res.status not in RETRY_STATUSES or attempt == self.retries:
+                            res.raise_for_status()
+                            return await res.json(content_type=None)
+                        logger.debug(f"{url} returned {res.status}, retrying.")
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if attempt == self.retries:
+                        raise
+                    logger.debug(f"{url} failed with {e!r}, retrying.")
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def async_query(
+        self, search_string: Text, include_blurbs=False
+    ) -> Dict[Text, Any]:
+        params = {"term": search_string, "include_blurbs": include_blurbs}
+        return await self.cache.get_or_fetch(
+            "discourse.query",
+            (self.url, search_string, include_blurbs),
+            lambda: self._async_get_json(f"{self.url}/query.json", params),
+        )
+
+    async def async_search(
+        self, search_string: Text, include_blurbs=False
+    ) -> Dict[Text, Any]:
+        params = {"q": search_string}
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        return await self.cache.get_or_fetch(
+            "discourse.search",
+            (self.url, search_string),
+            lambda: self._async_get_json(self.url, params, headers),
+        )
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    async def async_close(self) -> None:
+        if self._async_session is not None:
+            await self._async_session.close()
+            self._async_session = None
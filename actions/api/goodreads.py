@@ -1,80 +1,821 @@
+import asyncio
+import atexit
+import collections
+import functools
+import json
+import math
 import os
 import logging
-from betterreads import client
-#from betterreads.client import GoodreadsClient
-from typing import Dict, Text, Any, List
+import threading
+import time
+import uuid
+from typing import Dict, Text, Any, Awaitable, Iterable, List, NamedTuple, Optional
+from urllib.parse import quote, urlencode
+
+import aiohttp
+
+from actions.api.cache import ResponseCache, get_response_cache
+from actions.api.catalog import BookCatalog, get_catalog
 
 logger = logging.getLogger(__name__)
-logging.getLogger("").handlers = []
-logging.basicConfig(format="%(message)s", level=logging.DEBUG)
+
+GOODREADS_URL = "https://www.goodreads.com"
+
+# Goodreads asks clients not to call the API more than once a second
+RATE = 1.0
+BURST = 1
+
+# responses that are worth another try
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# seconds an authenticated session is reused before it is checked again
+SESSION_TTL = 60 * 60
+MAX_SESSIONS = 256
+
+# Goodreads returns at most 200 books per page of a shelf
+SHELF_PAGE_SIZE = 200
+# and 20 works per page of a search
+SEARCH_PAGE_SIZE = 20
+# ids of the books a search remembers, to skip them on the next pages
+MAX_SEEN_BOOKS = 1000
+
+RECORD = "record"
+REPLAY = "replay"
+FIXTURE_MODES = (RECORD, REPLAY)
+
 
 class GoodreadsAPI(object):
-  """Class to connect to the Algolia API"""
-
-  def __init__(self):
-      self.API_KEY = os.getenv('API_KEY')
-      self.API_SECRET = os.getenv('API_SECRET')
-      self.ACCESS_TOKEN = os.getenv('ACCESS_TOKEN')
-      self.ACCESS_TOKEN_SECRET = os.getenv('ACCESS_TOKEN_SECRET')
-      if not self.API_KEY or not self.API_SECRET:
-        logging.error("API key and secret not provided")
-
-      self.gc = client.GoodreadsClient(self.API_KEY, self.API_SECRET)
-      self.user_authenticated = False
-
-  def authenticate(self):
-    try:
-      self.gc.authenticate(self.ACCESS_TOKEN, self.ACCESS_TOKEN_SECRET)
-      self.user_authenticated = True
-      self.user = self.gc.user()
-      self.user_id = self.user.gid
-      self.user_name = user.user_name
-      logging.debug(f"user.gid: {user.gid}, user_name: {user.user_name}")
-    except:
-      logging.error("User authentication failed")
-
-# Client Calls
-  def find_author(self, name):
-    author = self.gc.find_author(name)
-    return name
-
-  def search_books(self, value, search_field="all"):
-    books = self.gc.search_books(q=value, search_field=search_field)
-    #books = self.gc.search_books(q="Snow Crash", search_field="title")
-    #books = self.gc.search_books(q="Neal Stephenson", search_field="author")
-    #books = self.gc.search_books(q="Snow Crash", search_field="title")
-    #books = self.gc.search_books(q="Daniel Mallory Ortberg", search_field="author")
-    #books = self.gc.search_books(q=value)
-    #books = self.gc.search_books(q=value, search_field="title", page=20)
-    #books = self.gc.search_books(q=value, search_field=search_field, page=20)
-    return books
-
-# User Calls
-  def user(self):
-    if not self.user_authenticated:
-      self.authenticate()
-    if self.user_authenticated:
-      self.user = self.gc.user()
-      self.user_id = self.user.gid
-      self.user_name = user.user_name
-      logging.debug(f"user.gid: {user.gid}, user_name: {user.user_name}")
-      return self.user
-    else:
-      logging.error("User not authenticated")
-
-  def shelves(self):
-    if not self.user_authenticated:
-      self.authenticate()
-    if self.user_authenticated:
-      shelves = self.user.shelves()
-      logging.debug(f"shelves: {shelves}")
-      return shelves
-    else:
-      logging.error("User not authenticated")
-
-gr = GoodreadsAPI()
-books = gr.search_books("think on these things", "title")
-#books = gr.search_books("snow crash", page=20, search_field="all")
-gr.authenticate()
-shelves = gr.shelves()
-logger.debug(f"user shelves: {shelves}")
+    """Class to connect to the Goodreads API
+
+    Nothing is done on construction: the betterreads client is created on the
+    first call, and the user is authenticated on the first user call.
+    Book and author searches are cached in the shared response cache, unless
+    another `cache` is given. Every call blocks: in the action server, use
+    `AsyncGoodreadsAPI` instead.
+    """
+
+    def __init__(self, cache: Optional[ResponseCache] = None):
+        self.API_KEY = os.getenv("API_KEY")
+        self.API_SECRET = os.getenv("API_SECRET")
+        self.ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
+        self.ACCESS_TOKEN_SECRET = os.getenv("ACCESS_TOKEN_SECRET")
+        self._gc = None
+        self.user_authenticated = False
+        self.user_id = None
+        self.user_name = None
+        self.cache = cache if cache is not None else get_response_cache()
+
+    @property
+    def gc(self):
+        if self._gc is None:
+            # betterreads pulls in rauth & xmltodict, only import it when used
+            from betterreads import client
+
+            if not self.API_KEY or not self.API_SECRET:
+                logger.error("API key and secret not provided")
+            self._gc = client.GoodreadsClient(self.API_KEY, self.API_SECRET)
+        return self._gc
+
+    def authenticate(self) -> bool:
+        if self.user_authenticated:
+            return True
+        try:
+            self.gc.authenticate(self.ACCESS_TOKEN, self.ACCESS_TOKEN_SECRET)
+            self._set_user(self.gc.user())
+            self.user_authenticated = True
+        except Exception:
+            logger.error("User authentication failed")
+        return self.user_authenticated
+
+    def _set_user(self, user) -> None:
+        self._user = user
+        self.user_id = user.gid
+        self.user_name = user.user_name
+        logger.debug(f"user.gid: {user.gid}, user_name: {user.user_name}")
+
+    # Client Calls
+    def find_author(self, name):
+        author = self.cache.get_or_call(
+            "goodreads.find_author", name, lambda: self.gc.find_author(name)
+        )
+        return author
+
+    def search_books(self, value, search_field="all", page=1):
+        books = self.cache.get_or_call(
+            "goodreads.search_books",
+            (value, search_field, page),
+            lambda: self.gc.search_books(q=value, page=page, search_field=search_field),
+        )
+        return books
+
+    # User Calls
+    def user(self):
+        if self.authenticate():
+            self._set_user(self.gc.user())
+            return self._user
+        else:
+            logger.error("User not authenticated")
+
+    def shelves(self):
+        if self.authenticate():
+            shelves = self._user.shelves()
+            logger.debug(f"shelves: {shelves}")
+            return shelves
+        else:
+            logger.error("User not authenticated")
+
+
+class GoodreadsError(Exception):
+    """Raised when Goodreads (or a fixture file) has no answer to a request."""
+
+
+class GoodreadsSession(NamedTuple):
+    """The access token of a user, and who it authenticates."""
+
+    access_token: Text
+    access_token_secret: Text
+    user_id: Optional[int] = None
+    user_name: Optional[Text] = None
+
+
+class TokenBucket(object):
+    """Rate limiter allowing `rate` calls per second, in bursts of up to `burst`.
+
+    Callers reserve a token and sleep until it is available, so they are
+    served in order and never wake up only to find the bucket empty again.
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        self._refill()
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Empties the bucket for `seconds`, e.g. after a `Retry-After` header."""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class Fixtures(object):
+    """Recorded Goodreads responses, to run the client without network access.
+
+    In `record` mode every response of the API is added to the file on
+    `save`, in `replay` mode the responses are served from the file and the
+    API is never called. Responses are keyed by path and parameters, without
+    the API key and OAuth parameters.
+    """
+
+    def __init__(self, path: Text, mode: Text = REPLAY) -> None:
+        if mode not in FIXTURE_MODES:
+            raise ValueError(
+                f"Unknown fixture mode `{mode}`, use one of {list(FIXTURE_MODES)}."
+            )
+        self.path = path
+        self.mode = mode
+        self.responses: Dict[Text, Text] = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.responses = json.load(f)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    @staticmethod
+    def key(path: Text, params: Dict[Text, Any]) -> Text:
+        params = {
+            name: params[name]
+            for name in sorted(params)
+            if name != "key" and not name.startswith("oauth_")
+        }
+        return f"{path}?{urlencode(params)}" if params else path
+
+    def get(self, key: Text) -> Text:
+        body = self.responses.get(key)
+        if body is None:
+            raise GoodreadsError(f"No recorded response for `{key}` in {self.path}.")
+        return body
+
+    def record(self, key: Text, body: Text) -> None:
+        self.responses[key] = body
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.responses, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def _text(element: Any) -> Optional[Text]:
+    """Returns the text of an element parsed by xmltodict."""
+    if isinstance(element, dict):
+        return element.get("#text")
+    return element
+
+
+def _int(element: Any) -> Optional[int]:
+    text = _text(element)
+    return int(text) if text else None
+
+
+def _float(element: Any) -> Optional[float]:
+    text = _text(element)
+    return float(text) if text else None
+
+
+def _as_list(element: Any) -> List[Any]:
+    """Returns the repeated elements, xmltodict only makes a list of two or more."""
+    if element is None:
+        return []
+    return element if isinstance(element, list) else [element]
+
+
+def _page_count(element: Any) -> int:
+    """Returns the number of pages of a list with `start`, `end` & `total` attributes."""
+    if not isinstance(element, dict) or not element.get("@total"):
+        return 1
+    start, end, total = (int(element[f"@{name}"]) for name in ("start", "end", "total"))
+    if total <= end or end < start:
+        return 1
+    return math.ceil(total / (end - start + 1))
+
+
+def author_from_xml(author: Dict[Text, Any]) -> Dict[Text, Any]:
+    return {
+        "id": _int(author.get("id")),
+        "name": _text(author.get("name")),
+        "link": _text(author.get("link")),
+        "image_url": _text(author.get("image_url")),
+        "average_rating": _float(author.get("average_rating")),
+        "works_count": _int(author.get("works_count")),
+    }
+
+
+def book_from_xml(book: Dict[Text, Any]) -> Dict[Text, Any]:
+    authors = (book.get("authors") or {}).get("author")
+    return {
+        "id": _int(book.get("id")),
+        "title": _text(book.get("title")),
+        "isbn": _text(book.get("isbn")),
+        "link": _text(book.get("link")),
+        "image_url": _text(book.get("image_url")),
+        "average_rating": _float(book.get("average_rating")),
+        "ratings_count": _int(book.get("ratings_count")),
+        "publication_year": _int(book.get("publication_year")),
+        "authors": [author_from_xml(author) for author in _as_list(authors)],
+    }
+
+
+def book_from_work(work: Dict[Text, Any]) -> Dict[Text, Any]:
+    """Returns the best book of a work found by a search."""
+    best_book = work.get("best_book") or {}
+    return {
+        **book_from_xml(best_book),
+        "average_rating": _float(work.get("average_rating")),
+        "ratings_count": _int(work.get("ratings_count")),
+        "publication_year": _int(work.get("original_publication_year")),
+        "authors": [author_from_xml(best_book.get("author") or {})],
+    }
+
+
+def shelf_from_xml(shelf: Dict[Text, Any]) -> Dict[Text, Any]:
+    return {
+        "id": _int(shelf.get("id")),
+        "name": _text(shelf.get("name")),
+        "book_count": _int(shelf.get("book_count")),
+        "exclusive": _text(shelf.get("exclusive_flag")) == "true",
+    }
+
+
+class AsyncGoodreadsAPI(object):
+    """Async client of the Goodreads API
+
+    Requests share a pooled `aiohttp.ClientSession` and go through a token
+    bucket allowing `rate` requests per second (in bursts of `burst`), with at
+    most `max_concurrency` of them in flight. Failed requests are retried up
+    to `retries` times with exponential backoff, and a `Retry-After` header
+    pauses all requests of the client.
+
+    Calls returning several books, authors or pages fetch them concurrently:
+    the later pages of a list are fetched as soon as the first page tells how
+    many there are, `books` and `authors` fetch the ones missing from the
+    shared response cache (unless another `cache` is given), and the books of
+    a shelf are cached as they are listed, so they are not fetched again.
+
+    `authenticate` returns a `GoodreadsSession`, cached per access token for
+    `session_ttl` seconds, to pass to the calls about the user.
+
+    With a `catalog`, searches and author lookups are answered from the
+    local book catalog when it has the answer, and the books and authors
+    fetched from Goodreads are added to it.
+
+    With `fixtures`, the responses are recorded to or replayed from that file,
+    depending on `fixture_mode`.
+    """
+
+    def __init__(
+        self,
+        url: Text = GOODREADS_URL,
+        rate: float = RATE,
+        burst: int = BURST,
+        timeout: float = 10.0,
+        retries: int = 2,
+        backoff: float = 1.0,
+        max_connections: int = 10,
+        max_concurrency: int = 10,
+        cache: Optional[ResponseCache] = None,
+        catalog: Optional[BookCatalog] = None,
+        session_ttl: float = SESSION_TTL,
+        fixtures: Optional[Text] = None,
+        fixture_mode: Text = REPLAY,
+    ):
+        self.url = url.rstrip("/")
+        self.API_KEY = os.getenv("API_KEY")
+        self.API_SECRET = os.getenv("API_SECRET")
+        self.ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
+        self.ACCESS_TOKEN_SECRET = os.getenv("ACCESS_TOKEN_SECRET")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.cache = cache if cache is not None else get_response_cache()
+        self.catalog = catalog
+        # not persisted: the keys are access tokens
+        self.sessions = ResponseCache(
+            maxsize=MAX_SESSIONS, ttls={"goodreads.auth_user": session_ttl}
+        )
+        self.fixtures = Fixtures(fixtures, fixture_mode) if fixtures else None
+        self.requests = 0
+        self._async_session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def _in_catalog(self, method: Text, *args: Any) -> Any:
+        """Calls a method of the catalog in the default executor, if there is one."""
+        if self.catalog is None:
+            return None
+        func = functools.partial(getattr(self.catalog, method), *args)
+        return await asyncio.get_event_loop().run_in_executor(None, func)
+
+    def _sign(
+        self, url: Text, params: Dict[Text, Text], session: GoodreadsSession
+    ) -> Dict[Text, Text]:
+        """Adds the OAuth 1.0a parameters of the user's session to a request."""
+        # rauth is a dependency of betterreads, only import it when used
+        from rauth.oauth import HmacSha1Signature
+
+        oauth_params = {
+            "oauth_consumer_key": self.API_KEY or "",
+            "oauth_nonce": uuid.uuid4().hex,
+            "oauth_signature_method": HmacSha1Signature.NAME,
+            "oauth_timestamp": str(int(time.time())),
+            "oauth_token": session.access_token,
+            "oauth_version": "1.0",
+        }
+        oauth_params["oauth_signature"] = HmacSha1Signature().sign(
+            self.API_SECRET or "",
+            session.access_token_secret,
+            "GET",
+            url,
+            oauth_params,
+            {"params": params},
+        )
+        return {**params, **oauth_params}
+
+    async def _fetch(
+        self,
+        path: Text,
+        params: Dict[Text, Text],
+        session: Optional[GoodreadsSession] = None,
+    ) -> Text:
+        if self._async_session is None or self._async_session.closed:
+            self._async_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        url = f"{self.url}/{path}"
+        params = {**params, "key": self.API_KEY or ""}
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                await self.rate_limiter.acquire()
+                self.requests += 1
+                query = self._sign(url, params, session) if session else params
+                try:
+                    async with self._async_session.get(url, params=query) as res:
+                        if res.status not in RETRY_STATUSES or attempt == self.retries:
+                            res.raise_for_status()
+                            return await res.text()
+                        logger.debug(f"{url} returned {res.status}, retrying.")
+                        retry_after = res.headers.get("Retry-After", "")
+                        if retry_after.isdigit():
+                            self.rate_limiter.pause(int(retry_after))
+                            continue
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if attempt == self.retries:
+                        raise
+                    logger.debug(f"{url} failed with {e!r}, retrying.")
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def _get(
+        self,
+        path: Text,
+        params: Optional[Dict[Text, Any]] = None,
+        session: Optional[GoodreadsSession] = None,
+    ) -> Dict[Text, Any]:
+        """Returns the parsed `GoodreadsResponse` of a request."""
+        # xmltodict is a dependency of betterreads, only import it when used
+        import xmltodict
+
+        params = {
+            name: str(value)
+            for name, value in (params or {}).items()
+            if value is not None
+        }
+        if self.fixtures is not None and self.fixtures.replaying:
+            body = self.fixtures.get(Fixtures.key(path, params))
+        else:
+            body = await self._fetch(path, params, session)
+            if self.fixtures is not None:
+                self.fixtures.record(Fixtures.key(path, params), body)
+        response = xmltodict.parse(body, dict_constructor=dict)
+        return response.get("GoodreadsResponse") or {}
+
+    async def _get_pages(
+        self,
+        path: Text,
+        params: Dict[Text, Any],
+        element: Text,
+        session: Optional[GoodreadsSession] = None,
+    ) -> List[Dict[Text, Any]]:
+        """Returns the `element` of every page of a list.
+
+        The first page tells how many pages there are, the others are then
+        fetched concurrently.
+        """
+        first = (await self._get(path, {**params, "page": 1}, session)).get(element)
+        responses = await asyncio.gather(
+            *(
+                self._get(path, {**params, "page": page}, session)
+                for page in range(2, _page_count(first) + 1)
+            )
+        )
+        return [first or {}] + [response.get(element) or {} for response in responses]
+
+    # Client Calls
+    async def book(self, book_id: int) -> Dict[Text, Any]:
+        async def fetch():
+            response = await self._get(f"book/show/{book_id}.xml")
+            book = book_from_xml(response["book"])
+            await self._in_catalog("add_books", [book])
+            return book
+
+        return await self.cache.get_or_fetch("goodreads.book", int(book_id), fetch)
+
+    async def books(self, book_ids: Iterable[int]) -> List[Dict[Text, Any]]:
+        """Returns the books with the given ids, fetching the uncached ones concurrently."""
+        book_ids = list(dict.fromkeys(int(book_id) for book_id in book_ids))
+        return list(await asyncio.gather(*(self.book(book_id) for book_id in book_ids)))
+
+    async def author(self, author_id: int) -> Dict[Text, Any]:
+        async def fetch():
+            response = await self._get(f"author/show/{author_id}.xml")
+            author = author_from_xml(response["author"])
+            await self._in_catalog("add_author", author)
+            return author
+
+        return await self.cache.get_or_fetch("goodreads.author", int(author_id), fetch)
+
+    async def authors(self, author_ids: Iterable[int]) -> List[Dict[Text, Any]]:
+        """Returns the authors with the given ids, fetching the uncached ones concurrently."""
+        author_ids = list(dict.fromkeys(int(author_id) for author_id in author_ids))
+        return list(
+            await asyncio.gather(*(self.author(author_id) for author_id in author_ids))
+        )
+
+    async def find_author(self, name: Text) -> Optional[Dict[Text, Any]]:
+        async def fetch():
+            author = await self._in_catalog("find_author", name)
+            if author is not None:
+                return author
+            response = await self._get(f"api/author_url/{quote(name)}")
+            author = response.get("author")
+            return await self.author(author["@id"]) if author else None
+
+        return await self.cache.get_or_fetch("goodreads.author_url", name, fetch)
+
+    async def search_page(
+        self, query: Text, search_field: Text = "all", page: int = 1
+    ) -> Dict[Text, Any]:
+        """Returns a page of the books found by a search, and the total found.
+
+        The books are the best books of the works found, as the search
+        describes them: they are not fetched one by one.
+        """
+
+        async def fetch():
+            result = await self._in_catalog(
+                "search_page", query, search_field, page, SEARCH_PAGE_SIZE
+            )
+            if result is not None:
+                return result
+            response = await self._get(
+                "search/index.xml",
+                {"q": query, "page": page, "search[field]": search_field},
+            )
+            search = response.get("search") or {}
+            works = (search.get("results") or {}).get("work")
+            result = {
+                "books": [book_from_work(work) for work in _as_list(works)],
+                "start": _int(search.get("results-start")) or 0,
+                "end": _int(search.get("results-end")) or 0,
+                "total": _int(search.get("total-results")) or 0,
+            }
+            await self._in_catalog("add_search", query, search_field, result)
+            return result
+
+        return await self.cache.get_or_fetch(
+            "goodreads.search", (query, search_field, page), fetch
+        )
+
+    async def search_books(
+        self, query: Text, search_field: Text = "all", page: int = 1
+    ) -> List[Dict[Text, Any]]:
+        return (await self.search_page(query, search_field, page))["books"]
+
+    def iter_books(
+        self,
+        query: Text,
+        search_field: Text = "all",
+        start: int = 0,
+        prefetch: bool = True,
+    ) -> "BookSearch":
+        """Returns an async iterator over all the books found by a search.
+
+        `start` is the `position` of a previous iteration over the same
+        search, to continue from there, e.g. to show more books.
+        """
+        return BookSearch(self, query, search_field, start, prefetch)
+
+    # User Calls
+    async def authenticate(
+        self,
+        access_token: Optional[Text] = None,
+        access_token_secret: Optional[Text] = None,
+    ) -> GoodreadsSession:
+        """Returns the session of a user, by default of the configured access token.
+
+        Concurrent calls for the same token share a single `auth_user` request.
+        """
+        access_token = access_token or self.ACCESS_TOKEN
+        access_token_secret = access_token_secret or self.ACCESS_TOKEN_SECRET
+        if not access_token or not access_token_secret:
+            raise GoodreadsError("No access token and secret provided.")
+
+        async def fetch():
+            session = GoodreadsSession(access_token, access_token_secret)
+            user = (await self._get("api/auth_user", session=session)).get("user")
+            if not user:
+                raise GoodreadsError("User authentication failed.")
+            logger.debug(
+                f"user.gid: {user['@id']}, user_name: {_text(user.get('name'))}"
+            )
+            return session._replace(
+                user_id=int(user["@id"]), user_name=_text(user.get("name"))
+            )
+
+        return await self.sessions.get_or_fetch(
+            "goodreads.auth_user", access_token, fetch
+        )
+
+    async def shelves(self, session: GoodreadsSession) -> List[Dict[Text, Any]]:
+        async def fetch():
+            pages = await self._get_pages(
+                "shelf/list.xml", {"user_id": session.user_id}, "shelves", session
+            )
+            return [
+                shelf_from_xml(shelf)
+                for page in pages
+                for shelf in _as_list(page.get("user_shelf"))
+            ]
+
+        return await self.cache.get_or_fetch(
+            "goodreads.shelves", session.user_id, fetch
+        )
+
+    async def _reviews(
+        self, session: GoodreadsSession, shelf: Optional[Text]
+    ) -> List[Dict[Text, Any]]:
+        pages = await self._get_pages(
+            f"review/list/{session.user_id}.xml",
+            {"v": 2, "shelf": shelf, "per_page": SHELF_PAGE_SIZE},
+            "reviews",
+            session,
+        )
+        reviews = [review for page in pages for review in _as_list(page.get("review"))]
+        books = [book_from_xml(review.get("book") or {}) for review in reviews]
+        for book in books:
+            self.cache.set("goodreads.book", book["id"], book)
+        await self._in_catalog("add_books", books)
+        return reviews
+
+    async def shelf_books(
+        self, session: GoodreadsSession, shelf: Text
+    ) -> List[Dict[Text, Any]]:
+        """Returns the books on a shelf of the user."""
+
+        async def fetch():
+            reviews = await self._reviews(session, shelf)
+            return [book_from_xml(review.get("book") or {}) for review in reviews]
+
+        return await self.cache.get_or_fetch(
+            "goodreads.shelf", (session.user_id, shelf), fetch
+        )
+
+    async def library(
+        self, session: GoodreadsSession
+    ) -> Dict[Text, List[Dict[Text, Any]]]:
+        """Returns the books of the user by shelf.
+
+        All the books are listed at once, rather than shelf by shelf, so a
+        book on several shelves is only fetched once.
+        """
+
+        async def fetch():
+            library: Dict[Text, List[Dict[Text, Any]]] = {}
+            for review in await self._reviews(session, None):
+                book = book_from_xml(review.get("book") or {})
+                shelves = (review.get("shelves") or {}).get("shelf")
+                for shelf in _as_list(shelves):
+                    library.setdefault(shelf["@name"], []).append(book)
+            return library
+
+        return await self.cache.get_or_fetch(
+            "goodreads.library", session.user_id, fetch
+        )
+
+    async def close(self) -> None:
+        if self._async_session is not None:
+            await self._async_session.close()
+            self._async_session = None
+        if self.fixtures is not None and not self.fixtures.replaying:
+            self.fixtures.save()
+
+
+class BookSearch(object):
+    """Async iterator over the books found by a search, page after page.
+
+    As soon as the books of a page are returned, the next page is fetched in
+    the background (unless `prefetch` is off), so turning the page does not
+    wait for Goodreads. The pages go through the response cache: a search
+    continued later from its `position` finds the prefetched page there.
+
+    Goodreads drops some works from the pages it returns, so a page can be
+    shorter than `SEARCH_PAGE_SIZE` before the last one. The pages are turned
+    by number, and the `position` of a result counts the full pages before it.
+
+    Only the current page is held, with the ids of the last `MAX_SEEN_BOOKS`
+    books returned, to skip the books repeated on the next pages when the
+    results shift between requests.
+    """
+
+    def __init__(
+        self,
+        client: AsyncGoodreadsAPI,
+        query: Text,
+        search_field: Text = "all",
+        start: int = 0,
+        prefetch: bool = True,
+    ) -> None:
+        self.client = client
+        self.query = query
+        self.search_field = search_field
+        self.prefetch = prefetch
+        # index of the next result in the results of the search
+        self.position = start
+        self.total: Optional[int] = None
+        self._books: List[Dict[Text, Any]] = []
+        # number of the next page, and the results to skip on it
+        page, self._offset = divmod(start, SEARCH_PAGE_SIZE)
+        self._page_number = page + 1
+        self._next_page: Optional[asyncio.Task] = None
+        self._seen: "collections.OrderedDict[int, None]" = collections.OrderedDict()
+
+    def __aiter__(self) -> "BookSearch":
+        return self
+
+    def _page(self, page: int) -> Awaitable[Dict[Text, Any]]:
+        return self.client.search_page(self.query, self.search_field, page)
+
+    def _prefetch(self, page: int) -> None:
+        if self.prefetch and (page - 1) * SEARCH_PAGE_SIZE < self.total:
+            self._next_page = asyncio.ensure_future(self._page(page))
+
+    async def _turn_page(self) -> bool:
+        """Turns to the next page, returns whether the search has more pages."""
+        next_page, self._next_page = self._next_page, None
+        if next_page is not None:
+            # prefetched for this page number, only the first page has an offset
+            result = await next_page
+        else:
+            result = await self._page(self._page_number)
+        self.total = result["total"]
+        self.position = (self._page_number - 1) * SEARCH_PAGE_SIZE + self._offset
+        self._books = result["books"][self._offset :]
+        self._offset = 0
+        self._page_number += 1
+        if self._books:
+            self._prefetch(self._page_number)
+        return bool(result["books"])
+
+    async def __anext__(self) -> Dict[Text, Any]:
+        while True:
+            if not self._books:
+                if self.total is not None and self.position >= self.total:
+                    raise StopAsyncIteration
+                if not await self._turn_page():
+                    raise StopAsyncIteration
+                continue
+            book = self._books.pop(0)
+            self.position += 1
+            if not self._books:
+                # the page may be short, the next one starts at a full page
+                self.position = (self._page_number - 1) * SEARCH_PAGE_SIZE
+            if book["id"] in self._seen:
+                continue
+            self._seen[book["id"]] = None
+            if len(self._seen) > MAX_SEEN_BOOKS:
+                self._seen.popitem(last=False)
+            return book
+
+    async def take(self, count: int) -> List[Dict[Text, Any]]:
+        """Returns the next `count` books, fewer at the end of the results."""
+        books: List[Dict[Text, Any]] = []
+        while len(books) < count:
+            try:
+                books.append(await self.__anext__())
+            except StopAsyncIteration:
+                break
+        return books
+
+    def close(self) -> None:
+        """Stops prefetching the next page."""
+        if self._next_page is not None:
+            self._next_page.cancel()
+            self._next_page = None
+
+
+_goodreads: Optional[GoodreadsAPI] = None
+_goodreads_lock = threading.Lock()
+
+
+def get_goodreads() -> GoodreadsAPI:
+    """Returns the Goodreads client shared by the action server."""
+    global _goodreads
+    if _goodreads is None:
+        with _goodreads_lock:
+            if _goodreads is None:
+                _goodreads = GoodreadsAPI()
+    return _goodreads
+
+
+_async_goodreads: Optional[AsyncGoodreadsAPI] = None
+_async_goodreads_lock = threading.Lock()
+
+
+def get_async_goodreads() -> AsyncGoodreadsAPI:
+    """Returns the async Goodreads client shared by the action server.
+
+    It searches the book catalog in `BOOK_CATALOG` before Goodreads.
+    `GOODREADS_URL` overrides the URL of the API, and `GOODREADS_FIXTURES`
+    replays the responses from a file, or with `GOODREADS_FIXTURE_MODE=record`,
+    records them to the file, which is written when the action server exits.
+    """
+    global _async_goodreads
+    if _async_goodreads is None:
+        with _async_goodreads_lock:
+            if _async_goodreads is None:
+                _async_goodreads = AsyncGoodreadsAPI(
+                    url=os.getenv("GOODREADS_URL", GOODREADS_URL),
+                    catalog=get_catalog(),
+                    fixtures=os.getenv("GOODREADS_FIXTURES"),
+                    fixture_mode=os.getenv("GOODREADS_FIXTURE_MODE", REPLAY),
+                )
+                fixtures = _async_goodreads.fixtures
+                if fixtures is not None and not fixtures.replaying:
+                    atexit.register(fixtures.save)
+    return _async_goodreads
@@ -1,51 +1,460 @@
+"""User store of the action server, with pluggable backends.
+
+The backend is selected in the `user_store` section of `endpoints.yml`:
+
+    user_store:
+      type: sqlite  # tinydb (default), sqlite or memory
+      path: users.db
+"""
+import abc
+import asyncio
+import atexit
+import copy
+import functools
+import inspect
 import json
 import logging
-from typing import Dict, Text, Any, List
+import os
+import pathlib
+import sqlite3
+import threading
+from typing import Dict, Text, Any, List, Optional, Tuple
+import ruamel.yaml
 from tinydb import TinyDB, Query
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import JSONStorage
 
 logger = logging.getLogger(__name__)
-logging.getLogger("").handlers = []
-logging.basicConfig(format="%(message)s", level=logging.DEBUG)
 
 # TinyDB docs: https://tinydb.readthedocs.io/en/stable/usage.html#updating-data
 
-class Store(object):
-  def __init__(self):
-    userfile = "users.json"
-    self.db = TinyDB(userfile)
-
-  def user_by_email(self, email: Text):
-    User = Query()
-    try:
-      user = self.db.search(User.email == email)
-    except:
-      user = None
-    return user
-
-  def user_by_sender_id(self, channel: Text, sender: Text):
-    User = Query()
-    try:
-      user = self.db.search(User['shell'] == sender)
-    except:
-      user = None
-    return user
-
-  def insert_user(self, user):
-    self.db.insert(user)
-
-  def update_user(self, user):
-    self.db.update(user)
-
-db = Store()
-user = db.user_by_sender_id("shell", "greg")
-
-logger.debug(f"user: {user}")
-if not user:
-  logger.debug("no users")
-  user = {
-    "firstName": "Greg",
-    "email": "greg@udon.org",
-    "shell": "greg",
-    "slack": "abc"
-  }
-  db.insert_user(user)
+here = pathlib.Path(__file__).parent.absolute()
+project = here.parent.parent
+ENDPOINTS_FILE = os.getenv("ENDPOINTS_FILE", str(project / "endpoints.yml"))
+USERS_FILE = os.getenv("USERS_FILE", str(project / "users.json"))
+
+# number of writes that are cached before they are written to the users file
+WRITE_CACHE_SIZE = 100
+
+# fields of a user that hold the user's sender id on a channel, all other
+# fields are not indexed
+CHANNELS = (
+    "shell",
+    "cmdline",
+    "rest",
+    "socketio",
+    "slack",
+    "facebook",
+    "telegram",
+    "twilio",
+    "mattermost",
+    "rocketchat",
+    "botframework",
+    "hangouts",
+)
+
+
+class DuplicateUserError(ValueError):
+    """A user with the same email is already in the store."""
+
+
+def sender_ids(user: Dict[Text, Any]) -> Dict[Text, Text]:
+    """Returns the sender id of the user for each channel."""
+    return {
+        channel: user[channel]
+        for channel in CHANNELS
+        if isinstance(user.get(channel), str)
+    }
+
+
+def user_keys(user: Dict[Text, Any]) -> Dict[Text, Text]:
+    """Returns the sender ids that identify a user without an email.
+
+    Raises:
+        ValueError: the user has neither an email nor a sender id.
+    """
+    senders = sender_ids(user)
+    if not user.get("email") and not senders:
+        raise ValueError("A user needs an email or a sender id to be updated.")
+    return senders
+
+
+class Store(object, metaclass=abc.ABCMeta):
+    """Async interface of the user store.
+
+    Backends implement the blocking `_` methods. Unless a backend sets
+    `blocking = False`, these run in the default executor, so the event loop
+    of the action server never waits on disk I/O.
+    """
+
+    blocking = True
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+
+    async def _call(self, func, *args):
+        if not self.blocking:
+            return func(*args)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args))
+
+    async def user_by_email(self, email: Text) -> List[Dict[Text, Any]]:
+        return await self._call(self._user_by_email, email)
+
+    async def user_by_sender_id(
+        self, channel: Text, sender: Text
+    ) -> List[Dict[Text, Any]]:
+        return await self._call(self._user_by_sender_id, channel, sender)
+
+    async def insert_user(self, user: Dict[Text, Any]) -> None:
+        """Inserts a new user.
+
+        Raises:
+            DuplicateUserError: a user with the same email is in the store.
+        """
+        await self._call(self._insert_user, user)
+
+    async def update_user(self, user: Dict[Text, Any]) -> None:
+        """Updates the user with the same email, or inserts a new user.
+
+        A user without an email is matched by its sender ids instead.
+
+        Raises:
+            ValueError: the user has neither an email nor a sender id.
+        """
+        await self._call(self._update_user, user)
+
+    async def close(self) -> None:
+        await self._call(self._close)
+
+    @abc.abstractmethod
+    def _user_by_email(self, email: Text) -> List[Dict[Text, Any]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _user_by_sender_id(self, channel: Text, sender: Text) -> List[Dict[Text, Any]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _insert_user(self, user: Dict[Text, Any]) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _update_user(self, user: Dict[Text, Any]) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        pass
+
+
+class InMemoryStore(Store):
+    """User store that only lives in memory, e.g. for tests."""
+
+    blocking = False
+
+    def __init__(self, users: Optional[List[Dict[Text, Any]]] = None) -> None:
+        super().__init__()
+        self._users: Dict[int, Dict[Text, Any]] = {}
+        self._email_index: Dict[Text, int] = {}
+        self._sender_index: Dict[Text, Dict[Text, int]] = {}
+        for user in users or []:
+            self._insert_user(user)
+
+    def _get(self, user_id: Optional[int]) -> List[Dict[Text, Any]]:
+        if user_id is None:
+            return []
+        return [copy.deepcopy(self._users[user_id])]
+
+    def _index_user(self, user: Dict[Text, Any], user_id: int) -> None:
+        if user.get("email"):
+            self._email_index[user["email"]] = user_id
+        for channel, sender in sender_ids(user).items():
+            self._sender_index.setdefault(channel, {})[sender] = user_id
+
+    def _unindex_user(self, user: Dict[Text, Any]) -> None:
+        self._email_index.pop(user.get("email"), None)
+        for channel, sender in sender_ids(user).items():
+            self._sender_index.get(channel, {}).pop(sender, None)
+
+    def _user_by_email(self, email: Text) -> List[Dict[Text, Any]]:
+        with self._lock:
+            return self._get(self._email_index.get(email))
+
+    def _user_by_sender_id(self, channel: Text, sender: Text) -> List[Dict[Text, Any]]:
+        with self._lock:
+            return self._get(self._sender_index.get(channel, {}).get(sender))
+
+    def _insert_user(self, user: Dict[Text, Any]) -> None:
+        with self._lock:
+            if user.get("email") in self._email_index:
+                raise DuplicateUserError(f"A user with email {user['email']} exists.")
+            user_id = len(self._users) + 1
+            self._users[user_id] = copy.deepcopy(user)
+            self._index_user(user, user_id)
+
+    def _user_id(self, user: Dict[Text, Any]) -> Optional[int]:
+        if user.get("email"):
+            return self._email_index.get(user["email"])
+        for channel, sender in user_keys(user).items():
+            user_id = self._sender_index.get(channel, {}).get(sender)
+            if user_id is not None:
+                return user_id
+        return None
+
+    def _update_user(self, user: Dict[Text, Any]) -> None:
+        with self._lock:
+            user_id = self._user_id(user)
+            if user_id is None:
+                self._insert_user(user)
+                return
+            self._unindex_user(self._users[user_id])
+            self._users[user_id].update(copy.deepcopy(user))
+            self._index_user(self._users[user_id], user_id)
+
+
+class TinyDBStore(Store):
+    """User store on top of TinyDB, with in-memory indexes for the lookups.
+
+    Writes are cached by TinyDB's `CachingMiddleware` and flushed to the users
+    file every `WRITE_CACHE_SIZE` writes and on `close`.
+    """
+
+    def __init__(self, path: Text = USERS_FILE) -> None:
+        super().__init__()
+        storage = CachingMiddleware(JSONStorage)
+        storage.WRITE_CACHE_SIZE = WRITE_CACHE_SIZE
+        self.db = TinyDB(path, storage=storage)
+        self._email_index: Dict[Text, int] = {}
+        # channel -> sender id -> doc id, built the first time a channel is used
+        self._sender_index: Dict[Text, Dict[Text, int]] = {}
+
+        for user in self.db.all():
+            self._index_user(user, user.doc_id)
+
+    def _index_user(self, user: Dict[Text, Any], doc_id: int) -> None:
+        email = user.get("email")
+        if email:
+            self._email_index[email] = doc_id
+        for channel, senders in self._sender_index.items():
+            sender = user.get(channel)
+            if sender:
+                senders[sender] = doc_id
+
+    def _sender_ids(self, channel: Text) -> Dict[Text, int]:
+        if channel not in CHANNELS:
+            return {}
+        senders = self._sender_index.get(channel)
+        if senders is None:
+            senders = {
+                user[channel]: user.doc_id
+                for user in self.db.all()
+                if user.get(channel)
+            }
+            self._sender_index[channel] = senders
+        return senders
+
+    def _get(self, doc_id: Optional[int]) -> List[Dict[Text, Any]]:
+        if doc_id is None:
+            return []
+        user = self.db.get(doc_id=doc_id)
+        return [user] if user else []
+
+    def _user_by_email(self, email: Text) -> List[Dict[Text, Any]]:
+        with self._lock:
+            return self._get(self._email_index.get(email))
+
+    def _user_by_sender_id(self, channel: Text, sender: Text) -> List[Dict[Text, Any]]:
+        with self._lock:
+            return self._get(self._sender_ids(channel).get(sender))
+
+    def _insert_user(self, user: Dict[Text, Any]) -> None:
+        with self._lock:
+            if user.get("email") in self._email_index:
+                raise DuplicateUserError(f"A user with email {user['email']} exists.")
+            doc_id = self.db.insert(user)
+            self._index_user(user, doc_id)
+
+    def _doc_id(self, user: Dict[Text, Any]) -> Optional[int]:
+        if user.get("email"):
+            return self._email_index.get(user["email"])
+        for channel, sender in user_keys(user).items():
+            doc_id = self._sender_ids(channel).get(sender)
+            if doc_id is not None:
+                return doc_id
+        return None
+
+    def _update_user(self, user: Dict[Text, Any]) -> None:
+        with self._lock:
+            doc_id = self._doc_id(user)
+            if doc_id is None:
+                self._insert_user(user)
+                return
+            old_user = self.db.get(doc_id=doc_id)
+            new_user = {**old_user, **user}
+            for channel, senders in self._sender_index.items():
+                if old_user.get(channel) != new_user.get(channel):
+                    senders.pop(old_user.get(channel), None)
+            self.db.update(user, doc_ids=[doc_id])
+            self._index_user(new_user, doc_id)
+
+    def flush(self) -> None:
+        """Writes cached changes to the users file."""
+        with self._lock:
+            self.db.storage.flush()
+
+    def _close(self) -> None:
+        with self._lock:
+            self.db.close()
+
+
+class SQLiteStore(Store):
+    """User store in an SQLite database in WAL mode.
+
+    Users are stored as JSON documents, with an indexed `email` column and a
+    `senders` table that maps (channel, sender id) to the user.
+    """
+
+    def __init__(self, path: Text = str(project / "users.db")) -> None:
+        super().__init__()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "id INTEGER PRIMARY KEY, email TEXT UNIQUE, data TEXT NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS senders ("
+                "channel TEXT NOT NULL, sender TEXT NOT NULL, "
+                "user_id INTEGER NOT NULL REFERENCES users(id), "
+                "PRIMARY KEY (channel, sender))"
+            )
+
+    def _fetch(self, query: Text, *args: Any) -> List[Dict[Text, Any]]:
+        with self._lock:
+            row = self.conn.execute(query, args).fetchone()
+        return [json.loads(row[0])] if row else []
+
+    def _user_by_email(self, email: Text) -> List[Dict[Text, Any]]:
+        return self._fetch("SELECT data FROM users WHERE email = ?", email)
+
+    def _user_by_sender_id(self, channel: Text, sender: Text) -> List[Dict[Text, Any]]:
+        return self._fetch(
+            "SELECT data FROM users JOIN senders ON users.id = senders.user_id "
+            "WHERE senders.channel = ? AND senders.sender = ?",
+            channel,
+            sender,
+        )
+
+    def _write_senders(self, user: Dict[Text, Any], user_id: int) -> None:
+        self.conn.execute("DELETE FROM senders WHERE user_id = ?", (user_id,))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO senders (channel, sender, user_id) "
+            "VALUES (?, ?, ?)",
+            [
+                (channel, sender, user_id)
+                for channel, sender in sender_ids(user).items()
+            ],
+        )
+
+    def _insert_user(self, user: Dict[Text, Any]) -> None:
+        with self._lock, self.conn:
+            try:
+                cursor = self.conn.execute(
+                    "INSERT INTO users (email, data) VALUES (?, ?)",
+                    (user.get("email"), json.dumps(user)),
+                )
+            except sqlite3.IntegrityError as e:
+                raise DuplicateUserError(
+                    f"A user with email {user['email']} exists."
+                ) from e
+            self._write_senders(user, cursor.lastrowid)
+
+    def _find_row(self, user: Dict[Text, Any]) -> Optional[Tuple[int, Text]]:
+        if user.get("email"):
+            return self.conn.execute(
+                "SELECT id, data FROM users WHERE email = ?", (user["email"],)
+            ).fetchone()
+        for channel, sender in user_keys(user).items():
+            row = self.conn.execute(
+                "SELECT id, data FROM users JOIN senders ON users.id = senders.user_id "
+                "WHERE senders.channel = ? AND senders.sender = ?",
+                (channel, sender),
+            ).fetchone()
+            if row is not None:
+                return row
+        return None
+
+    def _update_user(self, user: Dict[Text, Any]) -> None:
+        with self._lock:
+            row = self._find_row(user)
+            if row is None:
+                self._insert_user(user)
+                return
+            user_id, data = row
+            new_user = {**json.loads(data), **user}
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE users SET data = ? WHERE id = ?",
+                    (json.dumps(new_user), user_id),
+                )
+                self._write_senders(new_user, user_id)
+
+    def _close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+
+STORE_BACKENDS = {
+    "tinydb": TinyDBStore,
+    "sqlite": SQLiteStore,
+    "memory": InMemoryStore,
+}
+
+
+def read_store_config(endpoints_file: Text = ENDPOINTS_FILE) -> Dict[Text, Any]:
+    """Reads the `user_store` section of the endpoints file."""
+    if not os.path.exists(endpoints_file):
+        return {}
+    with open(endpoints_file, "r") as f:
+        return (ruamel.yaml.safe_load(f) or {}).get("user_store") or {}
+
+
+def create_store(config: Optional[Dict[Text, Any]] = None) -> Store:
+    """Creates the store backend described by a `user_store` config."""
+    config = dict(read_store_config() if config is None else config)
+    store_type = config.pop("type", "tinydb")
+    if store_type not in STORE_BACKENDS:
+        raise ValueError(
+            f"Unknown user store type `{store_type}`, "
+            f"use one of {list(STORE_BACKENDS.keys())}."
+        )
+    backend = STORE_BACKENDS[store_type]
+    options = inspect.signature(backend).parameters
+    unknown = [key for key in config if key not in options]
+    if unknown:
+        raise ValueError(
+            f"Unknown option(s) {unknown} for the {store_type} user store, "
+            f"it takes {list(options.keys()) or 'no options'}."
+        )
+    path = config.get("path")
+    if path and not os.path.isabs(path):
+        config["path"] = str(project / path)
+    logger.debug(f"Using {store_type} user store.")
+    return backend(**config)
+
+
+_store: Optional[Store] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Store:
+    """Returns the user store shared by the action server, opening it if needed."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_store()
+                atexit.register(_store._close)
+    return _store
@@ -1,11 +1,14 @@
 """Customization to deal nicely with repeated slot validation failures."""
 import abc
-from typing import Dict, Text, Any, List
+import asyncio
+import copy
+from typing import Dict, Text, Any, List, Optional, Tuple
 import logging
 import pathlib
+import warnings
 import ruamel.yaml
 from rasa_sdk import utils
-from rasa_sdk.forms import FormValidationAction
+from rasa_sdk.forms import FormValidationAction, REQUESTED_SLOT
 from rasa_sdk.events import (
     SlotSet,
     EventType,
@@ -30,6 +33,7 @@ custom_forms_config = (
 ).get("custom_forms", {})
 
 MAX_VALIDATION_FAILURES = custom_forms_config.get("max_validation_failures", 2)
+MAX_CONCURRENT_VALIDATIONS = custom_forms_config.get("max_concurrent_validations", 4)
 
 
 class CustomFormValidationAction(FormValidationAction, metaclass=abc.ABCMeta):
@@ -102,8 +106,21 @@ class CustomFormValidationAction(FormValidationAction, metaclass=abc.ABCMeta):
 
                 # optionally, you can set slots by returning a dict
                 return {}
+
+    (-) Optionally, list the slots whose 'validate_{slot}' methods are independent
+        of each other in 'independent_slots'. When a user fills several of them at
+        once, they are validated concurrently, e.g. while they wait on an API.
+
+        For example:
+
+        class ValidatePayCCForm(CustomFormValidationAction):
+            independent_slots = ["credit_card", "amount-of-money", "time"]
     """
 
+    # Slots whose `validate_{slot}` methods do not depend on each other, e.g. on
+    # the ledger updates of another validation, so they can run concurrently
+    independent_slots: List[Text] = []
+
     # Avoids registering this class as a custom action
     @abc.abstractmethod
     def name(self) -> Text:
@@ -130,49 +147,168 @@ class CustomFormValidationAction(FormValidationAction, metaclass=abc.ABCMeta):
         Returns:
             `SlotSet` events for every validated slot.
         """
-        events = []
+        slots: Dict[Text, Any] = {}
 
         if not tracker.get_slot(CF_SLOT):
-            events.append(SlotSet(CF_SLOT, "yes"))
+            slots[CF_SLOT] = "yes"
 
-        events.extend(await super().validate(dispatcher, tracker, domain))
+        slots.update(await self.validate_slots(dispatcher, tracker, domain))
 
+        events: List[EventType] = [
+            SlotSet(slot, value) for slot, value in slots.items()
+        ]
         events.extend(
-            await self.repeated_validation_failures(dispatcher, tracker, domain, events)
+            await self.repeated_validation_failures(dispatcher, tracker, domain, slots)
         )
 
         return events
 
+    async def validate_slots(
+        self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict,
+    ) -> Dict[Text, Any]:
+        """Validates the slot candidates by calling `validate_{slot}` for each slot.
+
+        Consecutive candidates listed in `independent_slots` are validated
+        concurrently, other candidates one at a time. Either way, the outputs
+        and messages are merged in the order of the candidates.
+
+        Once a validation function deactivates the form, by setting requested_slot
+        to None, the remaining candidates are neither validated nor set. The
+        `continue_form` candidate is validated first, so that cancelling the form
+        always skips the other candidates.
+
+        Returns:
+            The validated values of the slots, by slot name.
+        """
+        slots: Dict[Text, Any] = {}
+        candidates = list(tracker.slots_to_validate().items())
+        # an answer to continue_form may cancel the form, so it is validated
+        # first, whichever order the SDK lists the candidates in
+        candidates.sort(key=lambda candidate: candidate[0] != CF_SLOT)
+
+        start = 0
+        while start < len(candidates):
+            if REQUESTED_SLOT in slots and slots[REQUESTED_SLOT] is None:
+                break
+
+            end = start + 1
+            if candidates[start][0] in self.independent_slots:
+                while (
+                    end < len(candidates)
+                    and candidates[end][0] in self.independent_slots
+                ):
+                    end += 1
+            batch = candidates[start:end]
+            start = end
+
+            if len(batch) == 1:
+                outputs = [
+                    await self._validate_slot(*batch[0], dispatcher, tracker, domain)
+                ]
+            else:
+                outputs = await self._validate_concurrently(
+                    batch, dispatcher, tracker, domain
+                )
+
+            for (slot_name, slot_value), validation_output in zip(batch, outputs):
+                slots[slot_name] = slot_value
+                if validation_output:
+                    slots.update(validation_output)
+
+        return slots
+
+    async def _validate_concurrently(
+        self,
+        batch: List[Tuple[Text, Any]],
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict,
+    ) -> List[Optional[Dict[Text, Any]]]:
+        """Validates slot candidates concurrently, MAX_CONCURRENT_VALIDATIONS at a
+        time, and returns their outputs in the order of the candidates."""
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_VALIDATIONS)
+        # every validation gets its own dispatcher, and its own (shallow) copy
+        # of the tracker, so that the messages come out in a deterministic order
+        dispatchers = [CollectingDispatcher() for _ in batch]
+
+        async def validate_slot(
+            slot_name: Text, slot_value: Any, slot_dispatcher: CollectingDispatcher
+        ) -> Optional[Dict[Text, Any]]:
+            async with semaphore:
+                return await self._validate_slot(
+                    slot_name, slot_value, slot_dispatcher, copy.copy(tracker), domain
+                )
+
+        outputs = await asyncio.gather(
+            *(
+                validate_slot(slot_name, slot_value, slot_dispatcher)
+                for (slot_name, slot_value), slot_dispatcher in zip(batch, dispatchers)
+            )
+        )
+        for slot_dispatcher in dispatchers:
+            dispatcher.messages.extend(slot_dispatcher.messages)
+        return outputs
+
+    async def _validate_slot(
+        self,
+        slot_name: Text,
+        slot_value: Any,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict,
+    ) -> Optional[Dict[Text, Any]]:
+        """Calls `validate_{slot}` and returns its output, if it is valid."""
+        method_name = f"validate_{slot_name.replace('-','_')}"
+        validate_method = getattr(self, method_name, None)
+
+        if not validate_method:
+            logger.warning(
+                f"Skipping validation for `{slot_name}`: there is no validation "
+                f"method specified."
+            )
+            return None
+
+        validation_output = await utils.call_potential_coroutine(
+            validate_method(slot_value, dispatcher, tracker, domain)
+        )
+
+        if not isinstance(validation_output, dict):
+            warnings.warn(
+                f"Cannot validate `{slot_name}`: make sure the validation method "
+                f"returns the correct output."
+            )
+            return None
+        return validation_output
+
     async def repeated_validation_failures(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
         domain: Dict,
-        events: List[EventType],
+        slots: Dict[Text, Any],
     ) -> List[EventType]:
         """Updates the slot repeated_validation_failures, and sets required form slot
         `continue_form` to None when the threshold is reached.
 
         This will trigger utter_ask_{form}_continue_form, asking the user if they want
         to continue with this form or not.
+
+        Args:
+            slots: the slots set by `validate`, by slot name.
         """
         rvf_events: List[EventType] = []
-        requested_slot = tracker.get_slot("requested_slot")
+        requested_slot = tracker.get_slot(REQUESTED_SLOT)
 
         # Only do this while form is asking for a certain slot
         if not requested_slot:
             return rvf_events
 
-        # if the requested slot was not extracted, interupt the form
-        interrupt_form = False
-        if not events:
-            interrupt_form = True
-        else:
-            for event in events:
-                if event["event"] == "slot" and event["name"] == "requested_slot":
-                    interrupt_form = True
-
-        if interrupt_form:
+        # if the requested slot was not extracted, or validate_{slot} set the
+        # requested slot, interupt the form
+        if not slots or REQUESTED_SLOT in slots:
             # Sending LoopInterrupted will prevent rasa.core from asking for the slot
             rvf_events.append(LoopInterrupted(is_interrupted=True))
 
@@ -182,39 +318,11 @@ class CustomFormValidationAction(FormValidationAction, metaclass=abc.ABCMeta):
 
             return rvf_events
 
-        # Skip if validate_{slot} turned off the form by setting requested_slot to None
-        for event in events:
-            if (
-                event["event"] == "slot"
-                and event["name"] == "requested_slot"
-                and not event["value"]
-            ):
-                rvf_events.append(SlotSet(RVF_SLOT, 0))
-                return rvf_events
-
-        rvf = tracker.get_slot(RVF_SLOT)
-        if rvf:
-            rvf = int(rvf)
-        else:
-            # initialize counter to 0
-            rvf = 0
-
-        # check if validation of the requested_slot failed
-        validation_failed = True
-        for event in events:
-            if (
-                event["event"] == "slot"
-                and event["name"] == requested_slot
-                and event["value"]
-            ):
-                validation_failed = False
-                break
-
         # keep track of repeated validation failures
-        if validation_failed:
-            rvf += 1
-        else:
+        if slots.get(requested_slot):
             rvf = 0
+        else:
+            rvf = int(tracker.get_slot(RVF_SLOT) or 0) + 1
 
         if rvf >= MAX_VALIDATION_FAILURES:
             rvf_events.extend(
@@ -245,7 +353,7 @@ class CustomFormValidationAction(FormValidationAction, metaclass=abc.ABCMeta):
         Returns:
             `SlotSet` events for the explained slot (Optional).
         """
-        slot_name = tracker.get_slot("requested_slot")
+        slot_name = tracker.get_slot(REQUESTED_SLOT)
         if not slot_name:
             return []
 
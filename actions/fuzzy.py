@@ -0,0 +1,189 @@
+"""Approximate string matching helpers for the lookup indexes of the actions.
+
+`DeletionIndex` finds the terms within a small edit distance of a query
+without scanning all terms: every term is indexed under the strings obtained
+by deleting up to `max_distance` of its characters, so a query only has to
+look up its own deletions, and the few candidates found are verified with
+`edit_distance`. `TrigramIndex` finds the terms sharing most trigrams with a
+query, which also matches words with typos or in another order.
+"""
+import collections
+import math
+import re
+import unicodedata
+from typing import Dict, Hashable, Iterable, List, Set, Text, Tuple
+
+NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+
+def normalize(text: Text) -> Text:
+    """Lowercases text, strips accents and punctuation and collapses spaces."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return NON_ALPHANUMERIC.sub(" ", text).strip()
+
+
+def max_edits(term: Text) -> int:
+    """Number of typos tolerated in a term, depending on its length."""
+    if len(term) <= 3:
+        return 0
+    if len(term) <= 6:
+        return 1
+    return 2
+
+
+def deletions(term: Text, max_distance: int) -> Set[Text]:
+    """Returns the term and all strings with up to `max_distance` deletions."""
+    results = {term}
+    frontier = {term}
+    for _ in range(max_distance):
+        frontier = {
+            word[:i] + word[i + 1 :] for word in frontier for i in range(len(word))
+        }
+        results |= frontier
+    return results
+
+
+def edit_distance(a: Text, b: Text, max_distance: int) -> int:
+    """Returns the edit distance of two strings, counting transpositions.
+
+    Returns `max_distance + 1` as soon as the distance is known to be larger.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+def soundex(term: Text) -> Text:
+    """Returns the American Soundex code of a word, e.g. "R163" for "robert"."""
+    letters = [c for c in normalize(term) if c.isalpha()]
+    if not letters:
+        return ""
+    code = letters[0].upper()
+    last = SOUNDEX_CODES.get(letters[0], "")
+    for c in letters[1:]:
+        digit = SOUNDEX_CODES.get(c, "")
+        if digit and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        # h and w do not separate letters with the same code, vowels do
+        if c not in "hw":
+            last = digit
+    return code.ljust(4, "0")
+
+
+class DeletionIndex(object):
+    """Finds the values of the terms within a small edit distance of a query."""
+
+    def __init__(self, max_distance: int = 2) -> None:
+        self.max_distance = max_distance
+        self._terms: Dict[Text, Set[Hashable]] = collections.defaultdict(set)
+        self._deletions: Dict[Text, Set[Text]] = collections.defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def add(self, term: Text, value: Hashable) -> None:
+        if term not in self._terms:
+            for deletion in deletions(term, min(max_edits(term), self.max_distance)):
+                self._deletions[deletion].add(term)
+        self._terms[term].add(value)
+
+    def update(self, items: Iterable[Tuple[Text, Hashable]]) -> None:
+        for term, value in items:
+            self.add(term, value)
+
+    def search(self, query: Text) -> List[Tuple[int, Text, Hashable]]:
+        """Returns `(distance, term, value)` for the terms close to the query.
+
+        A term matches when the distance is within the number of typos
+        tolerated for both the query and the term. Closest terms come first.
+        """
+        distance = min(max_edits(query), self.max_distance)
+        terms: Set[Text] = set()
+        for deletion in deletions(query, distance):
+            terms |= self._deletions.get(deletion, set())
+
+        matches = []
+        for term in terms:
+            allowed = min(distance, max_edits(term))
+            found = edit_distance(query, term, allowed)
+            if found <= allowed:
+                matches.extend((found, term, value) for value in self._terms[term])
+        return sorted(matches, key=lambda match: (match[0], match[1]))
+
+
+def trigrams(term: Text) -> Set[Text]:
+    """Returns the trigrams of a term, padded to weigh its start and end."""
+    padded = f"  {term} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex(object):
+    """Finds the values of the terms sharing most trigrams with a query."""
+
+    def __init__(self) -> None:
+        self._terms: Dict[Text, Set[Hashable]] = collections.defaultdict(set)
+        self._grams: Dict[Text, Set[Text]] = {}
+        self._postings: Dict[Text, Set[Text]] = collections.defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def add(self, term: Text, value: Hashable) -> None:
+        if term not in self._terms:
+            grams = self._grams[term] = trigrams(term)
+            for gram in grams:
+                self._postings[gram].add(term)
+        self._terms[term].add(value)
+
+    def search(
+        self, query: Text, threshold: float = 0.5
+    ) -> List[Tuple[float, Text, Hashable]]:
+        """Returns `(similarity, term, value)` for the terms similar to the query.
+
+        The similarity is the Dice coefficient of the trigrams, between 0 and 1.
+        Only terms at least as similar as `threshold` are returned, most
+        similar first.
+        """
+        grams = trigrams(query)
+        # a similar term shares at least `required` trigrams with the query, so
+        # it is in one of the postings of all but `required - 1` trigrams:
+        # only the shortest postings have to be read
+        required = max(1, math.ceil(threshold * len(grams) / (2 - threshold)))
+        postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+        candidates: Set[Text] = set()
+        for terms in postings[: len(grams) - required + 1]:
+            candidates |= terms
+
+        matches = []
+        for term in candidates:
+            term_grams = self._grams[term]
+            similarity = 2 * len(grams & term_grams) / (len(grams) + len(term_grams))
+            if similarity >= threshold:
+                matches.extend((similarity, term, value) for value in self._terms[term])
+        return sorted(matches, key=lambda match: (-match[0], match[1]))
@@ -1,18 +1,220 @@
+"""Actions handing the conversation off to other bots.
+
+The bots are configured in `handoff_config.yml`. The `HandoffRegistry` keeps
+them with the buttons offering them, and reloads the file when it changes on
+disk: a new configuration replaces the old one at once, and one that fails to
+load leaves the old one in place. A background task checks that the bots
+answer, so only the live ones are offered. The actions only read what the
+registry has already computed.
+"""
 from rasa_sdk import Tracker, Action
 from rasa_sdk.executor import CollectingDispatcher
 
+import asyncio
+import logging
+import math
+import os
 import ruamel.yaml
 import pathlib
-from typing import Dict, Text, Any, List
+import threading
+import time
+from typing import Dict, Text, Any, List, NamedTuple, Optional
 from rasa_sdk.events import EventType
 
+from actions.instrumentation import instrumented
+
+logger = logging.getLogger(__name__)
+
 here = pathlib.Path(__file__).parent.absolute()
-handoff_config = (
-    ruamel.yaml.safe_load(open(f"{here}/handoff_config.yml", "r")) or {}
-).get("handoff_hosts", {})
+HANDOFF_CONFIG_FILE = f"{here}/handoff_config.yml"
+
+# seconds between two looks at the config file for changes
+RELOAD_INTERVAL = 2.0
+# seconds between two health checks of the bots, and how long a bot may take
+# to answer one
+HEALTH_CHECK_INTERVAL = 30.0
+HEALTH_CHECK_TIMEOUT = 2.0
+
+
+class HandoffHost(NamedTuple):
+    name: Text
+    title: Optional[Text]
+    url: Optional[Text]
+    button: Dict[Text, Any]
+
+
+class HandoffSnapshot(NamedTuple):
+    hosts: Dict[Text, HandoffHost]
+    # buttons offering the live hosts
+    buttons: List[Dict[Text, Any]]
+
+
+def load_handoff_hosts(path: Text = HANDOFF_CONFIG_FILE) -> Dict[Text, HandoffHost]:
+    """Reads the bots of the config file, with the buttons offering them."""
+    with open(path, "r") as f:
+        config = (ruamel.yaml.safe_load(f) or {}).get("handoff_hosts") or {}
+    hosts = {}
+    for bot, bot_config in config.items():
+        bot_config = bot_config or {}
+        hosts[bot] = HandoffHost(
+            bot,
+            bot_config.get("title"),
+            bot_config.get("url"),
+            {
+                "title": bot_config.get("title"),
+                "payload": f'/trigger_handoff{{"handoff_to":"{bot}"}}',
+            },
+        )
+    return hosts
+
+
+class HandoffRegistry(object):
+    """The bots to hand off to, reloaded when their config file changes.
+
+    The bots and the buttons of the live ones are replaced together, as one
+    snapshot, so a reader never sees half of a configuration. The file is
+    looked at, at most every `reload_interval` seconds, when the registry is
+    read, and by the health checks. These run every `health_check_interval`
+    seconds (never if it is None) in a background task of the event loop
+    reading the registry. Bots that were not checked yet are assumed live.
+    """
+
+    def __init__(
+        self,
+        path: Text = HANDOFF_CONFIG_FILE,
+        reload_interval: float = RELOAD_INTERVAL,
+        health_check_interval: Optional[float] = HEALTH_CHECK_INTERVAL,
+        health_check_timeout: float = HEALTH_CHECK_TIMEOUT,
+    ) -> None:
+        self.path = path
+        self.reload_interval = reload_interval
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        # url -> whether the bot answered its last health check
+        self.health: Dict[Text, bool] = {}
+        self._snapshot = HandoffSnapshot({}, [])
+        self._mtime: Optional[int] = None
+        self._looked_at = -math.inf
+        self._lock = threading.Lock()
+        self._health_checks: Optional[asyncio.Task] = None
+        self.reload()
+
+    @property
+    def hosts(self) -> Dict[Text, HandoffHost]:
+        return self._snapshot.hosts
+
+    @property
+    def buttons(self) -> List[Dict[Text, Any]]:
+        """Returns the buttons offering the live bots."""
+        return self._snapshot.buttons
 
+    def _update(self, hosts: Dict[Text, HandoffHost]) -> None:
+        buttons = [
+            host.button
+            for host in hosts.values()
+            if host.url and self.health.get(host.url, True)
+        ]
+        self._snapshot = HandoffSnapshot(hosts, buttons)
 
+    def reload(self) -> bool:
+        """Loads the config file if it changed since it was last loaded."""
+        self._looked_at = time.monotonic()
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime:
+                return False
+            hosts = load_handoff_hosts(self.path)
+        except Exception as e:
+            logger.error(f"Could not load the handoff config {self.path}: {e!r}")
+            return False
+        with self._lock:
+            self._mtime = mtime
+            self._update(hosts)
+        logger.debug(f"Loaded handoff hosts {list(hosts.keys())}.")
+        return True
+
+    def refresh(self) -> None:
+        """Reloads the config file if it was not looked at for a while, and starts
+        the health checks if they are not running.
+        """
+        if time.monotonic() - self._looked_at >= self.reload_interval:
+            self.reload()
+        if self.health_check_interval is not None and (
+            self._health_checks is None or self._health_checks.done()
+        ):
+            loop = asyncio.get_event_loop()
+            if loop.is_running():
+                self._health_checks = loop.create_task(self._check_health_forever())
+
+    def host(self, name: Optional[Text]) -> Optional[HandoffHost]:
+        self.refresh()
+        return self.hosts.get(name)
+
+    def live_buttons(self) -> List[Dict[Text, Any]]:
+        self.refresh()
+        return self.buttons
+
+    async def check_health(self) -> None:
+        """Checks that the bots answer, and offers only those that do."""
+        # aiohttp doubles the import time of the action server, so it is only
+        # imported once the health checks run
+        import aiohttp
+
+        async def is_live(session: aiohttp.ClientSession, url: Text) -> bool:
+            try:
+                async with session.get(url) as response:
+                    return response.status < 500
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return False
+
+        urls = sorted({host.url for host in self.hosts.values() if host.url})
+        async with aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=self.health_check_timeout)
+        ) as session:
+            live = await asyncio.gather(*(is_live(session, url) for url in urls))
+        health = dict(zip(urls, live))
+        for url, is_live in health.items():
+            if is_live != self.health.get(url, True):
+                state = "answering again" if is_live else "not answering"
+                logger.warning(f"Handoff host {url} is {state}.")
+        with self._lock:
+            self.health = health
+            self._update(self.hosts)
+
+    async def _check_health_forever(self) -> None:
+        while True:
+            self.reload()
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.error(f"Could not check the handoff hosts: {e!r}")
+            await asyncio.sleep(self.health_check_interval)
+
+    def close(self) -> None:
+        if self._health_checks is not None:
+            self._health_checks.cancel()
+            self._health_checks = None
+
+
+_handoff_registry: Optional[HandoffRegistry] = None
+_handoff_registry_lock = threading.Lock()
+
+
+def get_handoff_registry() -> HandoffRegistry:
+    """Returns the handoff registry shared by the action server."""
+    global _handoff_registry
+    if _handoff_registry is None:
+        with _handoff_registry_lock:
+            if _handoff_registry is None:
+                _handoff_registry = HandoffRegistry()
+    return _handoff_registry
+
+
+@instrumented
 class ActionHandoffOptions(Action):
+    def __init__(self, registry: Optional[HandoffRegistry] = None) -> None:
+        self.registry = registry
+
     def name(self) -> Text:
         return "action_handoff_options"
 
@@ -23,16 +225,10 @@ class ActionHandoffOptions(Action):
         domain: Dict[Text, Any],
     ) -> List[EventType]:
 
-        if not any([config.get("url") for bot, config in handoff_config.items()]):
+        buttons = (self.registry or get_handoff_registry()).live_buttons()
+        if not buttons:
             dispatcher.utter_message(template="utter_no_handoff")
         else:
-            buttons = [
-                {
-                    "title": config.get("title"),
-                    "payload": f'/trigger_handoff{{"handoff_to":"{bot}"}}',
-                }
-                for bot, config in handoff_config.items()
-            ]
             dispatcher.utter_message(
                 text=(
                     "I can't transfer you to a human, "
@@ -43,7 +239,11 @@ class ActionHandoffOptions(Action):
         return []
 
 
+@instrumented
 class ActionHandoff(Action):
+    def __init__(self, registry: Optional[HandoffRegistry] = None) -> None:
+        self.registry = registry
+
     def name(self) -> Text:
         return "action_handoff"
 
@@ -57,15 +257,15 @@ class ActionHandoff(Action):
         dispatcher.utter_message(template="utter_handoff")
         handoff_to = tracker.get_slot("handoff_to")
 
-        handoff_bot = handoff_config.get(handoff_to, {})
-        url = handoff_bot.get("url")
+        handoff_bot = (self.registry or get_handoff_registry()).host(handoff_to)
+        url = handoff_bot.url if handoff_bot else None
 
         if url:
             if tracker.get_latest_input_channel() == "rest":
                 dispatcher.utter_message(
                     json_message={
                         "handoff_host": url,
-                        "title": handoff_bot.get("title"),
+                        "title": handoff_bot.title,
                     }
                 )
             else:
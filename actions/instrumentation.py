@@ -0,0 +1,283 @@
+"""Latency and payload metrics of the custom actions, in Prometheus text format.
+
+Set `ACTION_METRICS_PORT` to enable the metrics, e.g. with
+`ACTION_METRICS_PORT=9105 rasa run actions`. They are served at
+`http://127.0.0.1:<port>/metrics`, set `ACTION_METRICS_HOST` to listen on
+another interface.
+
+Every action class decorated with `@instrumented` records, per action and per
+method (`run`, and every `validate_<slot>` and `explain_<slot>` method):
+
+- the wall time of the calls, as a histogram
+- the number of calls and of the calls that raised an exception
+- the number and serialized size of the returned events (or validated slots)
+- the serialized size of the messages sent with the dispatcher
+- the serialized size of the slots read from the tracker, per slot
+
+Without `ACTION_METRICS_PORT` the decorator returns the class unchanged, so
+the actions run without any overhead.
+"""
+import collections
+import functools
+import http.server
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Text, Tuple, Type
+
+from rasa_sdk import Tracker
+from rasa_sdk.executor import CollectingDispatcher
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = os.getenv("ACTION_METRICS_PORT")
+METRICS_HOST = os.getenv("ACTION_METRICS_HOST", "127.0.0.1")
+ENABLED = bool(METRICS_PORT)
+
+# upper bounds of the latency histogram buckets, in seconds
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+# methods of the form validation actions that are not about a single slot
+FORM_METHODS = {"validate_slots", "explain_requested_slot"}
+
+# name, type and help of the exported metrics
+METRICS = [
+    (
+        "action_duration_seconds",
+        "histogram",
+        "Wall time of the custom actions and their slot methods.",
+    ),
+    ("action_calls_total", "counter", "Calls of the custom actions."),
+    ("action_errors_total", "counter", "Calls that raised an exception."),
+    ("action_events_total", "counter", "Events or slots returned by the calls."),
+    ("action_event_bytes_total", "counter", "Serialized size of the returned events."),
+    ("action_message_bytes_total", "counter", "Serialized size of the messages sent."),
+    ("action_slot_reads_total", "counter", "Slots read from the tracker."),
+    ("action_slot_bytes_total", "counter", "Serialized size of the slots read."),
+]
+
+
+def serialized_size(value: Any) -> int:
+    return len(json.dumps(value, default=str))
+
+
+class ActionMetrics(object):
+    """Metrics of the action calls, keyed by action and method."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS) -> None:
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # (action, method) -> counts per bucket (the last one is +Inf)
+        self._durations: Dict[Tuple[Text, Text], List[int]] = {}
+        self._duration_sums: Dict[Tuple[Text, Text], float] = collections.Counter()
+        # metric -> (action, method) -> value
+        self._counters: Dict[
+            Text, Dict[Tuple[Text, Text], int]
+        ] = collections.defaultdict(collections.Counter)
+        # (action, method, slot) -> [reads, bytes]
+        self._slots: Dict[Tuple[Text, Text, Text], List[int]] = collections.defaultdict(
+            lambda: [0, 0]
+        )
+
+    def record(
+        self,
+        action: Text,
+        method: Text,
+        seconds: float,
+        error: bool = False,
+        events: int = 0,
+        event_bytes: int = 0,
+        message_bytes: int = 0,
+        slot_sizes: Optional[Dict[Text, int]] = None,
+    ) -> None:
+        key = (action, method)
+        with self._lock:
+            counts = self._durations.get(key)
+            if counts is None:
+                counts = self._durations[key] = [0] * (len(self.buckets) + 1)
+            index = next(
+                (i for i, bound in enumerate(self.buckets) if seconds <= bound),
+                len(self.buckets),
+            )
+            counts[index] += 1
+            self._duration_sums[key] += seconds
+            self._counters["action_calls_total"][key] += 1
+            self._counters["action_errors_total"][key] += int(error)
+            self._counters["action_events_total"][key] += events
+            self._counters["action_event_bytes_total"][key] += event_bytes
+            self._counters["action_message_bytes_total"][key] += message_bytes
+            for slot, size in (slot_sizes or {}).items():
+                reads = self._slots[(action, method, slot)]
+                reads[0] += 1
+                reads[1] += size
+
+    def render(self) -> Text:
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, kind, description in METRICS:
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                if name == "action_duration_seconds":
+                    lines.extend(self._render_durations(name))
+                elif name.startswith("action_slot_"):
+                    index = 0 if name == "action_slot_reads_total" else 1
+                    for key, values in sorted(self._slots.items()):
+                        labels = f'{self._labels(key[:2])},slot="{key[2]}"'
+                        lines.append(f"{name}{{{labels}}} {values[index]}")
+                else:
+                    for key, value in sorted(self._counters[name].items()):
+                        lines.append(f"{name}{{{self._labels(key)}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _render_durations(self, name: Text) -> List[Text]:
+        lines = []
+        for key, counts in sorted(self._durations.items()):
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {self._duration_sums[key]}")
+            lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+    @staticmethod
+    def _labels(key: Tuple[Text, Text]) -> Text:
+        return f'action="{key[0]}",method="{key[1]}"'
+
+    def serve(self, port: int, host: Text = METRICS_HOST) -> http.server.HTTPServer:
+        """Serves the metrics at `/metrics` from a daemon thread."""
+        metrics = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: Text, *args: Any) -> None:
+                logger.debug(format % args)
+
+        server = http.server.HTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(
+            target=server.serve_forever, name="action-metrics", daemon=True
+        )
+        thread.start()
+        logger.info(f"Serving action metrics at http://{host}:{port}/metrics")
+        return server
+
+
+_metrics: Optional[ActionMetrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> ActionMetrics:
+    """Returns the metrics of the action server, serving them when enabled."""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = ActionMetrics()
+                if METRICS_PORT:
+                    try:
+                        _metrics.serve(int(METRICS_PORT))
+                    except OSError as e:
+                        logger.error(f"Could not serve the action metrics: {e}")
+    return _metrics
+
+
+def _find_call_args(args: Tuple) -> Tuple[Any, Optional[Tracker]]:
+    """Returns the dispatcher and tracker among the arguments of a call."""
+    dispatcher = tracker = None
+    for arg in args:
+        if isinstance(arg, CollectingDispatcher):
+            dispatcher = arg
+        elif isinstance(arg, Tracker):
+            tracker = arg
+    return dispatcher, tracker
+
+
+def _instrument(method: Callable, method_name: Text) -> Callable:
+    @functools.wraps(method)
+    async def wrapper(self, *args: Any, **kwargs: Any) -> Any:
+        dispatcher, tracker = _find_call_args(args)
+        messages_before = len(dispatcher.messages) if dispatcher else 0
+
+        # record the sizes of the slots read during the call, nested calls
+        # (e.g. `validate_<slot>` during `run`) are recorded by both
+        slot_sizes: Dict[Text, int] = {}
+        if tracker is not None:
+            previous = vars(tracker).get("get_slot")
+            get_slot = tracker.get_slot
+
+            def get_slot_and_size(key: Text) -> Any:
+                value = get_slot(key)
+                if key not in slot_sizes:
+                    slot_sizes[key] = serialized_size(value)
+                return value
+
+            tracker.get_slot = get_slot_and_size
+
+        error = True
+        start = time.perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            error = False
+            return result
+        finally:
+            seconds = time.perf_counter() - start
+            if tracker is not None:
+                if previous is None:
+                    del tracker.get_slot
+                else:
+                    tracker.get_slot = previous
+            new_messages = dispatcher.messages[messages_before:] if dispatcher else []
+            output = None if error else result
+            get_metrics().record(
+                self.name(),
+                method_name,
+                seconds,
+                error=error,
+                events=len(output) if output else 0,
+                event_bytes=serialized_size(output) if output else 0,
+                message_bytes=serialized_size(new_messages) if new_messages else 0,
+                slot_sizes=slot_sizes,
+            )
+
+    return wrapper
+
+
+def instrumented(cls: Type) -> Type:
+    """Records the metrics of `run` and the slot methods of an action class.
+
+    Does nothing unless `ACTION_METRICS_PORT` is set.
+    """
+    if not ENABLED:
+        return cls
+
+    for name in dir(cls):
+        if name in FORM_METHODS or not (
+            name == "run" or name.startswith(("validate_", "explain_"))
+        ):
+            continue
+        method = getattr(cls, name)
+        if callable(method):
+            setattr(cls, name, _instrument(method, name))
+    return cls
+
+
+if ENABLED:
+    # serve the metrics as soon as the action server starts, not on the first call
+    get_metrics()
@@ -0,0 +1,240 @@
+"""Server-side ledger that holds the (mock) bank accounts of users.
+
+The account data is kept on the action server, keyed by a ledger id, so the
+conversation tracker only needs to carry the small `ledger_id` slot instead of
+the full transaction history and balances.
+
+Accounts are opened by `action_session_start` and only live in the memory of
+the action server process, which keeps the `MAX_ACCOUNTS` most recently used.
+The account of a conversation can therefore be missing mid-session, e.g. after
+a restart of the action server. The actions that read accounts are decorated
+with `requires_account`: instead of failing, they tell the user that the
+account was lost and restart the session, which opens a new account.
+"""
+from typing import Dict, Text, Any, List, Optional, Type
+import collections
+import functools
+import logging
+import threading
+
+from rasa_sdk import Tracker
+from rasa_sdk.events import EventType, FollowupAction, Restarted
+from rasa_sdk.executor import CollectingDispatcher
+
+from actions.profile import create_mock_profile
+from actions.recipients import RecipientIndex
+from actions.transactions import TransactionIndex, to_cents
+from actions.vendors import VendorCatalog, get_vendor_catalog
+
+logger = logging.getLogger(__name__)
+
+LEDGER_SLOT = "ledger_id"
+
+# search types of the transactions recorded by the bot, kept apart from the
+# spend and deposit history, so that payments and transfers are not spending
+PAYMENT = "payment"
+TRANSFER = "transfer"
+
+# number of accounts kept by the ledger, the least recently used is closed
+# when another one is opened
+MAX_ACCOUNTS = 1000
+
+
+class UnknownAccountError(KeyError):
+    """No account is open for a ledger id."""
+
+
+class CreditCard(object):
+    """Balances of a credit card, in integer cents."""
+
+    __slots__ = ("name", "current_balance", "minimum_balance")
+
+    # the balances a user can ask to pay, by the name they use
+    PAYMENT_AMOUNT_TYPES = {
+        "current balance": "current_balance",
+        "minimum balance": "minimum_balance",
+    }
+
+    def __init__(self, name: Text, current_balance: int, minimum_balance: int) -> None:
+        self.name = name
+        self.current_balance = current_balance
+        self.minimum_balance = minimum_balance
+
+    @classmethod
+    def from_profile(cls, name: Text, balances: Dict[Text, Any]) -> "CreditCard":
+        return cls(
+            name,
+            to_cents(balances.get("current balance", 0)),
+            to_cents(balances.get("minimum balance", 0)),
+        )
+
+    def payment_amount(self, payment_amount_type: Text) -> Optional[int]:
+        """Returns the balance named by a user, e.g. "minimum balance", if any."""
+        attribute = self.PAYMENT_AMOUNT_TYPES.get(payment_amount_type.lower())
+        return getattr(self, attribute) if attribute else None
+
+
+class Account(object):
+    """Bank account of one user.
+
+    All amounts are kept in integer cents, so that balances stay exact over
+    any number of payments and transfers.
+    """
+
+    def __init__(self, ledger_id: Text, profile: Dict[Text, Any]) -> None:
+        self.ledger_id = ledger_id
+        self.balance = to_cents(profile.get("account_balance", 0))
+        # cents paid and transferred since the account was opened
+        self.transferred = 0
+        self.currency = profile.get("currency", "$")
+        self.credit_cards: Dict[Text, CreditCard] = {
+            name: CreditCard.from_profile(name, balances)
+            for name, balances in profile.get("credit_card_balance", {}).items()
+        }
+        self.known_recipients = profile.get("known_recipients", [])
+        self.vendor_list = profile.get("vendor_list", [])
+        self.transactions = TransactionIndex.from_columns(
+            profile.get("transaction_history", {})
+        )
+        self._recipients: Optional[RecipientIndex] = None
+        self._vendors: Optional[VendorCatalog] = None
+
+    @property
+    def recipients(self) -> RecipientIndex:
+        """Index of the known recipients, built on first use."""
+        if self._recipients is None:
+            self._recipients = RecipientIndex(self.known_recipients)
+        return self._recipients
+
+    @property
+    def vendors(self) -> VendorCatalog:
+        """Catalog of the vendors of the account, built on first use."""
+        if self._vendors is None:
+            self._vendors = get_vendor_catalog().subset(self.vendor_list)
+        return self._vendors
+
+    def credit_card(self, credit_card: Optional[Text]) -> Optional[CreditCard]:
+        """Returns a credit card, or None if it is unknown."""
+        if not credit_card:
+            return None
+        return self.credit_cards.get(credit_card.lower())
+
+    def can_pay(self, cents: int) -> bool:
+        """Whether the bank account holds enough money to pay an amount."""
+        return cents <= self.balance
+
+    def pay_credit_card(self, credit_card: Text, cents: int) -> None:
+        """Pays an amount from the bank account towards a credit card."""
+        self.credit_cards[credit_card.lower()].current_balance -= cents
+        self._withdraw(PAYMENT, credit_card, cents)
+
+    def transfer(self, cents: int, recipient: Optional[Text] = None) -> None:
+        """Transfers an amount from the bank account to a recipient."""
+        self._withdraw(TRANSFER, recipient or "transfer", cents)
+
+    def _withdraw(self, search_type: Text, vendor: Text, cents: int) -> None:
+        self.balance -= cents
+        self.transferred += cents
+        self.transactions.record(search_type, vendor, cents)
+
+
+class Ledger(object):
+    """Holds the accounts of the users of this action server, by ledger id.
+
+    At most `max_accounts` accounts are kept, the least recently used ones
+    are closed to make room for new ones.
+    """
+
+    def __init__(self, max_accounts: int = MAX_ACCOUNTS) -> None:
+        self.max_accounts = max_accounts
+        self._accounts: "collections.OrderedDict[Text, Account]" = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    def __contains__(self, ledger_id: Text) -> bool:
+        return ledger_id in self._accounts
+
+    def open_account(
+        self, ledger_id: Text, profile: Optional[Dict[Text, Any]] = None
+    ) -> Account:
+        """Opens (or re-opens) an account from a profile.
+
+        A mock profile is created when no profile is given.
+        """
+        account = Account(ledger_id, profile or create_mock_profile())
+        with self._lock:
+            self._accounts[ledger_id] = account
+            self._accounts.move_to_end(ledger_id)
+            while len(self._accounts) > self.max_accounts:
+                closed, _ = self._accounts.popitem(last=False)
+                logger.debug(f"Closed the least recently used account `{closed}`.")
+        return account
+
+    def account(self, ledger_id: Text) -> Account:
+        """Returns the account of a ledger id.
+
+        Raises:
+            UnknownAccountError: no account is open for the ledger id.
+        """
+        with self._lock:
+            account = self._accounts.get(ledger_id)
+            if account is None:
+                raise UnknownAccountError(
+                    f"No account is open for ledger id `{ledger_id}`, accounts "
+                    f"are opened by action_session_start."
+                )
+            self._accounts.move_to_end(ledger_id)
+        return account
+
+    def close_account(self, ledger_id: Text) -> None:
+        """Removes the account of a ledger id from the ledger."""
+        with self._lock:
+            self._accounts.pop(ledger_id, None)
+
+    def ledger_ids(self) -> List[Text]:
+        return list(self._accounts.keys())
+
+
+ledger = Ledger()
+
+
+def get_account(tracker: Tracker) -> Account:
+    """Returns the account referenced by the `ledger_id` slot of the tracker.
+
+    Falls back on the sender id for conversations without a ledger id.
+
+    Raises:
+        UnknownAccountError: no account is open for the conversation.
+    """
+    ledger_id = tracker.get_slot(LEDGER_SLOT) or tracker.sender_id
+    return ledger.account(ledger_id)
+
+
+def requires_account(cls: Type) -> Type:
+    """Restarts the session when `run` finds no account for the conversation.
+
+    The user is told that the account was lost, as the payments and transfers
+    of the session are, and `action_session_start` opens a new account.
+    """
+    run = cls.run
+
+    @functools.wraps(run)
+    async def wrapper(
+        self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any],
+    ) -> List[EventType]:
+        try:
+            return await run(self, dispatcher, tracker, domain)
+        except UnknownAccountError as e:
+            logger.warning(f"{self.name()}: {e} Restarting the session.")
+            dispatcher.utter_message(template="utter_account_lost")
+            return [Restarted(), FollowupAction("action_session_start")]
+
+    cls.run = wrapper
+    return cls
@@ -1,7 +1,60 @@
+import functools
+from datetime import datetime
 from dateutil import relativedelta, parser
-from typing import Dict, Text, Any, Optional
+from typing import Dict, Text, Any, NamedTuple, Optional
 from rasa_sdk import Tracker
 
+GRAIN_FORMATS = {
+    "second": "%I:%M:%S%p, %A %b %d, %Y",
+    "day": "%A %b %d, %Y",
+    "week": "%A %b %d, %Y",
+    "month": "%b %Y",
+    "year": "%Y",
+}
+DEFAULT_FORMAT = "%I:%M%p, %A %b %d, %Y"
+
+GRAIN_DELTAS = {
+    grain: relativedelta.relativedelta(**{f"{grain}s": 1})
+    for grain in ["second", "minute", "hour", "day", "week", "month", "year"]
+}
+
+# number of (value, grain) combinations to remember
+TIME_CACHE_SIZE = 1024
+
+
+class DucklingTime(NamedTuple):
+    """A Duckling timestamp, parsed once, with its grain and formatted text"""
+
+    isotime: Text
+    value: datetime
+    grain: Optional[Text]
+    formatted: Text
+
+
+def _grain_delta(grain: Optional[Text]) -> relativedelta.relativedelta:
+    delta = GRAIN_DELTAS.get(grain)
+    if delta is None:
+        delta = relativedelta.relativedelta(**{f"{grain}s": 1})
+    return delta
+
+
+def _make_time(value: datetime, grain: Optional[Text], isotime: Text) -> DucklingTime:
+    timeformat = GRAIN_FORMATS.get(grain, DEFAULT_FORMAT)
+    return DucklingTime(isotime, value, grain, value.strftime(timeformat))
+
+
+@functools.lru_cache(maxsize=TIME_CACHE_SIZE)
+def parse_time(isotime: Text, grain: Optional[Text] = None) -> DucklingTime:
+    """Parses an ISO timestamp of a given grain, remembering the result."""
+    return _make_time(parser.isoparse(isotime), grain, isotime)
+
+
+@functools.lru_cache(maxsize=TIME_CACHE_SIZE)
+def shift_time(isotime: Text, grain: Optional[Text], steps: int) -> DucklingTime:
+    """Moves an ISO timestamp by a number of steps of its grain."""
+    value = parse_time(isotime, grain).value + _grain_delta(grain) * steps
+    return _make_time(value, grain, value.isoformat())
+
 
 def close_interval_duckling_time(
     timeinfo: Dict[Text, Any]
@@ -10,21 +63,20 @@ def close_interval_duckling_time(
     start = timeinfo.get("from", {}).get("value")
     end = timeinfo.get("to", {}).get("value")
     if (start or end) and not (start and end):
-        deltaargs = {f"{grain}s": 1}
-        delta = relativedelta.relativedelta(**deltaargs)
         if start:
-            parsedstart = parser.isoparse(start)
-            parsedend = parsedstart + delta
-            end = parsedend.isoformat()
+            parsedstart = parse_time(start, grain)
+            parsedend = shift_time(start, grain, 1)
         elif end:
-            parsedend = parser.isoparse(end)
-            parsedstart = parsedend - delta
-            start = parsedstart.isoformat()
+            parsedend = parse_time(end, grain)
+            parsedstart = shift_time(end, grain, -1)
+    else:
+        parsedstart = parse_time(start, grain)
+        parsedend = parse_time(end, grain)
     return {
-        "start_time": start,
-        "start_time_formatted": format_isotime_by_grain(start, grain),
-        "end_time": end,
-        "end_time_formatted": format_isotime_by_grain(end, grain),
+        "start_time": parsedstart.isotime,
+        "start_time_formatted": parsedstart.formatted,
+        "end_time": parsedend.isotime,
+        "end_time_formatted": parsedend.formatted,
         "grain": grain,
     }
 
@@ -34,16 +86,13 @@ def make_interval_from_value_duckling_time(
 ) -> Dict[Text, Any]:
     grain = timeinfo.get("grain")
     start = timeinfo.get("value")
-    parsedstart = parser.isoparse(start)
-    deltaargs = {f"{grain}s": 1}
-    delta = relativedelta.relativedelta(**deltaargs)
-    parsedend = parsedstart + delta
-    end = parsedend.isoformat()
+    parsedstart = parse_time(start, grain)
+    parsedend = shift_time(start, grain, 1)
     return {
-        "start_time": start,
-        "start_time_formatted": format_isotime_by_grain(start, grain),
-        "end_time": end,
-        "end_time_formatted": format_isotime_by_grain(end, grain),
+        "start_time": parsedstart.isotime,
+        "start_time_formatted": parsedstart.formatted,
+        "end_time": parsedend.isotime,
+        "end_time_formatted": parsedend.formatted,
         "grain": grain,
     }
 
@@ -59,17 +108,7 @@ def parse_duckling_time_as_interval(
 
 
 def format_isotime_by_grain(isotime, grain=None):
-    value = parser.isoparse(isotime)
-    grain_format = {
-        "second": "%I:%M:%S%p, %A %b %d, %Y",
-        "day": "%A %b %d, %Y",
-        "week": "%A %b %d, %Y",
-        "month": "%b %Y",
-        "year": "%Y",
-    }
-    timeformat = grain_format.get(grain, "%I:%M%p, %A %b %d, %Y")
-    time_formatted = value.strftime(timeformat)
-    return time_formatted
+    return parse_time(isotime, grain).formatted
 
 
 def parse_duckling_time(timeentity: Dict[Text, Any]) -> Optional[Dict[Text, Any]]:
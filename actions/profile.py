@@ -1,106 +1,128 @@
-from random import (
-    choice,
-    randrange,
-    sample,
-)
-from numpy import arange
-from datetime import datetime, timedelta
+from typing import Dict, Text, Any, List, Optional, Tuple
+from datetime import datetime
+import numpy as np
 import pytz
 
 utc = pytz.UTC
 
+SECONDS_PER_DAY = 24 * 60 * 60
 
-def create_mock_profile():
+CREDIT_CARD_DB = [
+    "iron bank",
+    "credit all",
+    "emblem",
+    "justice bank",
+]
+RECIPIENT_DB = [
+    "katy parrow",
+    "evan oslo",
+    "william baker",
+    "karen lancaster",
+    "kyle gardner",
+    "john jacob",
+    "percy donald",
+    "lisa macintyre",
+]
+VENDOR_DB = [
+    "target",
+    "starbucks",
+    "amazon",
+]
+# deposit source: (days between deposits, lowest amount, highest amount) in cents
+DEPOSIT_DB = {
+    "employer": (14, 100000, 200000),
+    "interest": (30, 500, 2000),
+}
+# spending per vendor: (days between purchases, lowest amount, highest amount)
+SPEND = (2, 500, 5000)
+# current balance of the credit cards: (lowest amount, highest amount)
+CREDIT_CARD_BALANCE = (2000, 50000)
+MINIMUM_BALANCE = 20
+
+HISTORY_START = datetime(2019, 1, 1)
+
+
+def _random_transactions(
+    rng: np.random.Generator,
+    start_epoch: int,
+    number_of_days: int,
+    days_between: int,
+    low: int,
+    high: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Draws transaction dates (epochs) and amounts (cents) for one vendor."""
+    size = number_of_days // days_between
+    days = rng.integers(number_of_days, size=size) if number_of_days else []
+    epochs = start_epoch + np.asarray(days, dtype=np.int64) * SECONDS_PER_DAY
+    cents = rng.integers(low, high, size=size)
+    return epochs, cents
+
+
+def create_mock_profile(
+    seed: Optional[int] = None,
+    history_days: Optional[int] = None,
+    vendors: Optional[List[Text]] = None,
+    end_date: Optional[datetime] = None,
+) -> Dict[Text, Any]:
+    """Creates a random bank account profile.
+
+    Amounts are drawn as integer cents and dates as whole days, directly with
+    NumPy's random `Generator`, so creating a profile stays cheap for long
+    histories and many vendors.
+
+    Args:
+        seed: seed for the random generator, to create reproducible profiles.
+        history_days: number of days of transaction history, by default all
+            days since 2019-01-01.
+        vendors: names of the vendors the user spends money with.
+        end_date: the day the transaction history ends, by default now.
+
+    Returns:
+        The profile. The transaction history maps search_type (spend/deposit)
+        to a dict that maps vendor names to `(epochs, cents)` arrays.
+    """
+    rng = np.random.default_rng(seed)
     currency = "$"
-    account_balance = 0
+    vendor_db = VENDOR_DB if vendors is None else vendors
 
-    credit_card_balance = {}
-    transaction_history = {"spend": {}, "deposit": {}}
+    end_date = end_date or datetime.now()
+    if end_date.tzinfo is None:
+        end_date = utc.localize(end_date)
+    if history_days is None:
+        history_days = (end_date - utc.localize(HISTORY_START)).days
+    start_epoch = int(end_date.timestamp()) - history_days * SECONDS_PER_DAY
+    start_epoch -= start_epoch % SECONDS_PER_DAY
 
-    credit_card_db = [
-        "iron bank",
-        "credit all",
-        "emblem",
-        "justice bank",
-    ]
-    deposit_db = [
-        "employer",
-        "interest",
-    ]
-    recipient_db = [
-        "katy parrow",
-        "evan oslo",
-        "william baker",
-        "karen lancaster",
-        "kyle gardner",
-        "john jacob",
-        "percy donald",
-        "lisa macintyre",
-    ]
-    vendor_db = [
-        "target",
-        "starbucks",
-        "amazon",
-    ]
-
-    start_date = utc.localize(datetime(2019, 1, 1))
-    end_date = utc.localize(datetime.now())
-    number_of_days = (end_date - start_date).days
+    transaction_history = {"spend": {}, "deposit": {}}
+    account_balance = 0
 
     for vendor in vendor_db:
-        rand_spend_amounts = sample(
-            [round(amount, 2) for amount in list(arange(5, 50, 0.01))],
-            number_of_days // 2,
+        epochs, cents = _random_transactions(rng, start_epoch, history_days, *SPEND)
+        transaction_history["spend"][vendor] = (epochs, cents)
+        account_balance -= int(cents.sum())
+
+    for deposit, deposit_spec in DEPOSIT_DB.items():
+        epochs, cents = _random_transactions(
+            rng, start_epoch, history_days, *deposit_spec
         )
+        transaction_history["deposit"][deposit] = (epochs, cents)
+        account_balance += int(cents.sum())
 
-        rand_dates = [
-            (start_date + timedelta(days=randrange(number_of_days))).isoformat()
-            for x in range(0, len(rand_spend_amounts))
-        ]
-
-        transaction_history["spend"][vendor] = [
-            {"amount": amount, "date": date}
-            for amount, date in zip(rand_spend_amounts, rand_dates)
-        ]
-        account_balance -= sum(rand_spend_amounts)
-
-    for deposit in deposit_db:
-        if deposit == "interest":
-            rand_deposit_amounts = sample(
-                [round(amount, 2) for amount in list(arange(5, 20, 0.01))],
-                number_of_days // 30,
-            )
-        else:
-            rand_deposit_amounts = sample(
-                [round(amount, 2) for amount in list(arange(1000, 2000, 0.01))],
-                number_of_days // 14,
-            )
-
-        rand_dates = [
-            (start_date + timedelta(days=randrange(number_of_days))).isoformat()
-            for x in range(0, len(rand_deposit_amounts))
-        ]
-
-        transaction_history["deposit"][deposit] = [
-            {"amount": amount, "date": date}
-            for amount, date in zip(rand_deposit_amounts, rand_dates)
-        ]
-        account_balance += sum(rand_deposit_amounts) - sum(rand_spend_amounts)
-
-    for credit_card in credit_card_db:
-        credit_card_balance[credit_card] = {
-            "minimum balance": 20,
-            "current balance": choice(
-                [round(amount, 2) for amount in list(arange(20, 500, 0.01))]
-            ),
+    card_balances = rng.integers(*CREDIT_CARD_BALANCE, size=len(CREDIT_CARD_DB))
+    credit_card_balance = {
+        credit_card: {
+            "minimum balance": MINIMUM_BALANCE,
+            "current balance": int(cents) / 100,
         }
+        for credit_card, cents in zip(CREDIT_CARD_DB, card_balances)
+    }
 
     mock_profile = {
-        "account_balance": f"{account_balance:.2f}",
+        "account_balance": f"{account_balance / 100:.2f}",
         "currency": currency,
         "transaction_history": transaction_history,
         "credit_card_balance": credit_card_balance,
-        "known_recipients": [recipient.title() for recipient in recipient_db],
-        "vendor_list": vendor_db,
+        "known_recipients": [recipient.title() for recipient in RECIPIENT_DB],
+        "vendor_list": list(vendor_db),
     }
     return mock_profile
@@ -0,0 +1,148 @@
+"""Index of the known recipients of a user, to resolve the names of transfers.
+
+A name is looked up, in order of preference, as a full name, a first or last
+name, a name with typos (within a bounded edit distance), a name that sounds
+the same and finally as a name of which only some words match. All lookups are
+dictionary lookups, so they do not depend on the number of recipients.
+"""
+import collections
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Text, Tuple
+
+from actions.fuzzy import DeletionIndex, edit_distance, max_edits, normalize, soundex
+
+# ranks of the kinds of matches, the lower the better
+EXACT = 0
+NAME = 1
+TYPO = 2
+PHONETIC = 3
+PARTIAL = 4
+
+MAX_CANDIDATES = 5
+
+
+class RecipientMatch(NamedTuple):
+    recipient: Text
+    rank: int
+    distance: int = 0
+
+
+class RecipientIndex(object):
+    """Resolves a (partial, misspelled) name to the known recipients."""
+
+    def __init__(self, recipients: Iterable[Text]) -> None:
+        self.recipients: List[Text] = []
+        self._full: Dict[Text, Text] = {}
+        self._names: Dict[Text, List[Text]] = collections.defaultdict(list)
+        self._words: Dict[Text, List[Text]] = {}
+        self._typos = DeletionIndex()
+        self._sounds: Dict[Text, Set[Text]] = collections.defaultdict(set)
+        for recipient in recipients:
+            self.add(recipient)
+
+    def __len__(self) -> int:
+        return len(self.recipients)
+
+    def add(self, recipient: Text) -> None:
+        full = normalize(recipient)
+        if not full or full in self._full:
+            return
+        self.recipients.append(recipient)
+        self._full[full] = recipient
+        self._words[recipient] = full.split()
+        for name in set(full.split()):
+            self._names[name].append(recipient)
+            self._typos.add(name, recipient)
+            self._sounds[soundex(name)].add(recipient)
+
+    def lookup(self, name: Text, limit: int = MAX_CANDIDATES) -> List[RecipientMatch]:
+        """Returns the recipients matching a name, best matches first.
+
+        Only the matches of the best kind are returned. A unique match is
+        unambiguous unless only some words of the name matched, other results
+        are candidates to choose from.
+        """
+        query = normalize(name)
+        if not query:
+            return []
+
+        recipient = self._full.get(query)
+        if recipient is not None:
+            return [RecipientMatch(recipient, EXACT)]
+
+        words = query.split()
+        if len(words) == 1 and words[0] in self._names:
+            matches = [RecipientMatch(r, NAME) for r in self._names[words[0]]]
+            return matches[:limit]
+
+        matches, partial_matches = self._closest(words)
+        if not matches:
+            candidates: Optional[Set[Text]] = None
+            for word in words:
+                sounds = self._sounds.get(soundex(word), set())
+                candidates = sounds if candidates is None else candidates & sounds
+            matches = [RecipientMatch(r, PHONETIC) for r in sorted(candidates or [])]
+        return (matches or partial_matches)[:limit]
+
+    def _closest(
+        self, words: List[Text]
+    ) -> Tuple[List[RecipientMatch], List[RecipientMatch]]:
+        """Returns the recipients with names closest to all the words, and when
+        there are none, those with names closest to some of the words.
+
+        The distance of a recipient is the sum of the distances of the words.
+        """
+        exact = [word for word in words if word in self._names]
+        if exact:
+            # the words with typos only need to be compared to the names of the
+            # recipients matching the other words
+            recipients = set(self._names[exact[0]]).intersection(
+                *(self._names[word] for word in exact[1:])
+            )
+            totals = {}
+            for recipient in recipients:
+                total = 0
+                for word in words:
+                    allowed = max_edits(word)
+                    distance = min(
+                        edit_distance(word, name, allowed)
+                        for name in self._words[recipient]
+                    )
+                    if distance > allowed:
+                        break
+                    total += distance
+                else:
+                    totals[recipient] = total
+            if totals:
+                return self._best(totals, TYPO), []
+
+        # recipient -> smallest distance of each word, None if it did not match
+        distances: Dict[Text, List[Optional[int]]] = {}
+        for i, word in enumerate(words):
+            for distance, _, recipient in self._typos.search(word):
+                best = distances.setdefault(recipient, [None] * len(words))
+                if best[i] is None or distance < best[i]:
+                    best[i] = distance
+        if not distances:
+            return [], []
+
+        totals = {
+            recipient: sum(d for d in best if d is not None)
+            for recipient, best in distances.items()
+            if None not in best
+        }
+        if totals:
+            return self._best(totals, TYPO), []
+        totals = {
+            recipient: min(d for d in best if d is not None)
+            for recipient, best in distances.items()
+        }
+        return [], self._best(totals, PARTIAL)
+
+    @staticmethod
+    def _best(totals: Dict[Text, int], rank: int) -> List[RecipientMatch]:
+        distance = min(totals.values())
+        return [
+            RecipientMatch(recipient, rank, distance)
+            for recipient in sorted(totals)
+            if totals[recipient] == distance
+        ]
@@ -0,0 +1,264 @@
+"""Columnar, date-sorted index over a user's transaction history."""
+from datetime import datetime
+from typing import Dict, Text, Any, Iterator, List, NamedTuple, Optional, Tuple
+import heapq
+import math
+import time
+
+import numpy as np
+from dateutil import parser
+
+
+def to_epoch(isotime: Text) -> float:
+    """Converts an ISO 8601 timestamp into seconds since the epoch."""
+    try:
+        # much faster than dateutil for the timestamps we write ourselves
+        value = datetime.fromisoformat(isotime)
+    except ValueError:
+        value = parser.isoparse(isotime)
+    return value.timestamp()
+
+
+def to_cents(amount: Any) -> int:
+    """Converts an amount of money into integer cents."""
+    return int(round(float(amount) * 100))
+
+
+def format_cents(cents: int) -> Text:
+    """Formats integer cents as an amount of money, e.g. "-12.30"."""
+    sign = "-" if cents < 0 else ""
+    return f"{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}"
+
+
+class Transaction(NamedTuple):
+    """A transaction, as listed by `TransactionIndex.iter_transactions`.
+
+    `(epoch, vendor, index)` orders the transactions and serves as a cursor.
+    """
+
+    epoch: int
+    vendor: Text
+    index: int
+    cents: int
+
+    @property
+    def cursor(self) -> List[Any]:
+        return [self.epoch, self.vendor, self.index]
+
+
+class TransactionSeries:
+    """Transactions of one vendor, as parallel arrays sorted by date.
+
+    `epochs` holds the transaction dates in seconds since the epoch and
+    `cents` holds the amounts in integer cents, so that totals are exact.
+    A running total of the cents is kept along, so the total of any date
+    range takes two binary searches and a subtraction. The arrays are
+    over-allocated, so that appending new transactions is cheap.
+    """
+
+    __slots__ = ("_epochs", "_cents", "_totals", "_size")
+
+    def __init__(self, epochs: np.ndarray, cents: np.ndarray) -> None:
+        order = np.argsort(epochs, kind="stable")
+        epochs = np.asarray(epochs, dtype=np.int64)[order]
+        cents = np.asarray(cents, dtype=np.int64)[order]
+        self._size = len(epochs)
+        capacity = max(16, self._size + self._size // 4)
+        self._epochs = np.zeros(capacity, dtype=np.int64)
+        self._cents = np.zeros(capacity, dtype=np.int64)
+        # _totals[i] is the total of the first i transactions
+        self._totals = np.zeros(capacity + 1, dtype=np.int64)
+        self._epochs[: self._size] = epochs
+        self._cents[: self._size] = cents
+        np.cumsum(cents, out=self._totals[1 : self._size + 1])
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def epochs(self) -> np.ndarray:
+        return self._epochs[: self._size]
+
+    @property
+    def cents(self) -> np.ndarray:
+        return self._cents[: self._size]
+
+    def bounds(self, start: float, end: float) -> Tuple[int, int]:
+        """Returns the index range of transactions with start <= date <= end."""
+        epochs = self.epochs
+        lo = int(np.searchsorted(epochs, math.ceil(start), side="left"))
+        hi = int(np.searchsorted(epochs, math.floor(end), side="right"))
+        return lo, max(lo, hi)
+
+    def total(self, lo: int, hi: int) -> int:
+        """Returns the total amount in cents of the transactions lo to hi."""
+        return int(self._totals[hi] - self._totals[lo])
+
+    def search(self, start: float, end: float) -> Tuple[int, int]:
+        """Returns number and total amount in cents of transactions in range."""
+        lo, hi = self.bounds(start, end)
+        return hi - lo, self.total(lo, hi)
+
+    def iter_newest(self, vendor: Text, lo: int, hi: int) -> Iterator[Transaction]:
+        """Yields the transactions hi - 1 down to lo, one at a time."""
+        for i in range(hi - 1, lo - 1, -1):
+            yield Transaction(int(self._epochs[i]), vendor, i, int(self._cents[i]))
+
+    def append(self, epoch: float, cents: int) -> None:
+        """Adds a transaction, in amortized constant time if it is the latest.
+
+        An earlier transaction is inserted in place, which moves the later
+        transactions and updates their running totals.
+        """
+        epoch = int(epoch)
+        size = self._size
+        if size == len(self._epochs):
+            capacity = 2 * size
+            self._epochs = np.resize(self._epochs, capacity)
+            self._cents = np.resize(self._cents, capacity)
+            self._totals = np.resize(self._totals, capacity + 1)
+
+        if size == 0 or epoch >= self._epochs[size - 1]:
+            self._epochs[size] = epoch
+            self._cents[size] = cents
+            self._totals[size + 1] = self._totals[size] + cents
+        else:
+            i = int(np.searchsorted(self._epochs[:size], epoch, side="right"))
+            self._epochs[i + 1 : size + 1] = self._epochs[i:size]
+            self._cents[i + 1 : size + 1] = self._cents[i:size]
+            self._epochs[i] = epoch
+            self._cents[i] = cents
+            self._totals[i + 1 : size + 2] = self._totals[i : size + 1] + cents
+        self._size = size + 1
+
+
+class TransactionIndex:
+    """Transaction history of a user, indexed by search_type and vendor.
+
+    Replaces linear scans over the list of transaction dicts with two binary
+    searches and a subtraction of running totals per vendor.
+    """
+
+    def __init__(self) -> None:
+        self.series: Dict[Text, Dict[Text, TransactionSeries]] = {}
+
+    @classmethod
+    def from_columns(
+        cls, transaction_history: Dict[Text, Dict[Text, Tuple[Any, Any]]]
+    ) -> "TransactionIndex":
+        """Builds the index from `(epochs, cents)` arrays per vendor.
+
+        This is the format of the transaction history of `create_mock_profile`.
+        """
+        index = cls()
+        for search_type, vendors in (transaction_history or {}).items():
+            for vendor, (epochs, cents) in vendors.items():
+                index.add(search_type, vendor, epochs, cents)
+        return index
+
+    def add(
+        self, search_type: Text, vendor: Text, epochs: List[Any], cents: List[Any]
+    ) -> None:
+        """Adds (or replaces) the series of transactions of a vendor."""
+        self.series.setdefault(search_type, {})[vendor] = TransactionSeries(
+            np.asarray(epochs), np.asarray(cents)
+        )
+
+    def record(
+        self,
+        search_type: Text,
+        vendor: Text,
+        cents: int,
+        epoch: Optional[float] = None,
+    ) -> None:
+        """Appends a new transaction of a vendor, dated now by default."""
+        epoch = time.time() if epoch is None else epoch
+        subset = self.series.setdefault(search_type, {})
+        series = subset.get(vendor.lower())
+        if series is None:
+            subset[vendor.lower()] = TransactionSeries(
+                np.array([epoch]), np.array([cents])
+            )
+        else:
+            series.append(epoch, cents)
+
+    def vendors(self, search_type: Text) -> List[Text]:
+        """Names of the vendors with transactions of this search_type."""
+        return list(self.series.get(search_type, {}).keys())
+
+    def has_vendor(self, search_type: Text, vendor: Text) -> bool:
+        return vendor.lower() in self.series.get(search_type, {})
+
+    def search(
+        self,
+        search_type: Text,
+        start_time: Text,
+        end_time: Text,
+        vendor: Optional[Text] = None,
+    ) -> Tuple[int, int]:
+        """Counts and totals transactions between start_time and end_time.
+
+        Both boundaries are inclusive. When no vendor is given, transactions
+        of all vendors of the search_type are included.
+
+        Returns:
+            The number of transactions and their total amount in cents.
+        """
+        start = to_epoch(start_time)
+        end = to_epoch(end_time)
+        subset = self.series.get(search_type, {})
+
+        if vendor:
+            series = subset.get(vendor.lower())
+            selected = [series] if series is not None else []
+        else:
+            selected = list(subset.values())
+
+        numtransacts = 0
+        total = 0
+        for series in selected:
+            count, amount = series.search(start, end)
+            numtransacts += count
+            total += amount
+        return numtransacts, total
+
+    def iter_transactions(
+        self,
+        search_type: Text,
+        start_time: Text,
+        end_time: Text,
+        vendor: Optional[Text] = None,
+        after: Optional[List[Any]] = None,
+    ) -> Iterator[Transaction]:
+        """Yields the transactions between start_time and end_time, newest first.
+
+        The transactions are read lazily from the series of each vendor and
+        merged, so only one transaction per vendor is in memory at a time.
+        `after` is the cursor of the last transaction listed before, to
+        continue the listing from there.
+        """
+        start = to_epoch(start_time)
+        end = to_epoch(end_time)
+        subset = self.series.get(search_type, {})
+        if vendor:
+            vendor = vendor.lower()
+            selected = [(vendor, subset[vendor])] if vendor in subset else []
+        else:
+            selected = sorted(subset.items())
+
+        listings = []
+        for name, series in selected:
+            lo, hi = series.bounds(start, end)
+            if after:
+                hi = min(hi, self._cursor_end(series, name, after))
+            listings.append(series.iter_newest(name, lo, hi))
+        return heapq.merge(*listings, key=lambda t: t[:3], reverse=True)
+
+    @staticmethod
+    def _cursor_end(series: TransactionSeries, vendor: Text, after: List[Any]) -> int:
+        """Returns the end of the transactions of a series listed after a cursor."""
+        epoch, cursor_vendor, index = after
+        if vendor == cursor_vendor:
+            return index
+        side = "left" if vendor > cursor_vendor else "right"
+        return int(np.searchsorted(series.epochs, epoch, side=side))
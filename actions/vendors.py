@@ -0,0 +1,125 @@
+"""Catalogs of the vendors of the transactions.
+
+Resolves what a user calls a vendor ("Starbucks", "sbux", "star bucks",
+"Starbuks") to the vendor's name in the transaction history ("starbucks").
+Names and aliases are found with a dictionary lookup, other names with a
+trigram index, whose cost depends on the length of the name rather than on
+the number of vendors. Resolved names are memoized.
+
+The vendors of `vendor_catalog.yml` and their aliases are shared by all
+users. Every account resolves names with its own catalog, of the vendors it
+has transactions with, so the vendors of one user never make the names of
+another user ambiguous.
+"""
+import collections
+import functools
+import logging
+import pathlib
+import threading
+from typing import Dict, Iterable, Optional, Text
+
+import ruamel.yaml
+
+from actions.fuzzy import TrigramIndex, normalize
+
+logger = logging.getLogger(__name__)
+
+here = pathlib.Path(__file__).parent.absolute()
+VENDOR_CATALOG_FILE = f"{here}/vendor_catalog.yml"
+
+MIN_SIMILARITY = 0.5
+RESOLVE_CACHE_SIZE = 4096
+
+
+class VendorCatalog(object):
+    """Normalized names and aliases of vendors, with a fuzzy index."""
+
+    def __init__(self, min_similarity: float = MIN_SIMILARITY) -> None:
+        self.min_similarity = min_similarity
+        # normalized name or alias, with and without spaces -> vendor
+        self._names: Dict[Text, Text] = {}
+        self._index = TrigramIndex()
+        self._lock = threading.Lock()
+        self.resolve = functools.lru_cache(maxsize=RESOLVE_CACHE_SIZE)(self._resolve)
+
+    def __len__(self) -> int:
+        return len(set(self._names.values()))
+
+    def __contains__(self, vendor: Text) -> bool:
+        return self._names.get(normalize(vendor)) == vendor
+
+    def add(self, vendor: Text, aliases: Iterable[Text] = ()) -> None:
+        """Adds a vendor, by its name in the transaction history, and its aliases.
+
+        A name or alias that is already known keeps its vendor.
+        """
+        with self._lock:
+            added = False
+            for name in [vendor, *aliases]:
+                name = normalize(name)
+                for key in {name, name.replace(" ", "")}:
+                    if key and key not in self._names:
+                        self._names[key] = vendor
+                        self._index.add(key, vendor)
+                        added = True
+            if added:
+                # names that did not resolve before may resolve now
+                self.resolve.cache_clear()
+
+    def subset(self, vendors: Iterable[Text]) -> "VendorCatalog":
+        """Returns a catalog of the given vendors, with their aliases in this one."""
+        vendors = list(dict.fromkeys(vendors))
+        aliases = collections.defaultdict(list)
+        with self._lock:
+            for name, vendor in self._names.items():
+                aliases[vendor].append(name)
+        catalog = VendorCatalog(self.min_similarity)
+        for vendor in vendors:
+            catalog.add(vendor, aliases.get(vendor, []))
+        return catalog
+
+    def _resolve(self, name: Text) -> Optional[Text]:
+        """Returns the vendor a name refers to, or None if there is none.
+
+        A name that is equally similar to several vendors does not resolve.
+        """
+        query = normalize(name)
+        if not query:
+            return None
+        vendor = self._names.get(query) or self._names.get(query.replace(" ", ""))
+        if vendor is not None:
+            return vendor
+
+        matches = self._index.search(query, self.min_similarity)
+        if not matches:
+            return None
+        best = matches[0][0]
+        vendors = {vendor for similarity, _, vendor in matches if similarity == best}
+        if len(vendors) > 1:
+            logger.debug(f"`{name}` is equally similar to vendors {sorted(vendors)}")
+            return None
+        return vendors.pop()
+
+
+def load_vendor_catalog(path: Text = VENDOR_CATALOG_FILE) -> VendorCatalog:
+    """Creates a vendor catalog from its configuration file."""
+    with open(path, "r") as f:
+        config = (ruamel.yaml.safe_load(f) or {}).get("vendor_catalog", {})
+    catalog = VendorCatalog(config.get("min_similarity", MIN_SIMILARITY))
+    for vendor, vendor_config in (config.get("vendors") or {}).items():
+        catalog.add(vendor, (vendor_config or {}).get("aliases", []))
+    return catalog
+
+
+_vendor_catalog: Optional[VendorCatalog] = None
+_vendor_catalog_lock = threading.Lock()
+
+
+def get_vendor_catalog() -> VendorCatalog:
+    """Returns the vendor catalog shared by all users."""
+    global _vendor_catalog
+    if _vendor_catalog is None:
+        with _vendor_catalog_lock:
+            if _vendor_catalog is None:
+                _vendor_catalog = load_vendor_catalog()
+    return _vendor_catalog
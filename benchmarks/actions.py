@@ -0,0 +1,511 @@
+"""Benchmarks of the custom actions and form validators, run offline.
+
+Every benchmark drives an action with a synthetic tracker, for a mock account
+of a configurable size, and reports latency percentiles, the peak memory
+allocated per call and the size of the serialized events and messages.
+
+    python -m benchmarks.actions --history-days 730 --vendors 3
+    python -m benchmarks.actions --save      # store baselines of new benchmarks
+    python -m benchmarks.actions --compare   # fail on regressions vs baselines
+
+Only the deterministic results (events, payload and allocation sizes) can
+fail the comparison, latencies depend on the machine and its load and are
+compared to the baselines for information only.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Text,
+    Tuple,
+)
+
+import ruamel.yaml
+from rasa_sdk import Tracker
+from rasa_sdk.executor import CollectingDispatcher
+
+from actions import actions
+from actions.custom_forms import CustomFormValidationAction, CF_SLOT
+from actions.handoff import ActionHandoff, ActionHandoffOptions, HandoffRegistry
+from actions.ledger import ledger, LEDGER_SLOT
+from actions.profile import create_mock_profile, RECIPIENT_DB
+
+here = os.path.dirname(os.path.abspath(__file__))
+BASELINES_FILE = os.path.join(here, "baselines.json")
+DOMAIN_FILE = os.path.join(os.path.dirname(here), "domain.yml")
+
+SENDER_ID = "benchmark"
+# account of the benchmarks that pay from it, opened again before every call
+PAYMENT_LEDGER_ID = "benchmark payments"
+START_TIME = "2020-01-01T00:00:00.000-08:00"
+END_TIME = "2020-12-01T00:00:00.000-08:00"
+# number of slots of the synthetic form, to benchmark the form validation
+FORM_SLOTS = 20
+# latency of the API calls of the validators of the synthetic form, in seconds
+API_DELAY = 0.001
+
+
+class Benchmark(NamedTuple):
+    name: Text
+    tracker: Tracker
+    run: Callable[[CollectingDispatcher, Tracker, Dict[Text, Any]], Awaitable[Any]]
+    # called before every run, and not timed
+    setup: Optional[Callable[[], Any]] = None
+
+
+def load_domain() -> Dict[Text, Any]:
+    with open(DOMAIN_FILE, "r") as f:
+        return ruamel.yaml.safe_load(f)
+
+
+def make_tracker(
+    slots: Dict[Text, Any],
+    entities: List[Dict[Text, Any]] = (),
+    events: List[Dict[Text, Any]] = (),
+    active_loop: Text = None,
+    ledger_id: Text = SENDER_ID,
+) -> Tracker:
+    """Creates a tracker, as it is sent to the action server's webhook."""
+    return Tracker.from_dict(
+        {
+            "sender_id": SENDER_ID,
+            "slots": {LEDGER_SLOT: ledger_id, **slots},
+            "latest_message": {"text": "", "entities": list(entities)},
+            "events": list(events),
+            "paused": False,
+            "followup_action": None,
+            "active_loop": {"name": active_loop} if active_loop else {},
+            "latest_action_name": "action_listen",
+        }
+    )
+
+
+def slot_events(slots: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    return [
+        {"event": "slot", "name": name, "value": value} for name, value in slots.items()
+    ]
+
+
+def many_slots_form(
+    number: int, delay: float = 0, independent: bool = False
+) -> CustomFormValidationAction:
+    """Returns the validation action of a form with many slots.
+
+    `validate_slot_<i>` accepts any value but "invalid", after waiting `delay`
+    seconds as if it called an API. With `independent`, all slots are declared
+    independent, so that they are validated concurrently.
+    """
+
+    async def validate_slot(
+        self: CustomFormValidationAction,
+        value: Any,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any],
+        slot: Text,
+    ) -> Dict[Text, Any]:
+        if delay:
+            await asyncio.sleep(delay)
+        if value == "invalid":
+            dispatcher.utter_message(text=f"{value} is not a valid {slot}")
+            return {slot: None}
+        return {slot: value}
+
+    def validator(slot: Text) -> Callable:
+        return lambda self, value, dispatcher, tracker, domain: validate_slot(
+            self, value, dispatcher, tracker, domain, slot
+        )
+
+    methods = {f"validate_slot_{i}": validator(f"slot_{i}") for i in range(number)}
+    methods["name"] = lambda self: "validate_many_slots_form"
+    if independent:
+        methods["independent_slots"] = [f"slot_{i}" for i in range(number)]
+    return type("ValidateManySlotsForm", (CustomFormValidationAction,), methods)()
+
+
+def benchmarks(profile: Dict[Text, Any], domain: Dict[Text, Any]) -> List[Benchmark]:
+    account = ledger.account(SENDER_ID)
+    recipients = profile["known_recipients"]
+    profile_slots = {
+        "currency": account.currency,
+        "known_recipients": recipients,
+        "vendor_list": account.vendor_list,
+    }
+    amount = [
+        {
+            "entity": "amount-of-money",
+            "value": 50,
+            "additional_info": {"value": 50.0, "unit": "$"},
+        }
+    ]
+    time_entity = [
+        {
+            "entity": "time",
+            "additional_info": {"type": "value", "value": START_TIME, "grain": "day"},
+        }
+    ]
+    # a transposition in the last name of the last recipient
+    first_name, last_name = recipients[-1].split()[:2]
+    misspelled = f"{first_name} {last_name[0]}{last_name[2:0:-1]}{last_name[3:]}"
+    vendor = account.vendor_list[0]
+    misspelled_vendor = f"{vendor[0]}{vendor[2:]}".title()
+    search_form = actions.ValidateTransactionSearchForm()
+    pay_cc_slots = {
+        "credit_card": "iron bank",
+        "amount-of-money": 50,
+        "time": START_TIME,
+    }
+
+    transaction_search = make_tracker(
+        {
+            **profile_slots,
+            "confirm": "yes",
+            "search_type": "spend",
+            "vendor_name": account.vendor_list[0],
+            "start_time": START_TIME,
+            "end_time": END_TIME,
+        }
+    )
+    show_transactions = make_tracker(
+        {
+            **profile_slots,
+            actions.TRANSACTION_CURSOR_SLOT: {
+                "search_type": "spend",
+                "vendor": None,
+                "start_time": START_TIME,
+                "end_time": END_TIME,
+                "after": None,
+            },
+        }
+    )
+    pay_cc = make_tracker(
+        {**profile_slots, "credit_card": "iron bank"}, entities=amount
+    )
+    pay_cc_confirmed = make_tracker(
+        {**profile_slots, **pay_cc_slots, "confirm": "yes"},
+        ledger_id=PAYMENT_LEDGER_ID,
+    )
+    transfer = make_tracker(profile_slots)
+    validate = make_tracker(
+        {**profile_slots, "requested_slot": "time", "continue_form": "yes"},
+        entities=amount + time_entity,
+        events=[{"event": "action", "name": "action_listen"}]
+        + slot_events(pay_cc_slots),
+        active_loop="cc_payment_form",
+    )
+    # all slots of the form are filled in one turn
+    form = many_slots_form(FORM_SLOTS)
+    io_form = many_slots_form(FORM_SLOTS, delay=API_DELAY)
+    concurrent_io_form = many_slots_form(FORM_SLOTS, delay=API_DELAY, independent=True)
+    form_slots = {f"slot_{i}": f"value {i}" for i in range(FORM_SLOTS)}
+    validate_form = make_tracker(
+        {"requested_slot": "slot_0", CF_SLOT: "yes"},
+        events=[{"event": "action", "name": "action_listen"}] + slot_events(form_slots),
+        active_loop="many_slots_form",
+    )
+    validate_form_invalid = make_tracker(
+        {"requested_slot": "slot_0", CF_SLOT: "yes"},
+        events=[{"event": "action", "name": "action_listen"}]
+        + slot_events({**form_slots, "slot_0": "invalid"}),
+        active_loop="many_slots_form",
+    )
+    validate_form_cancelled = make_tracker(
+        {"requested_slot": CF_SLOT},
+        events=[{"event": "action", "name": "action_listen"}]
+        + slot_events({CF_SLOT: "no", **form_slots}),
+        active_loop="many_slots_form",
+    )
+
+    # every slot of the domain, as at the end of a conversation
+    handoff = make_tracker({"handoff_to": "helpdesk_assistant"})
+    # the health checks hit the network, they are not benchmarked
+    handoff_registry = HandoffRegistry(health_check_interval=None)
+    session_start = make_tracker(
+        {
+            **{
+                slot: mapping.get("initial_value")
+                for slot, mapping in domain["slots"].items()
+            },
+            **profile_slots,
+            "user_profile": {"id": "anonymous", "name": "anonymous"},
+            "user_name": "anonymous",
+        }
+    )
+
+    return [
+        Benchmark(
+            "action_transaction_search",
+            transaction_search,
+            lambda d, t, domain: actions.ActionTransactionSearch().run(d, t, domain),
+        ),
+        Benchmark(
+            "action_show_transactions",
+            show_transactions,
+            lambda d, t, domain: actions.ActionShowTransactions().run(d, t, domain),
+        ),
+        Benchmark(
+            "action_pay_cc",
+            pay_cc_confirmed,
+            lambda d, t, domain: actions.ActionPayCC().run(d, t, domain),
+            # every call pays from the same account, as it was opened
+            lambda: ledger.open_account(PAYMENT_LEDGER_ID, profile),
+        ),
+        Benchmark(
+            "validate_cc_payment_form.validate_amount_of_money",
+            pay_cc,
+            lambda d, t, domain: actions.ValidatePayCCForm().validate_amount_of_money(
+                "50", d, t, {}
+            ),
+        ),
+        Benchmark(
+            "validate_transfer_money_form.validate_PERSON",
+            transfer,
+            lambda d, t, domain: actions.ValidateTransferMoneyForm().validate_PERSON(
+                recipients[-1].split()[0], d, t, {}
+            ),
+        ),
+        Benchmark(
+            "validate_transfer_money_form.validate_PERSON (typo)",
+            transfer,
+            lambda d, t, domain: actions.ValidateTransferMoneyForm().validate_PERSON(
+                misspelled, d, t, {}
+            ),
+        ),
+        Benchmark(
+            "validate_transaction_search_form.validate_vendor_name (typo)",
+            transaction_search,
+            lambda d, t, domain: search_form.validate_vendor_name(
+                misspelled_vendor, d, t, {}
+            ),
+        ),
+        Benchmark(
+            "validate_cc_payment_form.validate",
+            validate,
+            lambda d, t, domain: actions.ValidatePayCCForm().validate(d, t, domain),
+        ),
+        Benchmark(
+            f"validate_many_slots_form.validate ({FORM_SLOTS} slots)",
+            validate_form,
+            lambda d, t, domain: form.validate(d, t, domain),
+        ),
+        Benchmark(
+            f"validate_many_slots_form.validate ({FORM_SLOTS} slots, invalid)",
+            validate_form_invalid,
+            lambda d, t, domain: form.validate(d, t, domain),
+        ),
+        Benchmark(
+            f"validate_many_slots_form.validate ({FORM_SLOTS} slots, cancelled)",
+            validate_form_cancelled,
+            lambda d, t, domain: form.validate(d, t, domain),
+        ),
+        Benchmark(
+            f"validate_many_slots_form.validate ({FORM_SLOTS} slots, API)",
+            validate_form,
+            lambda d, t, domain: io_form.validate(d, t, domain),
+        ),
+        Benchmark(
+            f"validate_many_slots_form.validate ({FORM_SLOTS} slots, API, concurrent)",
+            validate_form,
+            lambda d, t, domain: concurrent_io_form.validate(d, t, domain),
+        ),
+        Benchmark(
+            "action_handoff_options",
+            handoff,
+            lambda d, t, domain: ActionHandoffOptions(handoff_registry).run(
+                d, t, domain
+            ),
+        ),
+        Benchmark(
+            "action_handoff",
+            handoff,
+            lambda d, t, domain: ActionHandoff(handoff_registry).run(d, t, domain),
+        ),
+        Benchmark(
+            "action_session_start",
+            session_start,
+            lambda d, t, domain: actions.ActionSessionStart().run(d, t, domain),
+        ),
+    ]
+
+
+def random_names(number: int, seed: int) -> List[Text]:
+    """Returns distinct, pronounceable first and last names."""
+    rng = random.Random(seed)
+
+    def word() -> Text:
+        return "".join(
+            rng.choice("bcdfghjklmnprstvwz") + rng.choice("aeiou")
+            for _ in range(rng.randint(2, 4))
+        )
+
+    names = set()
+    while len(names) < number:
+        names.add(f"{word().title()} {word().title()}")
+    return sorted(names)
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def measure(
+    benchmark: Benchmark, domain: Dict[Text, Any], iterations: int
+) -> Dict[Text, Any]:
+    loop = asyncio.get_event_loop()
+
+    def call() -> Tuple[Any, CollectingDispatcher]:
+        dispatcher = CollectingDispatcher()
+        if benchmark.setup is not None:
+            benchmark.setup()
+        output = loop.run_until_complete(
+            benchmark.run(dispatcher, benchmark.tracker, domain)
+        )
+        return output, dispatcher
+
+    output, dispatcher = call()
+
+    latencies = []
+    for _ in range(iterations):
+        if benchmark.setup is not None:
+            benchmark.setup()
+        start = time.perf_counter()
+        loop.run_until_complete(
+            benchmark.run(CollectingDispatcher(), benchmark.tracker, domain)
+        )
+        latencies.append((time.perf_counter() - start) * 1e6)
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(min(iterations, 20)):
+        if benchmark.setup is not None:
+            benchmark.setup()
+        tracemalloc.clear_traces()
+        loop.run_until_complete(
+            benchmark.run(CollectingDispatcher(), benchmark.tracker, domain)
+        )
+        peaks.append(tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    events = output if isinstance(output, list) else []
+    return {
+        "p50_us": percentile(latencies, 50),
+        "p90_us": percentile(latencies, 90),
+        "p99_us": percentile(latencies, 99),
+        "alloc_bytes": statistics.median(peaks),
+        "events": len(events),
+        "event_bytes": len(json.dumps(output)),
+        "message_bytes": len(json.dumps(dispatcher.messages)),
+        "request_bytes": len(json.dumps(benchmark.tracker.current_state())),
+    }
+
+
+# results that must not grow by more than the tolerance compared to baselines
+COMPARED = ["events", "alloc_bytes", "event_bytes", "message_bytes"]
+# results that are too noisy to fail on, only reported when they grew
+REPORTED = ["p50_us", "p90_us"]
+
+
+def compare(
+    results: Dict[Text, Dict[Text, Any]],
+    baselines: Dict[Text, Dict[Text, Any]],
+    tolerance: float,
+    keys: List[Text] = COMPARED,
+) -> List[Text]:
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name, {})
+        for key in keys:
+            if key in baseline and result[key] > baseline[key] * (1 + tolerance):
+                regressions.append(
+                    f"{name} {key}: {result[key]:.0f} > {baseline[key]:.0f} "
+                    f"(+{tolerance:.0%})"
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--history-days", type=int, default=730)
+    parser.add_argument("--vendors", type=int, default=3)
+    parser.add_argument("--recipients", type=int, default=len(RECIPIENT_DB))
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baselines", default=BASELINES_FILE)
+    parser.add_argument(
+        "--save", action="store_true", help="store the baselines of new benchmarks"
+    )
+    parser.add_argument(
+        "--overwrite", action="store_true", help="with --save, replace all baselines"
+    )
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args()
+
+    vendors = None
+    if args.vendors != 3:
+        vendors = [f"vendor {i}" for i in range(args.vendors)]
+    recipients = [name.title() for name in RECIPIENT_DB][: args.recipients]
+    recipients += random_names(args.recipients - len(recipients), args.seed)
+    profile = create_mock_profile(
+        seed=args.seed, history_days=args.history_days, vendors=vendors
+    )
+    profile["known_recipients"] = recipients
+    ledger.open_account(SENDER_ID, profile)
+
+    results = {}
+    print(
+        f"{'benchmark':62} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} "
+        f"{'alloc B':>9} {'events':>6} {'event B':>8} {'msg B':>7}"
+    )
+    domain = load_domain()
+    for benchmark in benchmarks(profile, domain):
+        result = measure(benchmark, domain, args.iterations)
+        results[benchmark.name] = result
+        print(
+            f"{benchmark.name:62} {result['p50_us']:9.1f} {result['p90_us']:9.1f} "
+            f"{result['p99_us']:9.1f} {result['alloc_bytes']:9.0f} "
+            f"{result['events']:6d} {result['event_bytes']:8d} "
+            f"{result['message_bytes']:7d}"
+        )
+
+    if args.save:
+        baselines = {}
+        if not args.overwrite and os.path.exists(args.baselines):
+            with open(args.baselines, "r") as f:
+                baselines = json.load(f)
+        new = {name: res for name, res in results.items() if name not in baselines}
+        baselines.update(new)
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Saved {len(new)} baselines to {args.baselines}")
+
+    if args.compare:
+        with open(args.baselines, "r") as f:
+            baselines = json.load(f)
+        for slower in compare(results, baselines, args.tolerance, REPORTED):
+            print(f"slower {slower}")
+        regressions = compare(results, baselines, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
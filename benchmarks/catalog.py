@@ -0,0 +1,126 @@
+"""Benchmark of the local book catalog on a generated catalog of books.
+
+Imports the books, then times searches of whole words, prefixes, words with a
+typo and several words, and author lookups, and reports the latency
+percentiles of each kind of query:
+
+    python -m benchmarks.catalog --books 20000 --queries 200
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Text
+
+from actions.api.catalog import BookCatalog
+from benchmarks.loadgen import percentile
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "sen", "to", "vi", "dor", "el", "an", "ber", "qu"]
+
+
+def generate_books(count: int, seed: int = 42) -> List[Dict[Text, Any]]:
+    rng = random.Random(seed)
+    words = sorted(
+        {"".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(5000)}
+    )
+    authors = [
+        {"id": i, "name": f"{rng.choice(words).title()} {rng.choice(words).title()}"}
+        for i in range(1, count // 10 + 2)
+    ]
+    return [
+        {
+            "id": i,
+            "title": " ".join(rng.choices(words, k=rng.randint(1, 5))).title(),
+            "ratings_count": int(rng.paretovariate(1.2) * 100),
+            "average_rating": round(rng.uniform(2.5, 5), 2),
+            "authors": [rng.choice(authors)],
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def typo(word: Text, rng: random.Random) -> Text:
+    i = rng.randrange(len(word))
+    return word[:i] + word[i + 1 :]
+
+
+def queries(books: List[Dict[Text, Any]], count: int, seed: int = 7):
+    rng = random.Random(seed)
+    sample = rng.sample(books, count)
+    words = [rng.choice(book["title"].lower().split()) for book in sample]
+    return {
+        "word": [(word,) for word in words],
+        "prefix": [(word[: max(2, len(word) // 2)],) for word in words],
+        "typo": [(typo(word, rng),) for word in words if len(word) > 4],
+        "words": [(book["title"],) for book in sample],
+        "author": [(book["authors"][0]["name"].lower(),) for book in sample],
+    }
+
+
+def time_calls(func: Callable, calls: List[tuple]) -> Dict[Text, float]:
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "queries": len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def benchmark(book_count: int, query_count: int) -> Dict[Text, Any]:
+    books = generate_books(book_count)
+    path = os.path.join(tempfile.mkdtemp(), "books.db")
+    catalog = BookCatalog(path)
+    start = time.perf_counter()
+    catalog.add_books(books)
+    results: Dict[Text, Any] = {
+        "books": len(catalog),
+        "import_s": time.perf_counter() - start,
+    }
+    catalog.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    results["size_mb"] = os.path.getsize(path) / 1e6
+
+    start = time.perf_counter()
+    catalog.search("warm up")
+    results["vocabulary_s"] = time.perf_counter() - start
+
+    for kind, calls in queries(books, query_count).items():
+        func = catalog.find_author if kind == "author" else catalog.search
+        results[kind] = time_calls(func, calls)
+    catalog.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--json", help="file to write the results to")
+    args = parser.parse_args()
+
+    results = benchmark(args.books, args.queries)
+    print(
+        f"{results['books']} books imported in {results['import_s']:.1f} s, "
+        f"{results['size_mb']:.1f} MB, typo index built in "
+        f"{results['vocabulary_s']:.2f} s"
+    )
+    print(f"{'query':<8} {'count':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    for kind in ("word", "prefix", "typo", "words", "author"):
+        result = results[kind]
+        print(
+            f"{kind:<8} {result['queries']:6d} {result['p50_ms']:8.2f} "
+            f"{result['p99_ms']:8.2f}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
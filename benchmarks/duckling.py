@@ -0,0 +1,159 @@
+"""Benchmark of the Duckling entity extraction, as the DucklingEntityExtractor calls it.
+
+Sends the texts of the NLU examples and the test stories to Duckling's
+`/parse` endpoint, a first time (cold cache) and then again (warm cache), and
+reports latency percentiles and the throughput of each round. By default, it
+runs the caching proxy with the pure-Python stand-in in-process, so it needs
+neither Duckling nor the network:
+
+    python -m benchmarks.duckling --rounds 3 --concurrency 8
+    python -m benchmarks.duckling --url http://localhost:8000   # Duckling itself
+    python -m benchmarks.duckling --url http://localhost:8001   # a running proxy
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Text
+
+import aiohttp
+import ruamel.yaml
+from aiohttp import web
+
+from benchmarks.loadgen import parse_entities, percentile
+from duckling_proxy.server import DucklingProxy, proxy_app
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+TEXT_FILES = [
+    os.path.join(root, "data", "nlu", "*.yml"),
+    os.path.join(root, "tests", "test_stories.yml"),
+]
+DIMS = ["amount-of-money", "time", "number"]
+
+
+def load_texts(patterns: List[Text]) -> List[Text]:
+    """Returns the distinct texts of the NLU examples and test stories."""
+    texts = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, "r") as f:
+                data = ruamel.yaml.safe_load(f) or {}
+            for example in data.get("nlu", []):
+                for line in (example.get("examples") or "").splitlines():
+                    if line.strip().startswith("- "):
+                        texts.append(parse_entities(line.strip()[2:])[0])
+            for story in data.get("stories", []):
+                for step in story.get("steps", []):
+                    if step.get("user"):
+                        texts.append(parse_entities(step["user"])[0])
+    return list(dict.fromkeys(text for text in texts if text))
+
+
+async def run_round(
+    session: aiohttp.ClientSession, url: Text, texts: List[Text], concurrency: int
+) -> Dict[Text, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def parse(text: Text) -> None:
+        nonlocal errors
+        payload = {
+            "text": text,
+            "locale": "en_US",
+            "dims": json.dumps(DIMS),
+            "reftime": int(time.time() * 1000),
+        }
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.post(f"{url}/parse", data=payload) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(parse(text) for text in texts))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(texts),
+        "errors": errors,
+        "requests_per_s": len(texts) / elapsed,
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+async def benchmark(
+    url: Optional[Text], texts: List[Text], rounds: int, concurrency: int
+) -> Dict[Text, Any]:
+    runner = None
+    proxy = None
+    if url is None:
+        proxy = DucklingProxy()
+        runner = web.AppRunner(proxy_app(proxy))
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        url = f"http://127.0.0.1:{port}"
+
+    results: Dict[Text, Any] = {"url": url, "texts": len(texts), "rounds": []}
+    try:
+        async with aiohttp.ClientSession() as session:
+            for _ in range(rounds):
+                results["rounds"].append(
+                    await run_round(session, url, texts, concurrency)
+                )
+            async with session.get(f"{url}/stats") as response:
+                if response.status == 200:
+                    results["cache"] = await response.json()
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--url", help="Duckling or proxy to benchmark, by default an in-process proxy"
+    )
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--json", help="file to write the results to")
+    args = parser.parse_args()
+
+    texts = load_texts(TEXT_FILES)
+    results = asyncio.get_event_loop().run_until_complete(
+        benchmark(args.url, texts, args.rounds, args.concurrency)
+    )
+
+    print(f"{results['texts']} texts against {results['url']}")
+    print(f"{'round':>5} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} errors")
+    for i, result in enumerate(results["rounds"], 1):
+        print(
+            f"{i:5d} {result['requests_per_s']:8.1f} {result['p50_ms']:8.2f} "
+            f"{result['p90_ms']:8.2f} {result['p99_ms']:8.2f} {result['errors']:6d}"
+        )
+    if "cache" in results:
+        cache = results["cache"]
+        print(
+            f"cache: {cache['hit_rate']:.0%} hits, {cache['entries']} entries, "
+            f"{cache['coalesced']} coalesced"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
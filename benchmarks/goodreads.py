@@ -0,0 +1,198 @@
+"""Benchmark of the async Goodreads client against a local Goodreads stub.
+
+Authenticates the user, lists their shelves and library, fetches the books of
+the library and their authors, and searches a few queries, three ways:
+
+- `sequential`: one request at a time and every book fetched on its own, the
+  way the betterreads client does it;
+- `batched`: with the concurrency and caching of `AsyncGoodreadsAPI`, recording
+  the responses to a fixture file;
+- `replay`: replaying the fixture file, without any network access.
+
+It then pages through the results of a search, waiting `--render` seconds
+per page as the bot would to show it, without and with prefetching the next
+page, and reports the time spent waiting for the pages after the first.
+
+    python -m benchmarks.goodreads --delay 0.02 --rate 50 --burst 10
+    python -m benchmarks.goodreads --fixtures goodreads.json   # replay only
+
+The stub has no rate limit: `--rate` is the client's own, Goodreads allows
+one request per second.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Text
+
+from aiohttp import web
+
+from actions.api.cache import ResponseCache
+from actions.api.goodreads import (
+    RECORD,
+    REPLAY,
+    SEARCH_PAGE_SIZE,
+    AsyncGoodreadsAPI,
+)
+from benchmarks.stubs import goodreads_app
+
+QUERIES = ["dragon", "winter", "sea"]
+SEARCH_PAGES = 2
+PAGING_QUERY = "the"
+PAGING_PAGES = 5
+
+
+async def scenario(client: AsyncGoodreadsAPI, sequential: bool = False) -> int:
+    """Runs the scenario, returns the number of books it saw."""
+    session = await client.authenticate("token", "secret")
+    shelves = await client.shelves(session)
+    if sequential:
+        shelf_books = [
+            await client.shelf_books(session, shelf["name"]) for shelf in shelves
+        ]
+        book_ids = {book["id"] for books in shelf_books for book in books}
+        books = [await client.book(book_id) for book_id in book_ids]
+        authors = {author["id"] for book in books for author in book["authors"]}
+        for author_id in authors:
+            await client.author(author_id)
+        for query in QUERIES:
+            for page in range(1, SEARCH_PAGES + 1):
+                for book in await client.search_books(query, page=page):
+                    await client.book(book["id"])
+        return len(books)
+
+    library = await client.library(session)
+    book_ids = {book["id"] for books in library.values() for book in books}
+    books = await client.books(book_ids)
+    await client.authors(author["id"] for book in books for author in book["authors"])
+    await asyncio.gather(
+        *(
+            client.search_books(query, page=page)
+            for query in QUERIES
+            for page in range(1, SEARCH_PAGES + 1)
+        )
+    )
+    return len(books)
+
+
+async def run(
+    name: Text, client: AsyncGoodreadsAPI, sequential: bool = False
+) -> Dict[Text, Any]:
+    start = time.perf_counter()
+    try:
+        books = await scenario(client, sequential)
+    finally:
+        await client.close()
+    return {
+        "name": name,
+        "seconds": time.perf_counter() - start,
+        "requests": client.requests,
+        "books": books,
+    }
+
+
+async def page_turns(
+    name: Text, client: AsyncGoodreadsAPI, render: float, prefetch: bool
+) -> Dict[Text, Any]:
+    search = client.iter_books(PAGING_QUERY, prefetch=prefetch)
+    waited = 0.0
+    books = 0
+    try:
+        for page in range(PAGING_PAGES):
+            start = time.perf_counter()
+            books += len(await search.take(SEARCH_PAGE_SIZE))
+            if page:
+                waited += time.perf_counter() - start
+            await asyncio.sleep(render)
+    finally:
+        search.close()
+        await client.close()
+    return {
+        "name": name,
+        "seconds": waited,
+        "requests": client.requests,
+        "books": books,
+    }
+
+
+async def benchmark(
+    fixtures: Optional[Text], delay: float, rate: float, burst: int, render: float
+) -> List[Dict[Text, Any]]:
+    results = []
+    if fixtures and os.path.exists(fixtures):
+        client = AsyncGoodreadsAPI(
+            cache=ResponseCache(), fixtures=fixtures, fixture_mode=REPLAY
+        )
+        return [await run("replay", client)]
+
+    runner = web.AppRunner(goodreads_app(delay=delay))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    fixtures = fixtures or os.path.join(tempfile.mkdtemp(), "goodreads.json")
+    try:
+        # a cache too small to keep anything, as betterreads has none
+        client = AsyncGoodreadsAPI(
+            url, rate=rate, burst=burst, max_concurrency=1, cache=ResponseCache(0)
+        )
+        results.append(await run("sequential", client, sequential=True))
+        client = AsyncGoodreadsAPI(
+            url,
+            rate=rate,
+            burst=burst,
+            cache=ResponseCache(),
+            fixtures=fixtures,
+            fixture_mode=RECORD,
+        )
+        results.append(await run("batched", client))
+        for prefetch in (False, True):
+            client = AsyncGoodreadsAPI(
+                url, rate=rate, burst=burst, cache=ResponseCache()
+            )
+            name = "prefetched" if prefetch else "paged"
+            results.append(await page_turns(name, client, render, prefetch))
+    finally:
+        await runner.cleanup()
+    client = AsyncGoodreadsAPI(
+        cache=ResponseCache(), fixtures=fixtures, fixture_mode=REPLAY
+    )
+    results.append(await run("replay", client))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--fixtures",
+        help="fixture file to replay if it exists, or to record the batched run to",
+    )
+    parser.add_argument(
+        "--delay", type=float, default=0.02, help="latency of the stub responses"
+    )
+    parser.add_argument("--rate", type=float, default=50.0)
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument(
+        "--render", type=float, default=0.1, help="seconds to show a page of books"
+    )
+    parser.add_argument("--json", help="file to write the results to")
+    args = parser.parse_args()
+
+    results = asyncio.get_event_loop().run_until_complete(
+        benchmark(args.fixtures, args.delay, args.rate, args.burst, args.render)
+    )
+    print(f"{'run':<12} {'seconds':>8} {'requests':>8} {'books':>6}")
+    for result in results:
+        print(
+            f"{result['name']:<12} {result['seconds']:8.3f} "
+            f"{result['requests']:8d} {result['books']:6d}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
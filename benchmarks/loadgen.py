@@ -0,0 +1,524 @@
+"""Load generator that replays conversations against the action server's webhook.
+
+Conversations are built from the stories in `data/stories`, the test stories
+and the handoff rules. Every virtual user replays one conversation: the user
+turns and the predicted actions are added to its tracker, and every custom
+action, form validation included, is sent to the webhook as Rasa would send it.
+Forms that complete in a story are filled with realistic values, one slot per
+turn, and the events returned by the action server are applied to the tracker.
+
+    rasa run actions --port 5055
+    python -m benchmarks.loadgen --concurrency 20 --rate 10 --duration 60
+
+Conversations start at `--rate` per second (Poisson arrivals), or as fast as
+possible without a rate, and at most `--concurrency` of them run at a time.
+Throughput, a latency histogram and the error rate are reported per action.
+"""
+import argparse
+import asyncio
+import collections
+import glob
+import json
+import os
+import random
+import re
+import sys
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Text, Tuple
+
+import aiohttp
+import ruamel.yaml
+
+from actions.profile import CREDIT_CARD_DB, RECIPIENT_DB, VENDOR_DB
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+DOMAIN_FILE = os.path.join(root, "domain.yml")
+CONVERSATION_FILES = [
+    os.path.join(root, "data", "stories", "*.yml"),
+    os.path.join(root, "tests", "test_stories.yml"),
+    os.path.join(root, "data", "rules", "rules_handoff.yml"),
+]
+
+WEBHOOK_URL = "http://localhost:5055/webhook"
+# upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf"))
+
+TIME = "2020-11-01T00:00:00.000-07:00"
+
+# annotated entities in the user text: [text](entity) or [text]{"entity": ...}
+ENTITY_PATTERN = re.compile(
+    r"\[(?P<text>[^\]]+)\](?:\((?P<entity>[^)]+)\)|(?P<json>{[^}]+}))"
+)
+
+
+class FormTurn(NamedTuple):
+    """A user turn that fills a slot of an active form."""
+
+    slot: Text
+    value: Any
+    intent: Text = "inform"
+    entities: Tuple[Dict[Text, Any], ...] = ()
+    # custom action asking for the slot before the turn, if any
+    ask: Optional[Text] = None
+
+
+def amount_entity(amount: float) -> Dict[Text, Any]:
+    return {
+        "entity": "amount-of-money",
+        "value": amount,
+        "additional_info": {"value": amount, "unit": "$"},
+    }
+
+
+def time_entity(isotime: Text, grain: Text = "month") -> Dict[Text, Any]:
+    return {
+        "entity": "time",
+        "value": isotime,
+        "additional_info": {"type": "value", "value": isotime, "grain": grain},
+    }
+
+
+def form_turns(rng: random.Random) -> Dict[Text, List[FormTurn]]:
+    """Returns the user turns that fill each form, with random values."""
+    credit_card = rng.choice(CREDIT_CARD_DB)
+    recipient = rng.choice(RECIPIENT_DB).split()[0].title()
+    amount = float(rng.randint(1, 100))
+    return {
+        "cc_payment_form": [
+            FormTurn(
+                "credit_card",
+                credit_card,
+                entities=({"entity": "credit_card", "value": credit_card},),
+            ),
+            FormTurn("amount-of-money", amount, entities=(amount_entity(amount),)),
+            FormTurn("time", TIME, entities=(time_entity(TIME, "day"),)),
+            FormTurn("confirm", "yes", intent="affirm"),
+        ],
+        "transfer_money_form": [
+            FormTurn(
+                "PERSON",
+                recipient,
+                entities=({"entity": "PERSON", "value": recipient},),
+            ),
+            FormTurn("amount-of-money", amount, entities=(amount_entity(amount),)),
+            FormTurn("confirm", "yes", intent="affirm"),
+        ],
+        "transaction_search_form": [
+            FormTurn("search_type", "spend"),
+            FormTurn("vendor_name", rng.choice(VENDOR_DB)),
+            FormTurn("time", TIME, entities=(time_entity(TIME),)),
+            FormTurn(
+                "confirm",
+                "yes",
+                intent="affirm",
+                ask="action_ask_transaction_search_form_confirm",
+            ),
+        ],
+    }
+
+
+def load_domain() -> Dict[Text, Any]:
+    with open(DOMAIN_FILE, "r") as f:
+        return ruamel.yaml.safe_load(f)
+
+
+def load_conversations(patterns: Iterable[Text]) -> List[Tuple[Text, List[Any]]]:
+    """Returns the name and steps of every story and rule in the files."""
+    conversations = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, "r") as f:
+                data = ruamel.yaml.safe_load(f) or {}
+            for story in data.get("stories", []) + data.get("rules", []):
+                name = story.get("story") or story.get("rule")
+                conversations.append((name, story.get("steps", [])))
+    return conversations
+
+
+def parse_entities(text: Text) -> Tuple[Text, List[Dict[Text, Any]]]:
+    """Returns the plain text and the entities annotated in a user turn."""
+    entities = []
+    for match in ENTITY_PATTERN.finditer(text):
+        if match.group("json"):
+            entity = json.loads(match.group("json"))
+            entity.setdefault("value", match.group("text"))
+        else:
+            entity = {"entity": match.group("entity"), "value": match.group("text")}
+        if entity["entity"] == "time":
+            entity = time_entity(entity["value"])
+        entities.append(entity)
+    return ENTITY_PATTERN.sub(lambda match: match.group("text"), text).strip(), entities
+
+
+class Stats(object):
+    """Latencies and errors of the webhook calls, per action."""
+
+    def __init__(self) -> None:
+        self.latencies: Dict[Text, List[float]] = collections.defaultdict(list)
+        self.errors: Dict[Text, collections.Counter] = collections.defaultdict(
+            collections.Counter
+        )
+        self.conversations = 0
+        # conversations that ended with an exception, by kind of exception
+        self.failures: collections.Counter = collections.Counter()
+        self.queued = 0
+
+    def record(self, action: Text, seconds: float, error: Optional[Text]) -> None:
+        self.latencies[action].append(seconds * 1000)
+        if error:
+            self.errors[action][error] += 1
+
+    def summary(self, elapsed: float) -> Dict[Text, Dict[Text, Any]]:
+        summary = {}
+        for action, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            errors = sum(self.errors[action].values())
+            summary[action] = {
+                "requests": len(latencies),
+                "rps": len(latencies) / elapsed,
+                "errors": errors,
+                "error_rate": errors / len(latencies),
+                "error_kinds": dict(self.errors[action]),
+                "p50_ms": percentile(latencies, 50),
+                "p90_ms": percentile(latencies, 90),
+                "p99_ms": percentile(latencies, 99),
+                "max_ms": latencies[-1],
+                "histogram": histogram(latencies),
+            }
+        return summary
+
+
+def percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def histogram(latencies: List[float]) -> List[int]:
+    counts = [0] * len(BUCKETS_MS)
+    for latency in latencies:
+        counts[next(i for i, bound in enumerate(BUCKETS_MS) if latency <= bound)] += 1
+    return counts
+
+
+class Conversation(object):
+    """The tracker of a virtual user, replaying the steps of a story."""
+
+    def __init__(
+        self,
+        sender_id: Text,
+        domain: Dict[Text, Any],
+        http: aiohttp.ClientSession,
+        url: Text,
+        stats: Stats,
+        rng: random.Random,
+    ) -> None:
+        self.sender_id = sender_id
+        self.domain = domain
+        self.custom_actions = set(domain.get("actions", []))
+        self.forms = domain.get("forms", {})
+        self.http = http
+        self.url = url
+        self.stats = stats
+        self.rng = rng
+        self.form_turns = form_turns(rng)
+        self.slots = {
+            slot: mapping.get("initial_value")
+            for slot, mapping in domain.get("slots", {}).items()
+        }
+        self.events: List[Dict[Text, Any]] = []
+        self.latest_message: Dict[Text, Any] = {}
+        self.active_loop: Optional[Text] = None
+        self.latest_action_name = "action_listen"
+
+    def tracker(self) -> Dict[Text, Any]:
+        return {
+            "sender_id": self.sender_id,
+            "slots": self.slots,
+            "latest_message": self.latest_message,
+            "events": self.events,
+            "paused": False,
+            "followup_action": None,
+            "active_loop": {"name": self.active_loop} if self.active_loop else {},
+            "latest_action_name": self.latest_action_name,
+        }
+
+    def add_event(self, event: Dict[Text, Any]) -> None:
+        self.events.append({**event, "timestamp": time.time()})
+        if event["event"] == "slot":
+            self.slots[event["name"]] = event["value"]
+        elif event["event"] == "active_loop":
+            self.active_loop = event["name"]
+
+    def set_slot(self, name: Text, value: Any) -> None:
+        self.add_event({"event": "slot", "name": name, "value": value})
+
+    def set_active_loop(self, name: Optional[Text]) -> None:
+        self.add_event({"event": "active_loop", "name": name})
+
+    async def user(
+        self,
+        text: Text,
+        intent: Text,
+        entities: List[Dict[Text, Any]] = (),
+        slots: Optional[Dict[Text, Any]] = None,
+    ) -> None:
+        """Adds a user turn, and runs the active form on the slots it fills."""
+        await self.action("action_listen")
+        self.latest_message = {
+            "text": text,
+            "intent": {"name": intent, "confidence": 1.0},
+            "entities": list(entities),
+        }
+        self.add_event(
+            {"event": "user", "text": text, "parse_data": self.latest_message}
+        )
+        # entities fill the slots of the same name
+        for entity in entities:
+            if entity["entity"] in self.slots:
+                self.set_slot(entity["entity"], entity["value"])
+        for name, value in (slots or {}).items():
+            self.set_slot(name, value)
+        if self.active_loop:
+            await self.run_form(self.active_loop)
+
+    async def action(self, name: Text) -> None:
+        """Runs an action: custom actions on the action server, others locally."""
+        if name in self.custom_actions:
+            await self.call(name)
+        self.latest_action_name = name
+        self.add_event({"event": "action", "name": name})
+
+    async def call(self, name: Text) -> None:
+        payload = {
+            "next_action": name,
+            "sender_id": self.sender_id,
+            "tracker": self.tracker(),
+            "domain": self.domain,
+            "version": "2.1.0",
+        }
+        error = None
+        start = time.perf_counter()
+        try:
+            async with self.http.post(self.url, json=payload) as response:
+                if response.status != 200:
+                    error = f"HTTP {response.status}"
+                body = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            error = error or type(e).__name__
+            body = None
+        self.stats.record(name, time.perf_counter() - start, error)
+        if not error:
+            for event in body.get("events") or []:
+                if event.get("event") in ("slot", "active_loop"):
+                    self.add_event(event)
+
+    async def run_form(self, form: Text) -> None:
+        """Activates a form, or continues it after an interruption."""
+        activated = self.active_loop != form
+        # the slots extracted from the latest user turn are validated first
+        self.active_loop = form
+        await self.call(f"validate_{form}")
+        if activated:
+            self.set_active_loop(form)
+        self.latest_action_name = form
+        self.add_event({"event": "action", "name": form})
+
+    async def fill_form(self, form: Text) -> None:
+        """Fills the slots of the active form, one turn per missing slot."""
+        for turn in self.form_turns.get(form, []):
+            if self.slots.get(turn.slot) is not None:
+                continue
+            self.set_slot("requested_slot", turn.slot)
+            if turn.ask:
+                await self.action(turn.ask)
+            await self.user(
+                str(turn.value),
+                turn.intent,
+                list(turn.entities),
+                slots={turn.slot: turn.value},
+            )
+        self.set_slot("requested_slot", None)
+        self.set_active_loop(None)
+
+    async def replay(self, steps: List[Any]) -> None:
+        await self.call("action_session_start")
+        for step in steps:
+            if "or" in step:
+                step = self.rng.choice(step["or"])
+            if "intent" in step:
+                text, entities = parse_entities(step.get("user") or step["intent"])
+                for entity in step.get("entities") or []:
+                    if isinstance(entity, dict) and "entity" not in entity:
+                        [(name, value)] = entity.items()
+                        entity = {"entity": name, "value": value}
+                    if entity not in entities:
+                        entities.append(entity)
+                await self.user(text, step["intent"], entities)
+            elif "action" in step:
+                if step["action"] in self.forms:
+                    # the form already ran on the latest user turn
+                    if self.latest_action_name != step["action"]:
+                        await self.run_form(step["action"])
+                else:
+                    await self.action(step["action"])
+            elif "slot_was_set" in step:
+                for slot in step["slot_was_set"]:
+                    name, value = next(iter(slot.items()))
+                    self.set_slot(name, value)
+            elif "active_loop" in step:
+                if step["active_loop"] is None and self.active_loop:
+                    await self.fill_form(self.active_loop)
+                elif step["active_loop"] and step["active_loop"] != self.active_loop:
+                    self.set_active_loop(step["active_loop"])
+
+
+async def generate_load(
+    conversations: List[Tuple[Text, List[Any]]],
+    domain: Dict[Text, Any],
+    url: Text,
+    concurrency: int,
+    rate: float,
+    duration: float,
+    max_conversations: int,
+    timeout: float,
+    seed: int,
+) -> Tuple[Stats, float]:
+    """Starts conversations until the duration or maximum is reached."""
+    stats = Stats()
+    rng = random.Random(seed)
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def converse(number: int) -> None:
+        try:
+            conversation = Conversation(
+                f"loadgen-{seed}-{number}",
+                domain,
+                http,
+                url,
+                stats,
+                random.Random(rng.random()),
+            )
+            _, steps = rng.choice(conversations)
+            await conversation.replay(steps)
+            stats.conversations += 1
+        except Exception as e:
+            # one broken conversation must not end the run
+            stats.failures[type(e).__name__] += 1
+        finally:
+            slots.release()
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=client_timeout
+    ) as http:
+        start = time.perf_counter()
+        deadline = start + duration
+        started = 0
+        while time.perf_counter() < deadline and (
+            not max_conversations or started < max_conversations
+        ):
+            if rate:
+                await asyncio.sleep(rng.expovariate(rate))
+            if slots.locked():
+                # all virtual users are busy, the arrival has to wait
+                stats.queued += 1
+            await slots.acquire()
+            task = asyncio.ensure_future(converse(started))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            started += 1
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        elapsed = time.perf_counter() - start
+    return stats, elapsed
+
+
+def print_summary(stats: Stats, summary: Dict[Text, Dict[Text, Any]], elapsed: float):
+    requests = sum(result["requests"] for result in summary.values())
+    errors = sum(result["errors"] for result in summary.values())
+    failures = sum(stats.failures.values())
+    print(
+        f"{stats.conversations} conversations, {requests} requests in {elapsed:.1f}s: "
+        f"{requests / elapsed:.1f} requests/s, {errors + failures} errors, "
+        f"{stats.queued} arrivals queued"
+    )
+    if failures:
+        print(f"{failures} conversations failed:")
+        for kind, count in stats.failures.items():
+            print(f"    {kind}: {count}")
+    print()
+    print(
+        f"{'action':44} {'requests':>8} {'req/s':>7} {'errors':>7} "
+        f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    )
+    for action, result in summary.items():
+        print(
+            f"{action:44} {result['requests']:8d} {result['rps']:7.1f} "
+            f"{result['error_rate']:7.1%} {result['p50_ms']:8.1f} "
+            f"{result['p90_ms']:8.1f} {result['p99_ms']:8.1f} {result['max_ms']:8.1f}"
+        )
+        for kind, count in result["error_kinds"].items():
+            print(f"    {kind}: {count}")
+
+    print()
+    for action, result in summary.items():
+        print(action)
+        for bound, count in zip(BUCKETS_MS, result["histogram"]):
+            if count:
+                bar = "#" * max(1, round(40 * count / result["requests"]))
+                print(f"  <= {bound:>6} ms {count:8d} {bar}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=WEBHOOK_URL)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument(
+        "--rate", type=float, default=0.0, help="conversations started per second"
+    )
+    parser.add_argument("--duration", type=float, default=30.0, help="in seconds")
+    parser.add_argument("--conversations", type=int, default=0, help="at most")
+    parser.add_argument("--timeout", type=float, default=10.0, help="per request")
+    parser.add_argument(
+        "--filter", default="", help="only replay stories whose name contains it"
+    )
+    parser.add_argument("--files", nargs="+", default=CONVERSATION_FILES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    conversations = [
+        (name, steps)
+        for name, steps in load_conversations(args.files)
+        if args.filter.lower() in name.lower()
+    ]
+    if not conversations:
+        print("No conversations to replay.")
+        return 1
+
+    stats, elapsed = asyncio.get_event_loop().run_until_complete(
+        generate_load(
+            conversations,
+            load_domain(),
+            args.url,
+            args.concurrency,
+            args.rate,
+            args.duration,
+            args.conversations,
+            args.timeout,
+            args.seed,
+        )
+    )
+    summary = stats.summary(elapsed)
+    print_summary(stats, summary, elapsed)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    return 0 if summary else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
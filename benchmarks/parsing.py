@@ -0,0 +1,148 @@
+"""Micro-benchmark of the Duckling time parsing in actions/parsing.py.
+
+Compares the per-call cost of the memoized parsing with the previous
+implementation, which parsed every timestamp again on every call, for the
+same few times repeated (cache hits) and for distinct times, parsed with an
+empty cache (cache misses, the cost of the parsing itself).
+
+    python -m benchmarks.parsing --number 20000
+"""
+import argparse
+import datetime
+import timeit
+from typing import Dict, Text, Any, Callable, List
+
+from dateutil import relativedelta, parser
+
+from actions import parsing
+
+TIMES = [
+    {
+        "type": "value",
+        "value": "2020-11-01T00:00:00.000-08:00",
+        "grain": "month",
+    },
+    {
+        "type": "value",
+        "value": "2020-11-23T00:00:00.000-08:00",
+        "grain": "day",
+    },
+    {
+        "type": "interval",
+        "from": {"value": "2020-11-16T00:00:00.000-08:00", "grain": "week"},
+    },
+    {
+        "type": "interval",
+        "from": {"value": "2020-10-01T00:00:00.000-07:00", "grain": "month"},
+        "to": {"value": "2020-12-01T00:00:00.000-08:00", "grain": "month"},
+    },
+]
+
+
+def distinct_times(number: int) -> List[Dict[Text, Any]]:
+    """Returns `number` times like `TIMES`, each at a different hour."""
+    start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    times = []
+    for i in range(number):
+        isotime = (start + datetime.timedelta(hours=i)).isoformat()
+        timeinfo = TIMES[i % len(TIMES)]
+        if timeinfo["type"] == "value":
+            times.append({**timeinfo, "value": isotime})
+        else:
+            times.append({**timeinfo, "from": {**timeinfo["from"], "value": isotime}})
+    return times
+
+
+def legacy_format_isotime_by_grain(isotime, grain=None):
+    value = parser.isoparse(isotime)
+    grain_format = {
+        "second": "%I:%M:%S%p, %A %b %d, %Y",
+        "day": "%A %b %d, %Y",
+        "week": "%A %b %d, %Y",
+        "month": "%b %Y",
+        "year": "%Y",
+    }
+    timeformat = grain_format.get(grain, "%I:%M%p, %A %b %d, %Y")
+    return value.strftime(timeformat)
+
+
+def legacy_parse_interval(timeinfo: Dict[Text, Any]) -> Dict[Text, Any]:
+    if timeinfo["type"] == "value":
+        grain = timeinfo.get("grain")
+        start = timeinfo.get("value")
+        end = None
+    else:
+        grain = timeinfo.get("to", timeinfo.get("from", {})).get("grain")
+        start = timeinfo.get("from", {}).get("value")
+        end = timeinfo.get("to", {}).get("value")
+    if (start or end) and not (start and end):
+        delta = relativedelta.relativedelta(**{f"{grain}s": 1})
+        if start:
+            end = (parser.isoparse(start) + delta).isoformat()
+        else:
+            start = (parser.isoparse(end) - delta).isoformat()
+    return {
+        "start_time": start,
+        "start_time_formatted": legacy_format_isotime_by_grain(start, grain),
+        "end_time": end,
+        "end_time_formatted": legacy_format_isotime_by_grain(end, grain),
+        "grain": grain,
+    }
+
+
+def parse_interval(timeinfo: Dict[Text, Any]) -> Dict[Text, Any]:
+    return parsing.parse_duckling_time_as_interval({"additional_info": timeinfo})
+
+
+def per_call_us(func: Callable, number: int) -> float:
+    def run():
+        for timeinfo in TIMES:
+            func(timeinfo)
+
+    seconds = min(timeit.repeat(run, number=number // len(TIMES), repeat=5))
+    return seconds / number * 1e6
+
+
+def cold_per_call_us(func: Callable, times: List[Dict[Text, Any]]) -> float:
+    """Returns the cost per call of distinct times, with empty caches."""
+
+    def run():
+        for timeinfo in times:
+            func(timeinfo)
+
+    def clear():
+        parsing.parse_time.cache_clear()
+        parsing.shift_time.cache_clear()
+
+    seconds = min(timeit.repeat(run, setup=clear, number=1, repeat=5))
+    return seconds / len(times) * 1e6
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--number", type=int, default=20000)
+    args = argparser.parse_args()
+
+    for timeinfo in TIMES:
+        assert parse_interval(timeinfo) == legacy_parse_interval(timeinfo), timeinfo
+
+    legacy = per_call_us(legacy_parse_interval, args.number)
+    memoized = per_call_us(parse_interval, args.number)
+    print("repeated times:")
+    print(f"previous: {legacy:8.2f} us per call")
+    print(f"memoized: {memoized:8.2f} us per call ({legacy / memoized:.1f}x faster)")
+    print(f"cache:    {parsing.parse_time.cache_info()}")
+
+    # fewer distinct times than the cache holds, so each one is parsed once
+    times = distinct_times(min(args.number, parsing.TIME_CACHE_SIZE // 2))
+    for timeinfo in times:
+        assert parse_interval(timeinfo) == legacy_parse_interval(timeinfo), timeinfo
+    legacy = cold_per_call_us(legacy_parse_interval, times)
+    cold = cold_per_call_us(parse_interval, times)
+    print(f"distinct times, empty cache ({len(times)} times):")
+    print(f"previous: {legacy:8.2f} us per call")
+    print(f"memoized: {cold:8.2f} us per call ({legacy / cold:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
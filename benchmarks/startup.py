@@ -0,0 +1,66 @@
+"""Measures the cold start cost of importing the `actions` package.
+
+Every run imports all modules of the package in a fresh interpreter, the way
+`rasa run actions` registers them, after rasa_sdk itself has been imported.
+Exits with status 1 when the median import time or allocated memory is over
+budget.
+
+    python -m benchmarks.startup --runs 5 --budget-ms 1000 --budget-mb 50
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict, Text, Any
+
+CHILD = """
+import importlib, json, pkgutil, time, tracemalloc
+import rasa_sdk.executor
+
+tracemalloc.start()
+start = time.perf_counter()
+import actions
+modules = [actions.__name__]
+for module in pkgutil.walk_packages(actions.__path__, actions.__name__ + "."):
+    importlib.import_module(module.name)
+    modules.append(module.name)
+elapsed = time.perf_counter() - start
+current, peak = tracemalloc.get_traced_memory()
+print(json.dumps({"seconds": elapsed, "allocated": current, "peak": peak,
+                  "modules": modules}))
+"""
+
+
+def measure_once() -> Dict[Text, Any]:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD], check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1000.0)
+    parser.add_argument("--budget-mb", type=float, default=50.0)
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.runs)]
+    wall_ms = statistics.median(run["seconds"] for run in runs) * 1000
+    allocated_mb = statistics.median(run["allocated"] for run in runs) / 2 ** 20
+    peak_mb = statistics.median(run["peak"] for run in runs) / 2 ** 20
+
+    print(f"modules:   {', '.join(runs[0]['modules'])}")
+    print(f"import:    {wall_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"allocated: {allocated_mb:.1f} MB, peak {peak_mb:.1f} MB ")
+    print(f"           (budget {args.budget_mb:.0f} MB)")
+
+    if wall_ms > args.budget_ms or allocated_mb > args.budget_mb:
+        print("Cold start is over budget.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
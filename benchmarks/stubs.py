@@ -0,0 +1,265 @@
+"""Local stub servers for the external APIs used by the action server.
+
+    python -m benchmarks.stubs discourse --port 8090 --delay 0.2 --error-rate 0.1
+    python -m benchmarks.stubs duckling --port 8000 --delay 0.02
+    python -m benchmarks.stubs goodreads --port 8091 --delay 0.1
+
+Point the client at the stub, e.g. `DiscourseAPI("http://localhost:8090")`.
+The Duckling stub parses with the stand-in of `duckling_proxy`, the Goodreads
+stub serves a generated catalog and the library of a single user.
+`--delay` adds latency to every response and `--error-rate` makes that
+fraction of the requests fail with a 503, to exercise timeouts and retries.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+from typing import Text
+from xml.sax.saxutils import escape
+
+import pytz
+from aiohttp import web
+
+from duckling_proxy import standin
+
+
+def topics(term: Text):
+    return [
+        {
+            "id": 1000 + i,
+            "slug": f"{term.replace(' ', '-')}-{i}",
+            "title": f"How do I {term}? ({i})",
+            "blurb": f"Some answer about {term}.",
+        }
+        for i in range(5)
+    ]
+
+
+def discourse_app(delay: float = 0.0, error_rate: float = 0.0) -> web.Application:
+    """Serves canned Discourse `query.json` and search responses."""
+
+    async def respond(request: web.Request, payload) -> web.Response:
+        if delay:
+            await asyncio.sleep(delay)
+        if random.random() < error_rate:
+            return web.json_response({"errors": ["stub error"]}, status=503)
+        return web.json_response(payload)
+
+    async def query(request: web.Request) -> web.Response:
+        term = request.query.get("term", "")
+        return await respond(request, {"topics": topics(term)})
+
+    async def search(request: web.Request) -> web.Response:
+        term = request.query.get("q", "")
+        return await respond(request, {"posts": [], "topics": topics(term)})
+
+    app = web.Application()
+    app.router.add_get("/query.json", query)
+    app.router.add_get("/search", search)
+    app.router.add_get("/", search)
+    return app
+
+
+def duckling_app(delay: float = 0.0, error_rate: float = 0.0) -> web.Application:
+    """Serves Duckling's `/parse` endpoint, parsing with the stand-in."""
+
+    async def parse(request: web.Request) -> web.Response:
+        form = await request.post()
+        if delay:
+            await asyncio.sleep(delay)
+        if random.random() < error_rate:
+            return web.Response(text="stub error", status=503)
+        reftime = int(form.get("reftime") or time.time() * 1000)
+        entities = standin.parse(
+            form.get("text", ""),
+            datetime.fromtimestamp(reftime / 1000, pytz.utc),
+            json.loads(form.get("dims") or "[]"),
+            form.get("tz"),
+        )
+        return web.json_response(entities)
+
+    app = web.Application()
+    app.router.add_post("/parse", parse)
+    return app
+
+
+GOODREADS_BOOKS = 400
+GOODREADS_AUTHORS = 40
+# the user's library are the first books of the catalog
+GOODREADS_LIBRARY = 120
+GOODREADS_SHELVES = ["read", "currently-reading", "to-read", "favorites"]
+GOODREADS_SEARCH_PAGE_SIZE = 20
+TITLE_WORDS = ["dragon", "garden", "river", "night", "city", "winter", "shadow", "sea"]
+
+
+def goodreads_title(book_id: int) -> Text:
+    first = TITLE_WORDS[book_id % len(TITLE_WORDS)]
+    second = TITLE_WORDS[book_id // len(TITLE_WORDS) % len(TITLE_WORDS)]
+    return f"The {first.title()} and the {second.title()} {book_id}"
+
+
+def goodreads_author(author_id: int) -> Text:
+    return (
+        f"<id>{author_id}</id><name>Author {author_id}</name>"
+        f"<link>https://www.goodreads.com/author/show/{author_id}</link>"
+        f"<average_rating>3.9</average_rating><works_count>10</works_count>"
+    )
+
+
+def goodreads_book(book_id: int) -> Text:
+    author_id = 1 + book_id % GOODREADS_AUTHORS
+    return (
+        f'<id type="integer">{book_id}</id>'
+        f"<title>{escape(goodreads_title(book_id))}</title>"
+        f"<isbn>{9780000000000 + book_id}</isbn>"
+        f"<link>https://www.goodreads.com/book/show/{book_id}</link>"
+        f"<image_url>https://images.example.com/{book_id}.jpg</image_url>"
+        f"<average_rating>{3 + book_id % 20 / 10}</average_rating>"
+        f"<ratings_count>{book_id * 37}</ratings_count>"
+        f"<publication_year>{1950 + book_id % 70}</publication_year>"
+        f"<authors><author>{goodreads_author(author_id)}</author></authors>"
+    )
+
+
+def goodreads_shelves(book_id: int):
+    shelves = [GOODREADS_SHELVES[book_id % 3]]
+    if book_id % 5 == 0:
+        shelves.append("favorites")
+    return shelves
+
+
+def goodreads_app(delay: float = 0.0, error_rate: float = 0.0) -> web.Application:
+    """Serves generated Goodreads XML responses, for the user with id 1."""
+
+    async def respond(body: Text) -> web.Response:
+        if delay:
+            await asyncio.sleep(delay)
+        if random.random() < error_rate:
+            return web.Response(text="stub error", status=503)
+        return web.Response(
+            text=f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f"<GoodreadsResponse>{body}</GoodreadsResponse>",
+            content_type="application/xml",
+        )
+
+    def page_of(items, page: int, per_page: int):
+        start = (page - 1) * per_page
+        return items[start : start + per_page], start + 1, start + per_page
+
+    async def auth_user(request: web.Request) -> web.Response:
+        return await respond('<user id="1"><name>Reader</name></user>')
+
+    async def shelves(request: web.Request) -> web.Response:
+        body = "".join(
+            f'<user_shelf><id type="integer">{i + 1}</id><name>{name}</name>'
+            f'<book_count type="integer">'
+            f"{sum(name in goodreads_shelves(b) for b in range(1, GOODREADS_LIBRARY + 1))}"
+            f"</book_count><exclusive_flag>{str(i < 3).lower()}</exclusive_flag>"
+            f"</user_shelf>"
+            for i, name in enumerate(GOODREADS_SHELVES)
+        )
+        total = len(GOODREADS_SHELVES)
+        return await respond(
+            f'<shelves start="1" end="{total}" total="{total}">{body}</shelves>'
+        )
+
+    async def reviews(request: web.Request) -> web.Response:
+        shelf = request.query.get("shelf")
+        page = int(request.query.get("page", 1))
+        per_page = int(request.query.get("per_page", 20))
+        books = [
+            b
+            for b in range(1, GOODREADS_LIBRARY + 1)
+            if not shelf or shelf == "all" or shelf in goodreads_shelves(b)
+        ]
+        books_of_page, start, end = page_of(books, page, per_page)
+        body = "".join(
+            f"<review><id>{10000 + b}</id><book>{goodreads_book(b)}</book><shelves>"
+            + "".join(f'<shelf name="{name}" />' for name in goodreads_shelves(b))
+            + "</shelves></review>"
+            for b in books_of_page
+        )
+        return await respond(
+            f'<reviews start="{start}" end="{min(end, len(books))}" '
+            f'total="{len(books)}">{body}</reviews>'
+        )
+
+    async def book(request: web.Request) -> web.Response:
+        book_id = int(request.match_info["id"])
+        return await respond(f"<book>{goodreads_book(book_id)}</book>")
+
+    async def author(request: web.Request) -> web.Response:
+        author_id = int(request.match_info["id"])
+        return await respond(f"<author>{goodreads_author(author_id)}</author>")
+
+    async def author_url(request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        number = name.rsplit(" ", 1)[-1]
+        if number.isdigit() and 1 <= int(number) <= GOODREADS_AUTHORS:
+            return await respond(f'<author id="{number}"><name>{name}</name></author>')
+        return await respond("")
+
+    async def search(request: web.Request) -> web.Response:
+        query = request.query.get("q", "").lower()
+        page = int(request.query.get("page", 1))
+        books = [
+            b
+            for b in range(1, GOODREADS_BOOKS + 1)
+            if query in goodreads_title(b).lower()
+        ]
+        books_of_page, start, end = page_of(books, page, GOODREADS_SEARCH_PAGE_SIZE)
+        works = "".join(
+            f'<work><id type="integer">{20000 + b}</id>'
+            f"<ratings_count>{b * 37}</ratings_count>"
+            f"<original_publication_year>{1950 + b % 70}</original_publication_year>"
+            f"<average_rating>{3 + b % 20 / 10}</average_rating>"
+            f'<best_book type="Book"><id type="integer">{b}</id>'
+            f"<title>{escape(goodreads_title(b))}</title>"
+            f"<author><id>{1 + b % GOODREADS_AUTHORS}</id>"
+            f"<name>Author {1 + b % GOODREADS_AUTHORS}</name></author>"
+            f"<image_url>https://images.example.com/{b}.jpg</image_url>"
+            f"</best_book></work>"
+            for b in books_of_page
+        )
+        return await respond(
+            f"<search><query>{escape(query)}</query>"
+            f"<results-start>{start}</results-start>"
+            f"<results-end>{min(end, len(books))}</results-end>"
+            f"<total-results>{len(books)}</total-results>"
+            f"<results>{works}</results></search>"
+        )
+
+    app = web.Application()
+    app.router.add_get("/api/auth_user", auth_user)
+    app.router.add_get("/shelf/list.xml", shelves)
+    app.router.add_get("/review/list/{user_id}.xml", reviews)
+    app.router.add_get("/book/show/{id}.xml", book)
+    app.router.add_get("/author/show/{id}.xml", author)
+    app.router.add_get("/api/author_url/{name}", author_url)
+    app.router.add_get("/search/index.xml", search)
+    return app
+
+
+APPS = {
+    "discourse": discourse_app,
+    "duckling": duckling_app,
+    "goodreads": goodreads_app,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("api", choices=list(APPS.keys()))
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    app = APPS[args.api](delay=args.delay, error_rate=args.error_rate)
+    web.run_app(app, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
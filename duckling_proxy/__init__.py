@@ -0,0 +1,11 @@
+"""Caching proxy in front of the Duckling server of the DucklingEntityExtractor.
+
+The proxy serves Duckling's `/parse` endpoint. It caches the parses of texts
+until the reference time leaves the period of their time grain, and
+coalesces concurrent requests for the same text into a single upstream call.
+Without an upstream Duckling server, it parses with a pure-Python stand-in
+that covers the dimensions this bot uses (amount-of-money, number, time).
+
+    python -m duckling_proxy.server --upstream http://localhost:8000 --port 8001
+    python -m duckling_proxy.server --standin --port 8001
+"""
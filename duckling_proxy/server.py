@@ -0,0 +1,313 @@
+"""Caching proxy serving Duckling's `/parse` endpoint.
+
+Point the DucklingEntityExtractor in `config.yml` at the proxy, e.g.
+`url: http://localhost:8001`, and the proxy at Duckling:
+
+    python -m duckling_proxy.server --upstream http://localhost:8000 --port 8001
+
+or run it with the pure-Python stand-in instead of Duckling:
+
+    python -m duckling_proxy.server --standin --port 8001
+
+Texts are normalized (case and whitespace) before they are parsed, and the
+offsets of the entities are mapped back to the original text. The parse of a
+text stays valid as long as the reference time is in the same period of the
+finest time grain found in it: "last month" is parsed once a month, "$50" as
+long as it stays in the cache. Concurrent requests for the same text share a
+single upstream call. `GET /stats` returns the hits, misses and hit rate.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import math
+import time
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Optional, Text, Tuple
+
+import aiohttp
+import pytz
+from aiohttp import web
+
+from duckling_proxy import standin
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8001
+CACHE_SIZE = 10000
+# seconds a parse without time entities stays cached
+MAX_AGE = 24 * 60 * 60
+MAX_CONNECTIONS = 16
+
+METRICS = ("hits", "misses", "coalesced", "evictions", "expired")
+
+
+def normalize_text(text: Text) -> Tuple[Text, List[int]]:
+    """Lowercases a text and collapses its whitespace.
+
+    Returns the normalized text, and for each of its characters (and its end)
+    the offset of the character in the original text.
+    """
+    characters: List[Text] = []
+    offsets: List[int] = []
+    for offset, character in enumerate(text):
+        if character.isspace():
+            if not characters or characters[-1] == " ":
+                continue
+            character = " "
+        else:
+            lower = character.lower()
+            character = lower if len(lower) == 1 else character
+        characters.append(character)
+        offsets.append(offset)
+    if characters and characters[-1] == " ":
+        characters.pop()
+        offsets.pop()
+    offsets.append(offsets[-1] + 1 if offsets else 0)
+    return "".join(characters), offsets
+
+
+def restore_entities(
+    entities: List[Dict[Text, Any]], text: Text, offsets: List[int]
+) -> List[Dict[Text, Any]]:
+    """Maps the entities parsed from a normalized text back to the original text."""
+    restored = []
+    for entity in entities:
+        start = offsets[entity["start"]]
+        end = offsets[entity["end"] - 1] + 1
+        restored.append({**entity, "start": start, "end": end, "body": text[start:end]})
+    return restored
+
+
+def time_grains(entities: List[Dict[Text, Any]]) -> List[Text]:
+    """Returns the grains of the time entities."""
+    grains = []
+    for entity in entities:
+        if entity.get("dim") != "time":
+            continue
+        value = entity.get("value", {})
+        for time_value in value.get("values") or [value]:
+            for part in (time_value, time_value.get("from"), time_value.get("to")):
+                if part and part.get("grain"):
+                    grains.append(part["grain"])
+    return grains
+
+
+def validity(
+    entities: List[Dict[Text, Any]], reftime: int, tz: Optional[Text]
+) -> Tuple[float, float]:
+    """Returns the range of reference times (in ms) the parse of a text holds for.
+
+    The times are resolved against the reference time, so the parse holds as
+    long as the reference time is in the same period of their finest grain.
+    """
+    grains = time_grains(entities)
+    if not grains:
+        return -math.inf, math.inf
+    grain = min(grains, key=standin.GRAINS.index)
+    timezone = pytz.timezone(tz or standin.DEFAULT_TIMEZONE)
+    now = datetime.fromtimestamp(reftime / 1000, timezone).replace(tzinfo=None)
+    start = standin.truncate(now, grain)
+    end = standin.shift(start, grain, 1)
+    return (
+        timezone.localize(start).timestamp() * 1000,
+        timezone.localize(end).timestamp() * 1000,
+    )
+
+
+class ParseCache(object):
+    """LRU cache of parses, each valid for a range of reference times."""
+
+    def __init__(self, maxsize: int = CACHE_SIZE, max_age: float = MAX_AGE) -> None:
+        self.maxsize = maxsize
+        self.max_age = max_age
+        # key -> (stored at, valid from, valid until, entities)
+        self._entries: "collections.OrderedDict[Hashable, Tuple]" = (
+            collections.OrderedDict()
+        )
+        self.metrics: Dict[Text, int] = dict.fromkeys(METRICS, 0)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, reftime: int) -> Optional[List[Dict[Text, Any]]]:
+        """Returns the cached parse of a key for a reference time, if any."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, valid_from, valid_until, entities = entry
+            if (
+                valid_from <= reftime < valid_until
+                and time.time() - stored_at < self.max_age
+            ):
+                self._entries.move_to_end(key)
+                self.metrics["hits"] += 1
+                return entities
+            self.metrics["expired"] += 1
+        self.metrics["misses"] += 1
+        return None
+
+    def set(
+        self,
+        key: Hashable,
+        valid: Tuple[float, float],
+        entities: List[Dict[Text, Any]],
+    ) -> None:
+        self._entries[key] = (time.time(), *valid, entities)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.metrics["evictions"] += 1
+
+    def stats(self) -> Dict[Text, Any]:
+        lookups = self.metrics["hits"] + self.metrics["misses"]
+        return {
+            **self.metrics,
+            "entries": len(self._entries),
+            "hit_rate": self.metrics["hits"] / lookups if lookups else 0.0,
+        }
+
+
+class DucklingProxy(object):
+    """Parses texts with an upstream Duckling server, or with the stand-in."""
+
+    def __init__(
+        self,
+        upstream: Optional[Text] = None,
+        cache: Optional[ParseCache] = None,
+        max_connections: int = MAX_CONNECTIONS,
+    ) -> None:
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.cache = cache or ParseCache()
+        self.max_connections = max_connections
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def parse(self, form: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        """Returns the entities of a `/parse` request, from the cache if possible.
+
+        Args:
+            form: the form fields of the request: `text`, `locale`, `tz`,
+                `dims` (a JSON list) and `reftime` (in ms since the epoch).
+        """
+        text = form.get("text", "")
+        normalized, offsets = normalize_text(text)
+        dims = tuple(sorted(json.loads(form.get("dims") or "[]")))
+        tz = form.get("tz") or None
+        reftime = int(form.get("reftime") or time.time() * 1000)
+        key = (normalized, form.get("locale"), tz, dims)
+
+        entities = self.cache.get(key, reftime)
+        if entities is None:
+            call = self._calls.get(key)
+            if call is not None:
+                self.cache.metrics["coalesced"] += 1
+                entities, valid = await asyncio.shield(call)
+                if not valid[0] <= reftime < valid[1]:
+                    # the shared call was for another period
+                    entities = None
+            if entities is None:
+                entities = await self._call(key, normalized, dims, tz, reftime, form)
+        return restore_entities(entities, text, offsets)
+
+    async def _call(
+        self,
+        key: Hashable,
+        text: Text,
+        dims: Tuple[Text, ...],
+        tz: Optional[Text],
+        reftime: int,
+        form: Dict[Text, Any],
+    ) -> List[Dict[Text, Any]]:
+        future = asyncio.get_event_loop().create_future()
+        self._calls[key] = future
+        try:
+            if self.upstream:
+                entities = await self._fetch({**form, "text": text, "reftime": reftime})
+            else:
+                entities = standin.parse(
+                    text, datetime.fromtimestamp(reftime / 1000, pytz.utc), dims, tz
+                )
+        except BaseException as e:
+            future.set_exception(e)
+            # mark the exception as retrieved, the waiters (if any) get it too
+            future.exception()
+            raise
+        else:
+            valid = validity(entities, reftime, tz)
+            self.cache.set(key, valid, entities)
+            future.set_result((entities, valid))
+            return entities
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    async def _fetch(self, form: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections)
+            )
+        async with self._session.post(f"{self.upstream}/parse", data=form) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+
+def proxy_app(proxy: DucklingProxy) -> web.Application:
+    """Serves Duckling's `/parse` endpoint through a proxy."""
+
+    async def parse(request: web.Request) -> web.Response:
+        form = dict(await request.post())
+        try:
+            entities = await proxy.parse(form)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Duckling did not parse `{form.get('text')}`: {e!r}")
+            return web.json_response({"error": str(e)}, status=502)
+        return web.json_response(entities)
+
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(text="quack!")
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(proxy.cache.stats())
+
+    async def close(app: web.Application) -> None:
+        await proxy.close()
+
+    app = web.Application()
+    app.router.add_post("/parse", parse)
+    app.router.add_get("/", health)
+    app.router.add_get("/stats", stats)
+    app.on_cleanup.append(close)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    upstream = parser.add_mutually_exclusive_group(required=True)
+    upstream.add_argument("--upstream", help="URL of the Duckling server")
+    upstream.add_argument(
+        "--standin", action="store_true", help="parse with the pure-Python stand-in"
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE)
+    parser.add_argument("--max-age", type=float, default=MAX_AGE)
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    proxy = DucklingProxy(
+        upstream=args.upstream,
+        cache=ParseCache(args.cache_size, args.max_age),
+        max_connections=args.max_connections,
+    )
+    web.run_app(proxy_app(proxy), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
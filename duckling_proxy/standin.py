@@ -0,0 +1,446 @@
+"""Pure-Python stand-in for the Duckling dimensions this bot uses.
+
+Parses amounts of money ("$50", "60 euros"), numbers ("1,200", "two") and the
+times users mention in the stories ("last month", "past two days", "on
+Sunday", "in January", "tomorrow at 3pm", "2020-11-23"), and returns them in
+the format of Duckling's `/parse` endpoint. It does not cover Duckling's
+grammar in general, but lets the whole pipeline run (and be benchmarked)
+without a Duckling server.
+"""
+import re
+from datetime import datetime, timedelta
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Match,
+    Optional,
+    Pattern,
+    Text,
+    Tuple,
+)
+
+import pytz
+from dateutil.relativedelta import relativedelta
+
+DIMENSIONS = ("amount-of-money", "number", "time")
+DEFAULT_TIMEZONE = "America/Los_Angeles"
+
+# from the finest to the coarsest
+GRAINS = ("second", "minute", "hour", "day", "week", "month", "quarter", "year")
+
+NUMBER_WORDS = {
+    "zero": 0,
+    "one": 1,
+    "two": 2,
+    "three": 3,
+    "four": 4,
+    "five": 5,
+    "six": 6,
+    "seven": 7,
+    "eight": 8,
+    "nine": 9,
+    "ten": 10,
+    "eleven": 11,
+    "twelve": 12,
+    "thirteen": 13,
+    "fourteen": 14,
+    "fifteen": 15,
+    "sixteen": 16,
+    "seventeen": 17,
+    "eighteen": 18,
+    "nineteen": 19,
+    "twenty": 20,
+    "thirty": 30,
+    "forty": 40,
+    "fifty": 50,
+    "sixty": 60,
+    "seventy": 70,
+    "eighty": 80,
+    "ninety": 90,
+    "hundred": 100,
+    "thousand": 1000,
+}
+TENS = "twenty|thirty|forty|fifty|sixty|seventy|eighty|ninety"
+UNITS = "one|two|three|four|five|six|seven|eight|nine"
+NUMBER = (
+    r"\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?"
+    rf"|(?:{TENS})[- ](?:{UNITS})|(?:{'|'.join(sorted(NUMBER_WORDS, key=len)[::-1])})"
+)
+
+CURRENCIES = {
+    "$": "$",
+    "dollar": "$",
+    "dollars": "$",
+    "buck": "$",
+    "bucks": "$",
+    "usd": "$",
+    "€": "EUR",
+    "euro": "EUR",
+    "euros": "EUR",
+    "eur": "EUR",
+    "£": "£",
+    "pound": "£",
+    "pounds": "£",
+    "gbp": "£",
+}
+CURRENCY_SYMBOL = r"[$€£]"
+CURRENCY_NAME = r"dollars?|bucks?|usd|euros?|eur|pounds?|gbp"
+
+UNIT = r"(?P<unit>second|minute|hour|day|week|month|quarter|year)s?"
+WEEKDAYS = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+MONTHS = [
+    "january",
+    "february",
+    "march",
+    "april",
+    "may",
+    "june",
+    "july",
+    "august",
+    "september",
+    "october",
+    "november",
+    "december",
+]
+MONTH_ABBREVIATIONS = "jan|feb|mar|apr|jun|jul|aug|sep|sept|oct|nov|dec"
+MONTH = rf"(?P<month>{'|'.join(MONTHS)}|(?:{MONTH_ABBREVIATIONS})\.?)"
+WEEKDAY = rf"(?P<weekday>{'|'.join(WEEKDAYS)})"
+
+# start, end, dimension and value of an entity
+Candidate = Tuple[int, int, Text, Dict[Text, Any]]
+
+
+def to_number(text: Text) -> float:
+    """Converts a number in digits or in words, e.g. "1,200" or "twenty-five"."""
+    text = text.lower().replace(",", "")
+    if text in NUMBER_WORDS:
+        return NUMBER_WORDS[text]
+    words = re.split(r"[- ]", text)
+    if len(words) == 2 and all(word in NUMBER_WORDS for word in words):
+        return NUMBER_WORDS[words[0]] + NUMBER_WORDS[words[1]]
+    return float(text)
+
+
+def number_value(value: float) -> Any:
+    """Returns integral numbers as `int`, as Duckling does."""
+    return int(value) if float(value).is_integer() else value
+
+
+def truncate(value: datetime, grain: Text) -> datetime:
+    """Returns the start of the period of a grain that contains a (naive) time."""
+    if grain == "second":
+        return value.replace(microsecond=0)
+    if grain == "minute":
+        return value.replace(second=0, microsecond=0)
+    if grain == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    day = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if grain == "day":
+        return day
+    if grain == "week":
+        return day - timedelta(days=day.weekday())
+    if grain == "month":
+        return day.replace(day=1)
+    if grain == "quarter":
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    return day.replace(month=1, day=1)
+
+
+def shift(value: datetime, grain: Text, number: int) -> datetime:
+    """Adds a number of periods of a grain to a (naive) time."""
+    if grain == "quarter":
+        return value + relativedelta(months=3 * number)
+    return value + relativedelta(**{f"{grain}s": number})
+
+
+class StandinParser(object):
+    """Parses the dimensions this bot uses, relative to a reference time."""
+
+    def __init__(self) -> None:
+        flags = re.IGNORECASE
+        self._amounts = [
+            re.compile(
+                rf"(?P<currency>{CURRENCY_SYMBOL}) ?(?P<number>{NUMBER})\b", flags
+            ),
+            re.compile(
+                rf"\b(?P<number>{NUMBER}) ?(?P<currency>{CURRENCY_NAME}|{CURRENCY_SYMBOL})(?!\w)",
+                flags,
+            ),
+        ]
+        self._numbers = re.compile(
+            rf"(?<![\w.,])(?P<number>{NUMBER})(?![\w,]|\.\d)", flags
+        )
+        self._times: List[Tuple[Pattern, Callable]] = [
+            (
+                rf"\b(?:in the )?(?:last|past|previous) (?P<number>{NUMBER}) {UNIT}\b",
+                self._last_n,
+            ),
+            (rf"\b(?:in the )?next (?P<number>{NUMBER}) {UNIT}\b", self._next_n),
+            (rf"\b(?P<number>{NUMBER}) {UNIT} ago\b", self._ago),
+            (rf"\bin (?P<number>{NUMBER}) {UNIT}\b", self._in),
+            (
+                rf"\b(?P<which>last|past|previous|this|current|next|coming) {UNIT}\b",
+                self._relative,
+            ),
+            (r"\b(?P<day>today|tomorrow|yesterday)\b", self._day),
+            (r"\b(?P<now>now|right now)\b", self._now),
+            (r"\b(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})\b", self._date),
+            (
+                rf"\b(?:on )?{MONTH} (?P<day>\d{{1,2}})(?:st|nd|rd|th)?(?:,? (?P<year>\d{{4}}))?\b",
+                self._month_day,
+            ),
+            (
+                rf"\b(?:(?:in|of|during) )?(?P<which>last |this |next )?{MONTH}(?: (?P<year>\d{{4}}))?(?!\w)",
+                self._month,
+            ),
+            (rf"\b(?:on )?(?P<which>last |this |next )?{WEEKDAY}(?!\w)", self._weekday),
+            (
+                r"\b(?:at )?(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))? ?(?P<ampm>am|pm|a\.m\.|p\.m\.)",
+                self._clock,
+            ),
+        ]
+        self._times = [(re.compile(pattern, flags), f) for pattern, f in self._times]
+
+    def parse(
+        self,
+        text: Text,
+        reftime: datetime,
+        dims: Optional[Iterable[Text]] = None,
+        tz: Optional[Text] = None,
+    ) -> List[Dict[Text, Any]]:
+        """Returns the entities of a text, in the format of Duckling's `/parse`.
+
+        Args:
+            text: the text to parse.
+            reftime: the time relative times are resolved against.
+            dims: the dimensions to extract, all of them by default.
+            tz: the time zone of the times, Duckling's default by default.
+        """
+        dims = set(dims or DIMENSIONS)
+        timezone = pytz.timezone(tz or DEFAULT_TIMEZONE)
+        if reftime.tzinfo is None:
+            reftime = pytz.utc.localize(reftime)
+        now = reftime.astimezone(timezone).replace(tzinfo=None)
+
+        matches: List[Candidate] = []
+        if "time" in dims:
+            for pattern, resolve in self._times:
+                for match in pattern.finditer(text):
+                    value = resolve(match, now)
+                    if value is not None:
+                        value = self._localize(value, timezone)
+                        matches.append((match.start(), match.end(), "time", value))
+        if "amount-of-money" in dims:
+            for pattern in self._amounts:
+                for match in pattern.finditer(text):
+                    value = {
+                        "value": number_value(to_number(match.group("number"))),
+                        "type": "value",
+                        "unit": CURRENCIES[match.group("currency").lower()],
+                    }
+                    matches.append(
+                        (match.start(), match.end(), "amount-of-money", value)
+                    )
+        if "number" in dims:
+            for match in self._numbers.finditer(text):
+                value = {
+                    "value": number_value(to_number(match.group("number"))),
+                    "type": "value",
+                }
+                matches.append((match.start(), match.end(), "number", value))
+
+        # like Duckling, only keep the longest of overlapping entities
+        entities = []
+        end = -1
+        for start, stop, dim, value in sorted(matches, key=lambda m: (m[0], -m[1])):
+            if start < end:
+                continue
+            end = stop
+            entities.append(
+                {
+                    "body": text[start:stop],
+                    "start": start,
+                    "end": stop,
+                    "dim": dim,
+                    "latent": False,
+                    "value": value,
+                }
+            )
+        return entities
+
+    @staticmethod
+    def _localize(value: Dict[Text, Any], timezone: Any) -> Dict[Text, Any]:
+        """Formats the naive times of a resolved time like Duckling does."""
+
+        def time_value(time: datetime, grain: Text) -> Dict[Text, Any]:
+            local = timezone.localize(time)
+            offset = local.strftime("%z")
+            return {
+                "value": local.strftime("%Y-%m-%dT%H:%M:%S.000")
+                + f"{offset[:3]}:{offset[3:]}",
+                "grain": grain,
+            }
+
+        if "from" in value:
+            interval = {
+                "from": time_value(*value["from"]),
+                "to": time_value(*value["to"]),
+                "type": "interval",
+            }
+            return {"values": [interval], **interval}
+        single = {**time_value(value["value"], value["grain"]), "type": "value"}
+        return {"values": [single], **single}
+
+    @staticmethod
+    def _unit(match: Match) -> Tuple[int, Text]:
+        return int(to_number(match.group("number"))), match.group("unit").lower()
+
+    def _last_n(self, match: Match, now: datetime) -> Dict[Text, Any]:
+        number, grain = self._unit(match)
+        end = truncate(now, grain)
+        return {"from": (shift(end, grain, -number), grain), "to": (end, grain)}
+
+    def _next_n(self, match: Match, now: datetime) -> Dict[Text, Any]:
+        number, grain = self._unit(match)
+        start = shift(truncate(now, grain), grain, 1)
+        return {"from": (start, grain), "to": (shift(start, grain, number), grain)}
+
+    def _ago(self, match: Match, now: datetime) -> Dict[Text, Any]:
+        number, grain = self._unit(match)
+        return {"value": shift(truncate(now, grain), grain, -number), "grain": grain}
+
+    def _in(self, match: Match, now: datetime) -> Dict[Text, Any]:
+        number, grain = self._unit(match)
+        if GRAINS.index(grain) < GRAINS.index("day"):
+            # "in 2 hours" is a precise time
+            return {
+                "value": shift(truncate(now, "second"), grain, number),
+                "grain": "second",
+            }
+        return {"value": shift(truncate(now, grain), grain, number), "grain": grain}
+
+    @staticmethod
+    def _relative(match: Match, now: datetime) -> Dict[Text, Any]:
+        which = match.group("which").lower()
+        grain = match.group("unit").lower()
+        offset = {"last": -1, "past": -1, "previous": -1, "next": 1, "coming": 1}
+        return {
+            "value": shift(truncate(now, grain), grain, offset.get(which, 0)),
+            "grain": grain,
+        }
+
+    @staticmethod
+    def _day(match: Match, now: datetime) -> Dict[Text, Any]:
+        offset = {"yesterday": -1, "today": 0, "tomorrow": 1}[
+            match.group("day").lower()
+        ]
+        return {"value": truncate(now, "day") + timedelta(days=offset), "grain": "day"}
+
+    @staticmethod
+    def _now(match: Match, now: datetime) -> Dict[Text, Any]:
+        return {"value": truncate(now, "second"), "grain": "second"}
+
+    @staticmethod
+    def _date(match: Match, now: datetime) -> Optional[Dict[Text, Any]]:
+        try:
+            value = datetime(*(int(match.group(g)) for g in ("year", "month", "day")))
+        except ValueError:
+            return None
+        return {"value": value, "grain": "day"}
+
+    @staticmethod
+    def _month_number(match: Match) -> int:
+        name = match.group("month").lower().rstrip(".")
+        return next(i for i, month in enumerate(MONTHS, 1) if month.startswith(name))
+
+    def _month_day(self, match: Match, now: datetime) -> Optional[Dict[Text, Any]]:
+        month = self._month_number(match)
+        year = int(match.group("year") or now.year)
+        try:
+            value = datetime(year, month, int(match.group("day")))
+        except ValueError:
+            return None
+        if not match.group("year") and value < truncate(now, "day"):
+            value = value.replace(year=year + 1)
+        return {"value": value, "grain": "day"}
+
+    def _month(self, match: Match, now: datetime) -> Optional[Dict[Text, Any]]:
+        month = self._month_number(match)
+        which = (match.group("which") or "").strip().lower()
+        if match.group("month").lower() == "may" and not (
+            which
+            or match.group("year")
+            or match.group(0).lower().startswith(("in ", "of ", "during "))
+        ):
+            # "may" is a month only when it obviously refers to one
+            return None
+        if match.group("year"):
+            return {
+                "value": datetime(int(match.group("year")), month, 1),
+                "grain": "month",
+            }
+        value = datetime(now.year, month, 1)
+        if which == "last":
+            if value >= truncate(now, "month"):
+                value = value.replace(year=now.year - 1)
+        elif which == "next":
+            if value <= truncate(now, "month"):
+                value = value.replace(year=now.year + 1)
+        elif value < truncate(now, "month"):
+            # the upcoming one
+            value = value.replace(year=now.year + 1)
+        return {"value": value, "grain": "month"}
+
+    @staticmethod
+    def _weekday(match: Match, now: datetime) -> Dict[Text, Any]:
+        weekday = WEEKDAYS.index(match.group("weekday").lower())
+        which = (match.group("which") or "").strip().lower()
+        today = truncate(now, "day")
+        days = (weekday - today.weekday()) % 7
+        if which == "last":
+            days = days - 7 if days else -7
+        elif which == "next" and days == 0:
+            days = 7
+        return {"value": today + timedelta(days=days), "grain": "day"}
+
+    @staticmethod
+    def _clock(match: Match, now: datetime) -> Optional[Dict[Text, Any]]:
+        hour = int(match.group("hour"))
+        minute = int(match.group("minute") or 0)
+        if not 1 <= hour <= 12 or minute > 59:
+            return None
+        if match.group("ampm").lower().startswith("p"):
+            hour = hour % 12 + 12
+        else:
+            hour = hour % 12
+        value = truncate(now, "day").replace(hour=hour, minute=minute)
+        if value < truncate(now, "minute"):
+            value += timedelta(days=1)
+        return {"value": value, "grain": "minute" if match.group("minute") else "hour"}
+
+
+_parser: Optional[StandinParser] = None
+
+
+def parse(
+    text: Text,
+    reftime: datetime,
+    dims: Optional[Iterable[Text]] = None,
+    tz: Optional[Text] = None,
+) -> List[Dict[Text, Any]]:
+    """Parses a text with the shared `StandinParser`, see `StandinParser.parse`."""
+    global _parser
+    if _parser is None:
+        _parser = StandinParser()
+    return _parser.parse(text, reftime, dims, tz)
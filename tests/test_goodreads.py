@@ -0,0 +1,59 @@
+import asyncio
+
+from actions.api.goodreads import SEARCH_PAGE_SIZE, BookSearch
+
+
+class FakeSearchClient(object):
+    """Answers the pages of a search, the middle one short as Goodreads does."""
+
+    def __init__(self, page_sizes, total):
+        self.pages = {}
+        for number, size in enumerate(page_sizes, start=1):
+            first = (number - 1) * SEARCH_PAGE_SIZE
+            self.pages[number] = [{"id": first + i} for i in range(size)]
+        self.total = total
+        self.requested = []
+
+    async def search_page(self, query, search_field="all", page=1):
+        self.requested.append(page)
+        return {"books": self.pages.get(page, []), "total": self.total}
+
+
+async def take(search, count):
+    try:
+        return await search.take(count)
+    finally:
+        search.close()
+
+
+def test_short_middle_page_is_not_the_end_of_the_search():
+    client = FakeSearchClient([SEARCH_PAGE_SIZE, 15, 5], total=45)
+    search = BookSearch(client, "query")
+
+    books = asyncio.run(take(search, 100))
+
+    expected = [book["id"] for page in (1, 2, 3) for book in client.pages[page]]
+    assert [book["id"] for book in books] == expected
+    assert sorted(set(client.requested)) == [1, 2, 3]
+
+
+def test_search_continues_after_a_short_page():
+    client = FakeSearchClient([15, SEARCH_PAGE_SIZE], total=40)
+    search = BookSearch(client, "query", prefetch=False)
+
+    first = asyncio.run(take(search, 15))
+    rest = BookSearch(client, "query", start=search.position, prefetch=False)
+    second = asyncio.run(take(rest, 5))
+
+    assert [book["id"] for book in first] == list(range(15))
+    assert [book["id"] for book in second] == list(range(20, 25))
+    assert rest.position == 25
+
+
+def test_search_skips_past_a_stale_offset():
+    client = FakeSearchClient([15, SEARCH_PAGE_SIZE], total=40)
+    search = BookSearch(client, "query", start=17, prefetch=False)
+
+    books = asyncio.run(take(search, 3))
+
+    assert [book["id"] for book in books] == [20, 21, 22]
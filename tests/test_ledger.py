@@ -0,0 +1,55 @@
+import asyncio
+
+from rasa_sdk import Tracker
+from rasa_sdk.events import FollowupAction, Restarted, SlotSet
+from rasa_sdk.executor import CollectingDispatcher
+
+from actions.actions import ActionSessionStart, ActionShowBalance
+from actions.ledger import LEDGER_SLOT, MAX_ACCOUNTS, ledger
+
+SENDER_ID = "test-ledger-eviction"
+DOMAIN = {"session_config": {"carry_over_slots_to_new_session": True}}
+
+
+def make_tracker(slots):
+    return Tracker.from_dict(
+        {
+            "sender_id": SENDER_ID,
+            "slots": slots,
+            "latest_message": {"text": "", "entities": []},
+            "events": [],
+            "paused": False,
+            "followup_action": None,
+            "active_loop": {},
+            "latest_action_name": "action_listen",
+        }
+    )
+
+
+def run(action, slots):
+    dispatcher = CollectingDispatcher()
+    events = asyncio.run(action.run(dispatcher, make_tracker(slots), DOMAIN))
+    return dispatcher.messages, events
+
+
+def test_account_evicted_mid_conversation_restarts_the_session():
+    _, events = run(ActionSessionStart(), {})
+    slots = {e["name"]: e["value"] for e in events if e["event"] == "slot"}
+    assert slots[LEDGER_SLOT] in ledger
+
+    messages, events = run(ActionShowBalance(), slots)
+    assert [m["template"] for m in messages] == ["utter_account_balance"]
+
+    # other conversations push the account out of the ledger
+    for number in range(MAX_ACCOUNTS):
+        ledger.open_account(f"{SENDER_ID}-{number}")
+    assert slots[LEDGER_SLOT] not in ledger
+
+    messages, events = run(ActionShowBalance(), slots)
+    assert [m["template"] for m in messages] == ["utter_account_lost"]
+    assert events == [Restarted(), FollowupAction("action_session_start")]
+
+    # the restarted session opens a new account
+    _, events = run(ActionSessionStart(), {})
+    assert SlotSet(LEDGER_SLOT, slots[LEDGER_SLOT]) in events
+    assert slots[LEDGER_SLOT] in ledger